@@ -6,7 +6,7 @@ import ptspy.utilities.dataHandler as dh
 
 def main(args):
 	allData = dh.getAllData(args.configFile)
-	particleList = sm.startSimulation(allData)
+	particleList = sm.startSimulation(allData,resume=args.resume)
 	pl.plotData(allData,particleList)
 
 if __name__ == "__main__":
@@ -0,0 +1,21 @@
+import ptspy.simulator.simulator as sm
+import ptspy.utilities.dataHandler as dh
+from ptspy.utilities.parse import parseArgs
+
+def main(args=None):
+    """Runs the simulation of a config file (the ptspy console command), then the plots it asks for
+
+    The plotting code, and matplotlib with it, is only imported if a plot is drawn, so headless runs
+    (--headless, or plot_data.plotTrajectory and plotFields "False") start up with NumPy alone.
+    """
+    if args is None:
+        args = parseArgs()
+    allData = dh.getAllData(args.configFile)
+    particleList = sm.startSimulation(allData,resume=args.resume)
+    p = allData["plot"]
+    if not args.headless and (p.plotTrajectory or p.plotFields):
+        from ptspy.plot import plotter
+        plotter.plotData(allData,particleList)
+
+if __name__ == "__main__":
+    main(parseArgs())
@@ -0,0 +1,7 @@
+from syntheticField import syntheticFieldData
+from syntheticField import syntheticParticleData
+from syntheticField import writeSyntheticField
+from syntheticField import writeSyntheticParticles
+from syntheticField import syntheticConfig
+from benchmark import runCase
+from benchmark import runSweep
@@ -0,0 +1,29 @@
+import argparse
+from ptspy.bench.benchmark import runSweep
+from ptspy.bench.benchmark import writeReport
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description="Benchmarks ptspy on synthetic Poiseuille + grad(|E|^2) bump fields.")
+    parser.add_argument("--output", type=str, default="bench.json", help="JSON report file.")
+    parser.add_argument("--workDirectory", type=str, default="bench_data", help="Directory for the generated fields.")
+    parser.add_argument("--particles", type=int, nargs="+", default=[10,100,1000], help="Particle counts.")
+    parser.add_argument("--grids", type=str, nargs="+", default=["50x15","200x60","800x240"], help="Grid sizes NXxNY.")
+    parser.add_argument("--steps", type=int, nargs="+", default=[100,1000], help="Step counts.")
+    parser.add_argument("--dt", type=float, default=7.5e-4, help="Time step.")
+    parser.add_argument("--integrator", type=str, default="rk2", help="time_data.integrator of the simulation.")
+    parser.add_argument("--workers", type=int, default=1, help="Simulation processes.")
+    parser.add_argument("--noPlot", action="store_true", help="Skip the headless plot stage.")
+    return parser.parse_args()
+
+def main(args):
+    gridSizes = [tuple(int(n) for n in grid.split('x')) for grid in args.grids]
+    report = runSweep(args.workDirectory,args.particles,gridSizes,args.steps,args.dt,args.integrator,
+                      args.workers,not args.noPlot)
+    writeReport(report,args.output)
+    for case in report["cases"]:
+        print "%4dx%-4d %6d particles %6d steps: %10.0f particle steps/sec, peak RSS %6.1f MB" % (
+            case["nx"],case["ny"],case["particles"],case["steps"],
+            case["simulation"]["particleStepsPerSec"],case["peakRSS"]/2.**20)
+
+if __name__ == "__main__":
+    main(parseArgs())
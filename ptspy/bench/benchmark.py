@@ -0,0 +1,176 @@
+import json
+import platform
+import resource
+import sys
+import traceback
+from copy import deepcopy
+from multiprocessing import Process
+from multiprocessing import Queue
+from os import makedirs
+from os.path import isdir
+from os.path import join
+from Queue import Empty
+from timeit import default_timer
+
+import numpy
+from numpy import random
+
+from ptspy.bench.syntheticField import syntheticConfig
+from ptspy.bench.syntheticField import writeSyntheticField
+from ptspy.bench.syntheticField import writeSyntheticParticles
+from ptspy.utilities import dataHandler
+from ptspy.simulator import simulator
+
+def peakRSS():
+    """Returns the peak resident set size of this process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on OS X
+    return peak if sys.platform == 'darwin' else peak*1024
+
+def timed(function,*args,**kwargs):
+    """Returns (seconds,result) of one call of function"""
+    start = default_timer()
+    result = function(*args,**kwargs)
+    return default_timer()-start, result
+
+def benchLoad(fieldFile,config):
+    """Times the text parse (dataFromFile), the processed field load without and with the binary cache"""
+    config = deepcopy(config)
+    parse, fieldData = timed(dataHandler.dataFromFile,fieldFile)
+    config["config"]["cacheFieldData"] = "False"
+    vectorField, _ = timed(dataHandler.getVectorFieldData,fieldFile,config)
+    config["config"]["cacheFieldData"] = "True"
+    cacheWrite, _ = timed(dataHandler.getFieldGrid,fieldFile,config)
+    cacheRead, _ = timed(dataHandler.getFieldGrid,fieldFile,config)
+    return {"nodes":len(fieldData),"dataFromFile":parse,"getVectorFieldData":vectorField,
+            "getFieldGridCacheWrite":cacheWrite,"getFieldGridCached":cacheRead}
+
+def benchInterpolation(integrator,samples,seed=0):
+    """Times buildNearestIndexes+interpolate point by point and batched for samples random points in the grid"""
+    BI = integrator.BI
+    state = random.RandomState(seed)
+    points = numpy.array([state.uniform(BI.X.minValue,BI.X.maxValue,samples),
+                          state.uniform(BI.Y.minValue,BI.Y.maxValue,samples)]).T
+    def scalar():
+        for point in points:
+            BI.interpolate(point=point,indexList=BI.buildNearestIndexes(point),fieldName='velocity')
+    def batch():
+        BI.interpolateAllBatch(points,BI.buildNearestIndexesBatch(points))
+    scalarTime, _ = timed(scalar)
+    batchTime, _ = timed(batch)
+    return {"samples":samples,"scalar":scalarTime,"batch":batchTime,
+            "scalarPointsPerSec":samples/scalarTime,"batchPointsPerSec":samples/batchTime}
+
+def benchParticle(integrator,particle,steps):
+    """Times RungeKuttaIntegrator.particle for one particle over steps steps"""
+    particle = deepcopy(particle)
+    def run():
+        for step in range(steps):
+            particle.position = integrator.particle(particle)
+    seconds, _ = timed(run)
+    return {"steps":steps,"seconds":seconds,"stepsPerSec":steps/seconds}
+
+def benchSimulation(allData,workers=1):
+    """Times a full startSimulation"""
+    numberOfSteps = len(allData["time"].stepList())
+    numberOfParticles = len(allData["particleList"])
+    seconds, particleList = timed(simulator.startSimulation,allData,workers)
+    return {"steps":numberOfSteps,"particles":numberOfParticles,"workers":workers,"seconds":seconds,
+            "stepsPerSec":numberOfSteps/seconds,"particleStepsPerSec":numberOfSteps*numberOfParticles/seconds}
+
+def benchPlot(allData,particleList):
+    """Times plotter.plotData with the Agg backend (nothing is shown)"""
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+    from ptspy.plot import plotter
+    seconds, _ = timed(plotter.plotData,allData,particleList)
+    plt.close('all')
+    return {"seconds":seconds}
+
+def runCase(workDirectory,nx,ny,particles,steps,dt=7.5e-4,integrator="rk2",workers=1,
+            interpolationSamples=10000,particleSteps=1000,plot=True):
+    """Generates a synthetic case in workDirectory and times every stage, returns a dictionary of the results
+    
+    Args:
+        workDirectory : string of the directory for the generated files
+        nx, ny : integers of grid points
+        particles : integer of particles
+        steps : integer of integration steps
+        dt : time step (defaults to 7.5e-4)
+        integrator : time_data.integrator (defaults to "rk2")
+        workers : integer of simulation processes (defaults to 1)
+        interpolationSamples : integer of points for the interpolation stage (defaults to 10000)
+        particleSteps : integer of steps for the single particle stage (defaults to 1000)
+        plot : bool, time the headless plot (defaults to True)
+    """
+    if not isdir(workDirectory):
+        makedirs(workDirectory)
+    name = 'grid%dx%d_particles%d' % (nx,ny,particles)
+    fieldFile = join(workDirectory,name+'_field.csv')
+    particleFile = join(workDirectory,name+'_particles.csv')
+    writeSyntheticField(fieldFile,nx,ny)
+    writeSyntheticParticles(particleFile,particles)
+    config = syntheticConfig(fieldFile,particleFile,steps,dt,integrator,workers)
+
+    result = {"nx":nx,"ny":ny,"particles":particles,"steps":steps,"dt":dt,"integrator":integrator}
+    result["load"] = benchLoad(fieldFile,config)
+    allData = dataHandler.setupData(config)
+    rk2 = simulator.buildIntegrator(dict(allData,integrator="rk2",events={}))
+    result["interpolation"] = benchInterpolation(rk2,interpolationSamples)
+    result["particle"] = benchParticle(rk2,allData["particleList"][0],particleSteps)
+    result["simulation"] = benchSimulation(allData,workers)
+    if plot:
+        result["plot"] = benchPlot(allData,allData["particleList"])
+    result["peakRSS"] = peakRSS()
+    return result
+
+def runCaseProcess(kwargs,results):
+    """Runs runCase in a child process, puts (result,None) or (None,traceback) on the results Queue"""
+    try:
+        results.put((runCase(**kwargs),None))
+    except Exception:
+        results.put((None,traceback.format_exc()))
+
+def runCaseInProcess(kwargs):
+    """Returns the runCase result of kwargs, run in a fresh process
+    
+    The process isn't a daemon (unlike Pool workers), so cases with workers > 1 can start the simulation's own Pool.
+    Raises RuntimeError if the case fails or its process dies.
+    """
+    results = Queue()
+    process = Process(target=runCaseProcess,args=(kwargs,results))
+    process.start()
+    try:
+        while True:
+            try:
+                result, error = results.get(timeout=1.)
+                break
+            except Empty:
+                if not process.is_alive() and results.empty():
+                    raise RuntimeError("benchmark case process exited with code %s" % process.exitcode)
+    finally:
+        process.join()
+    if error is not None:
+        raise RuntimeError("benchmark case failed\n%s" % error)
+    return result
+
+def runSweep(workDirectory,particleCounts=(10,100,1000),gridSizes=((50,15),(200,60),(800,240)),
+             stepCounts=(100,1000),dt=7.5e-4,integrator="rk2",workers=1,plot=True):
+    """Runs every combination of particle count, grid size and step count, each in a fresh process
+    
+    Every case runs in its own process so peakRSS is the peak of that case alone.
+    Returns a dictionary with the environment and the list of case results (see runCase).
+    """
+    cases = []
+    for nx,ny in gridSizes:
+        for particles in particleCounts:
+            for steps in stepCounts:
+                kwargs = {"workDirectory":workDirectory,"nx":nx,"ny":ny,"particles":particles,"steps":steps,
+                          "dt":dt,"integrator":integrator,"workers":workers,"plot":plot}
+                cases.append(runCaseInProcess(kwargs))
+    return {"python":platform.python_version(),"numpy":numpy.__version__,"platform":platform.platform(),
+            "cases":cases}
+
+def writeReport(report,fileName):
+    with open(fileName,'w') as outFile:
+        json.dump(report,outFile,indent=1,sort_keys=True)
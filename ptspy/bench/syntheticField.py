@@ -0,0 +1,100 @@
+from numpy import array
+from numpy import exp
+from numpy import linspace
+from numpy import meshgrid
+from numpy import pi
+from numpy import random
+from numpy import zeros
+
+def syntheticFieldData(nx,ny,width=300e-6,height=100e-6,meanVelocity=2e-3,bumpAmplitude=3e9,bumpWidth=20e-6):
+    """Returns a uniform grid field of shape (nx*ny,6) with columns x,y,u,v,gradE2x,gradE2y (same layout as a COMSOL export)
+    
+    The flow is plane Poiseuille flow in X, u = 1.5*meanVelocity*(1-(2y/height-1)^2), and |E|^2 is a gaussian
+    bump of bumpAmplitude centred on the bottom wall at width/2, so its gradient is known analytically.
+    Grid points are cell centred like the example field.
+    
+    Args:
+        nx : integer of grid points in X
+        ny : integer of grid points in Y
+        width, height : channel size in m (defaults to 300um x 100um)
+        meanVelocity : mean flow velocity in m/s (defaults to 2e-3)
+        bumpAmplitude : peak |E|^2 in V^2/m^2 (defaults to 3e9)
+        bumpWidth : standard deviation of the bump in m (defaults to 20e-6)
+    """
+    x = linspace(0,width,nx,endpoint=False)+width/(2.*nx)
+    y = linspace(0,height,ny,endpoint=False)+height/(2.*ny)
+    X, Y = meshgrid(x,y)
+    X, Y = X.ravel(), Y.ravel()
+    U = 1.5*meanVelocity*(1-(2*Y/height-1)**2)
+    ESquared = bumpAmplitude*exp(-((X-width/2.)**2+Y**2)/(2*bumpWidth**2))
+    gradE2X = -(X-width/2.)/bumpWidth**2*ESquared
+    gradE2Y = -Y/bumpWidth**2*ESquared
+    return array([X,Y,U,zeros(len(X)),gradE2X,gradE2Y]).T
+
+def syntheticParticleData(numberOfParticles,width=300e-6,height=100e-6,radius=5e-6,density=1100,seed=0):
+    """Returns particle rows x,y,vx,vy,ax,ay,radius,density,mass,depFactor of shape (numberOfParticles,10)
+    
+    Particles start at rest near the inlet at random heights, the depFactor alternates between 0.5 and -0.5.
+    
+    Args:
+        numberOfParticles : integer of particles
+        width, height : channel size in m (defaults to 300um x 100um)
+        radius : particle radius in m (defaults to 5e-6)
+        density : particle density in kg/m^3 (defaults to 1100)
+        seed : integer seed of the random heights (defaults to 0)
+    """
+    state = random.RandomState(seed)
+    particles = zeros((numberOfParticles,10))
+    particles[:,0] = 0.02*width
+    particles[:,1] = state.uniform(0.1*height,0.9*height,numberOfParticles)
+    particles[:,6] = radius
+    particles[:,7] = density
+    particles[:,8] = density*4/3.*pi*radius**3
+    particles[:,9] = 0.5
+    particles[1::2,9] = -0.5
+    return particles
+
+def writeSyntheticField(fileName,nx,ny,**kwargs):
+    """Writes syntheticFieldData to a comma separated file readable by dataHandler.dataFromFile"""
+    writeRows(fileName,syntheticFieldData(nx,ny,**kwargs),
+              ['% Context, Synthetic Poiseuille flow and gaussian grad(|E|^2) bump','% Nodes,'+str(nx*ny),
+               '% x,y,u (m/s),v (m/s),d(normE^2,x),d(normE^2,y)'])
+
+def writeSyntheticParticles(fileName,numberOfParticles,**kwargs):
+    """Writes syntheticParticleData to a comma separated file readable by dataHandler.dataFromFile"""
+    writeRows(fileName,syntheticParticleData(numberOfParticles,**kwargs),
+              ['% x,y,vx,vy,ax,ay,radius,density,mass,depFactor'])
+
+def writeRows(fileName,rows,header):
+    with open(fileName,'w') as outFile:
+        outFile.write('\n'.join(header)+'\n')
+        for row in rows:
+            outFile.write(','.join('%.17g' % value for value in row)+'\n')
+
+def syntheticConfig(fieldFile,particleFile,steps,dt=7.5e-4,integrator="rk2",workers=1,cacheFieldData="False"):
+    """Returns a config dictionary (same sections as example/Basic DEP/config.json) for a synthetic case
+    
+    Args:
+        fieldFile : string of the field file
+        particleFile : string of the particle file
+        steps : integer of integration steps
+        dt : time step (defaults to 7.5e-4)
+        integrator : time_data.integrator (defaults to "rk2")
+        workers : integer of simulation processes (defaults to 1)
+        cacheFieldData : "True" or "False" (defaults to "False")
+    """
+    return {
+        "config":{"multiplyFieldX":0,"repeatX":"False","repeatY":"False","interpolation":"bilinear",
+                  "workers":workers,"cacheFieldData":cacheFieldData},
+        "file_locations":{"vectorFieldFile":fieldFile,"particleFile":particleFile},
+        "output_data":{"trajectoryDirectory":"","blockSize":100},
+        "plot_data":{"plotTrajectory":"True","plotFields":"False","scaleX":1,"scaleY":0.5},
+        "electrode_data":{"voltageScale":5},
+        "time_data":{"start":0,"stop":steps*dt,"step":dt,"recordStride":1,"integrator":integrator,
+                     "rtol":1e-6,"atol":[1e-9,1e-9]},
+        "physicalConstants_data":{"gravitationalAcceleration":[0,-9.8],"boltzmannConstant":1.38e-23,
+                                  "vacuumPermittivity":8.85e-12},
+        "forces_data":{"includeGravitational":"False","includeBuoyant":"False","includeDEP":"True",
+                       "includeStokes":"True"},
+        "fluid_data":{"density":1001,"viscosity":0.001,"relativePermittivity":81,"name":"water",
+                      "scaleX":1,"scaleY":1}}
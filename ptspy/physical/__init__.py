@@ -1,4 +1,6 @@
 from fluid import Fluid
 from particle import Particle
+from particleEnsemble import ParticleEnsemble
 from physicalConstants import PhysicalConstants
-from forces import Forces
\ No newline at end of file
+from forces import Forces
+from forceModel import ForceModel
\ No newline at end of file
@@ -0,0 +1,99 @@
+from copy import copy
+from numpy import newaxis
+from numpy import pi
+from numpy import zeros_like
+
+class ForceModel:
+    """Batched forces of one run, compiled once from the Forces flags into per-particle coefficient columns (SI units).
+
+    Only the enabled terms are kept, a disabled force costs nothing per step:
+
+        acceleration = (drag*(fluidVelocity-velocity) + DEPCoefficient*gradE2 + weight)/mass
+
+    with drag = 6*pi*viscosity*radius, DEPCoefficient = 2*pi*CMFactor*relativePermittivity*vacuumPermittivity*radius**3
+    and weight = mass*gravitationalAcceleration (gravitational) - volume*fluid.density*gravitationalAcceleration (buoyant).
+    The coefficients are multiplied in the same order as Forces.stokes and Forces.DEP, so the results match them exactly.
+
+    Attributes:
+        velocity, Efield : slices of the 'velocity' and 'Efield' channels in the sampled fields
+        mass : column array of shape (N,1)
+        drag : column array of shape (N,1), None if stokes is disabled
+        DEPCoefficient : column array of shape (N,1), None if DEP is disabled
+        mobility : column array CMFactor*relativePermittivity*vacuumPermittivity*radius**2 of shape (N,1),
+                   the DEP drift velocity is mobility*gradE2*inverseViscosity3 (None if DEP is disabled)
+        inverseViscosity3 : 1/(3*viscosity)
+        weight : array of shape (N,D) of the gravitational and buoyant forces, None if both are disabled
+        settlingVelocity : array of shape (N,D) of weight/(6*pi*viscosity*radius), None if both are disabled
+    """
+    # Per-particle coefficient arrays, compacted by select
+    coefficientNames = ['mass','drag','DEPCoefficient','mobility','weight','settlingVelocity']
+
+    def __init__(self,forces,fluid,channels,radius,mass,DEPFactor,dimensions=2):
+        """
+        Args:
+            forces : Forces object with the include flags
+            fluid : Fluid object
+            channels : dictionary of field name to its slice of the sampled fields (eg. BilinearInterpolation.channels)
+            radius, mass, DEPFactor : numpy.arrays of shape (N,)
+            dimensions : integer of the spatial dimensions (defaults to 2)
+        """
+        radius = radius[:,newaxis]
+        self.velocity = channels['velocity']
+        self.Efield = channels['Efield']
+        self.mass = mass[:,newaxis]
+        self.inverseViscosity3 = (fluid.viscosity*3)**-1
+        self.drag = 6*pi*fluid.viscosity*radius if forces.includeStokes else None
+        self.DEPCoefficient, self.mobility = None, None
+        if forces.includeDEP:
+            relativePermittivity, vacuumPermittivity = fluid.relativePermittivity, forces.vacuumPermittivity
+            self.DEPCoefficient = (2*pi*DEPFactor[:,newaxis]*relativePermittivity*vacuumPermittivity)*(radius**3)
+            self.mobility = DEPFactor[:,newaxis]*relativePermittivity*vacuumPermittivity*(radius**2)
+        self.weight, self.settlingVelocity = None, None
+        if forces.includeGravitational or forces.includeBuoyant:
+            g = forces.gravitationalAcceleration
+            if len(g) != dimensions:
+                raise ValueError("gravitationalAcceleration needs %d components for a %dD run" % (dimensions,dimensions))
+            self.weight = (self.mass*forces.includeGravitational-(4/3.)*pi*radius**3*fluid.density*forces.includeBuoyant)*g
+            self.settlingVelocity = self.weight/(6*pi*fluid.viscosity*radius)
+
+    def select(self,indexes):
+        """Returns a ForceModel of the particles at indexes (eg. the active particles)"""
+        model = copy(self)
+        for name in self.coefficientNames:
+            if getattr(self,name) is not None:
+                setattr(model,name,getattr(self,name)[indexes])
+        return model
+
+    def acceleration(self,positions,velocities,sampledFields):
+        """Returns the acceleration of shape (N,D) of every particle
+
+        Args:
+            positions : numpy.array of shape (N,D) where the fields were sampled
+            velocities : numpy.array of shape (N,D) of the particle velocities
+            sampledFields : numpy.array of shape (N,C) of the stacked field channels at positions
+        """
+        terms = []
+        if self.drag is not None:
+            terms.append(self.drag*(sampledFields[:,self.velocity]-velocities))
+        if self.DEPCoefficient is not None:
+            terms.append(self.DEPCoefficient*sampledFields[:,self.Efield])
+        if self.weight is not None:
+            terms.append(self.weight)
+        if not terms:
+            return zeros_like(velocities)
+        sumForces = terms[0]
+        for term in terms[1:]:
+            sumForces = sumForces+term
+        return sumForces/self.mass
+
+    def terminalVelocity(self,sampledFields):
+        """Returns the local terminal velocity of shape (N,D), where the stokes drag balances DEP, gravity and buoyancy
+
+        terminalVelocity = fluidVelocity + mobility*gradE2/(3*viscosity) + settlingVelocity
+        """
+        terminalVelocity = sampledFields[:,self.velocity]
+        if self.mobility is not None:
+            terminalVelocity = (self.mobility*sampledFields[:,self.Efield]*self.inverseViscosity3)+terminalVelocity
+        if self.settlingVelocity is not None:
+            terminalVelocity = terminalVelocity+self.settlingVelocity
+        return terminalVelocity
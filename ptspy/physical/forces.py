@@ -1,26 +1,27 @@
 from numpy import array
 from numpy import pi
+from ptspy.physical.forceModel import ForceModel
 
 class Forces:
     def __init__(self,physicalConstants,includeGravitational,includeStokes,includeBuoyant,includeDEP):
         self.physicalConstants = physicalConstants
         self.vacuumPermittivity = physicalConstants.vacuumPermittivity
+        self.gravitationalAcceleration = array(physicalConstants.gravitationalAcceleration,dtype=float)
         self.includeGravitational = includeGravitational == "True"
         self.includeStokes = includeStokes == "True"
         self.includeBuoyant = includeBuoyant == "True"
         self.includeDEP = includeDEP == "True"
         
-    def sumForces(self):
-        forceList = []
-        if self.includeGravitational:
-            forceList.append(self.gravitational())
-        if self.includeStokes:
-            forceList.append(self.stokes())
-        if self.includeBuoyant:
-            forceList.append(self.buoyant())                    
-        if self.includeDEP:
-            forceList.append(self.DEP())
-        pass
+    def compile(self,fluid,channels,ensemble):
+        """Returns the ForceModel of the enabled forces for the particles of a ParticleEnsemble
+        
+        Args:
+            fluid : Fluid object
+            channels : dictionary of field name to its slice of the sampled fields
+            ensemble : ParticleEnsemble object
+        """
+        return ForceModel(self,fluid,channels,ensemble.radius,ensemble.mass,ensemble.DEPFactor,
+                          ensemble.positions.shape[1])
         
     def gravitational(self,mass=1):
         """The gravitational force 
@@ -54,7 +55,7 @@ class Forces:
         Args:
             radius : radius of the particle (default to 1)
         """
-        return ((-self.gravitationalAcceleration)*((pi)*(4/3)*(radius**3))*(density))*(self.includeBuoyant)
+        return ((-self.gravitationalAcceleration)*((pi)*(4/3.)*(radius**3))*(density))*(self.includeBuoyant)
         
     def DEP(self,CMFactor=1,relativePermittivity=81,radius=1,gradESquared=array([0,0])):
         """The dielectrophoresis (DEP) force
@@ -16,6 +16,9 @@ class Particle:
         velocityList : 2D numpy.array for particle's velocity during simulation time (numpy.array([[vx1,vx2,vx3,...],[vy1,vy2,vy3,...]])
         accelerationList : 2D numpy.array for particle's acceleration during simulation time (numpy.array([[ax1,ax2,ax3,...],[ay1,ay2,ay3,...]])
         repeatCnt : An integer used internally to keep track if particle went off screen and re-spawned at beginning
+        event : A string of the event that ended the particle's simulation ('none', 'exit', 'wall', 'capture' or 'stagnation')
+        eventTime : Time of the event (None if no event)
+        eventPosition : 2D numpy.array of the position of the event (None if no event)
     """
     def __init__(self,position=[0,0],velocity=[0,0],acceleration=[0,0],mass=1,radius=1,\
                  density=1,DEPFactor=1, name='particle'):
@@ -30,4 +33,7 @@ class Particle:
         self.positionList = array([[],[]])
         self.velocityList = array([[],[]])
         self.accelerationList = array([[],[]])
-        self.repeatCnt = 0
\ No newline at end of file
+        self.repeatCnt = 0
+        self.event = 'none'
+        self.eventTime = None
+        self.eventPosition = None
\ No newline at end of file
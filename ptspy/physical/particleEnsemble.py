@@ -0,0 +1,149 @@
+from numpy import array
+from numpy import concatenate
+from numpy import full
+from numpy import nan
+from numpy import zeros
+from ptspy.physical.particle import Particle
+
+class ParticleEnsemble:
+    """Struct-of-arrays container for N 2D or 3D particles (SI units).
+
+    Every per-particle quantity is stored as one numpy.array so the integrator can advance
+    all particles at once instead of looping over Particle objects. The number of
+    dimensions D is taken from the positions (2 if there are no particles).
+
+    Attributes:
+        positions : numpy.array of shape (N,D) for particle positions
+        velocities : numpy.array of shape (N,D) for particle velocities
+        accelerations : numpy.array of shape (N,D) for particle accelerations
+        radius : numpy.array of shape (N,) for particle radii
+        mass : numpy.array of shape (N,) for particle masses
+        density : numpy.array of shape (N,) for particle densities
+        DEPFactor : numpy.array of shape (N,) for particle Clausius-Mossotti factors
+        repeatCnt : numpy.array of shape (N,) used internally to count channel repeats
+        names : list of particle names
+        event : numpy.array of shape (N,) of event codes, an index into ParticleEnsemble.eventNames
+        eventTime : numpy.array of shape (N,) for event times (nan if no event)
+        eventPositions : numpy.array of shape (N,D) for event positions (nan if no event)
+    """
+    # Names of the events detected by simulator.EventDetector
+    eventNames = ['none','exit','wall','capture','stagnation']
+    
+    def __init__(self,positions,velocities,accelerations,radius,mass,density,DEPFactor,names=None):
+        self.positions = array(positions,dtype=float)
+        dimensions = self.positions.shape[-1] if self.positions.ndim == 2 else 2
+        self.positions = self.positions.reshape(-1,dimensions)
+        self.velocities = array(velocities,dtype=float).reshape(-1,dimensions)
+        self.accelerations = array(accelerations,dtype=float).reshape(-1,dimensions)
+        self.radius = array(radius,dtype=float).reshape(-1)
+        self.mass = array(mass,dtype=float).reshape(-1)
+        self.density = array(density,dtype=float).reshape(-1)
+        self.DEPFactor = array(DEPFactor,dtype=float).reshape(-1)
+        self.repeatCnt = zeros(len(self.positions),int)
+        self.event = zeros(len(self.positions),int)
+        self.eventTime = full(len(self.positions),nan)
+        self.eventPositions = full((len(self.positions),dimensions),nan)
+        if names is None:
+            names = ['particle'+str(i) for i in range(len(self.positions))]
+        self.names = list(names)
+
+    def __len__(self):
+        return len(self.positions)
+
+    @classmethod
+    def fromParticleList(cls,particleList):
+        """Builds an ensemble from a list of Particle objects
+
+        Args:
+            particleList : list of Particle objects
+        """
+        ensemble = cls(
+            positions = [p.position for p in particleList],
+            velocities = [p.velocity for p in particleList],
+            accelerations = [p.acceleration for p in particleList],
+            radius = [p.radius for p in particleList],
+            mass = [p.mass for p in particleList],
+            density = [p.density for p in particleList],
+            DEPFactor = [p.DEPFactor for p in particleList],
+            names = [p.name for p in particleList])
+        ensemble.repeatCnt[:] = [p.repeatCnt for p in particleList]
+        return ensemble
+
+    def select(self,indexes):
+        """Returns a new ParticleEnsemble holding copies of the particles at indexes
+        
+        Args:
+            indexes : numpy.array of integer particle indexes
+        """
+        ensemble = ParticleEnsemble(self.positions[indexes],self.velocities[indexes],self.accelerations[indexes],
+                                    self.radius[indexes],self.mass[indexes],self.density[indexes],self.DEPFactor[indexes],
+                                    [self.names[i] for i in indexes])
+        ensemble.repeatCnt[:] = self.repeatCnt[indexes]
+        ensemble.event[:] = self.event[indexes]
+        ensemble.eventTime[:] = self.eventTime[indexes]
+        ensemble.eventPositions[:] = self.eventPositions[indexes]
+        return ensemble
+    
+    def assign(self,indexes,ensemble):
+        """Writes the state of a (sub)ensemble back into the particles at indexes
+        
+        Args:
+            indexes : numpy.array of integer particle indexes
+            ensemble : ParticleEnsemble with len(indexes) particles
+        """
+        self.positions[indexes] = ensemble.positions
+        self.velocities[indexes] = ensemble.velocities
+        self.accelerations[indexes] = ensemble.accelerations
+        self.repeatCnt[indexes] = ensemble.repeatCnt
+        self.event[indexes] = ensemble.event
+        self.eventTime[indexes] = ensemble.eventTime
+        self.eventPositions[indexes] = ensemble.eventPositions
+        
+    def place(self,indexes,ensemble):
+        """Writes the particles of ensemble, properties and names included, into the slots at indexes (eg. injected particles)
+        
+        Args:
+            indexes : numpy.array of integer particle indexes
+            ensemble : ParticleEnsemble with len(indexes) particles
+        """
+        self.assign(indexes,ensemble)
+        self.radius[indexes] = ensemble.radius
+        self.mass[indexes] = ensemble.mass
+        self.density[indexes] = ensemble.density
+        self.DEPFactor[indexes] = ensemble.DEPFactor
+        for index,name in zip(indexes,ensemble.names):
+            self.names[index] = name
+        
+    def append(self,ensemble):
+        """Returns a new ParticleEnsemble holding copies of the particles of self followed by those of ensemble"""
+        joined = ParticleEnsemble(concatenate((self.positions,ensemble.positions)),concatenate((self.velocities,ensemble.velocities)),
+                                  concatenate((self.accelerations,ensemble.accelerations)),concatenate((self.radius,ensemble.radius)),
+                                  concatenate((self.mass,ensemble.mass)),concatenate((self.density,ensemble.density)),
+                                  concatenate((self.DEPFactor,ensemble.DEPFactor)),self.names+ensemble.names)
+        joined.repeatCnt[:] = concatenate((self.repeatCnt,ensemble.repeatCnt))
+        joined.event[:] = concatenate((self.event,ensemble.event))
+        joined.eventTime[:] = concatenate((self.eventTime,ensemble.eventTime))
+        joined.eventPositions[:] = concatenate((self.eventPositions,ensemble.eventPositions))
+        return joined
+        
+    def particles(self):
+        """Returns a new Particle object for every particle with its properties and name (see updateParticles for the state)"""
+        return [Particle(radius=self.radius[ind],mass=self.mass[ind],density=self.density[ind],
+                         DEPFactor=self.DEPFactor[ind],name=self.names[ind]) for ind in range(len(self))]
+        
+    def updateParticles(self,particleList):
+        """Copies the current ensemble state back into the matching Particle objects
+
+        Args:
+            particleList : list of Particle objects in the same order as the ensemble
+        """
+        for ind,particle in enumerate(particleList):
+            particle.position = self.positions[ind].copy()
+            particle.velocity = self.velocities[ind].copy()
+            particle.acceleration = self.accelerations[ind].copy()
+            particle.repeatCnt = int(self.repeatCnt[ind])
+            if self.event[ind] > 0:
+                particle.event = self.eventNames[self.event[ind]]
+                particle.eventTime = float(self.eventTime[ind])
+                particle.eventPosition = self.eventPositions[ind].copy()
+        return particleList
@@ -1,24 +1,133 @@
 import numpy.ma as ma
-from pylab import quiver
+from numpy import empty
+from numpy import floor
+from numpy import isnan
 from numpy import zeros
+from os.path import splitext
 
 class Plot:
-    def __init__(self,plotTrajectory=True,plotFields=True,scaleX=1,scaleY=1):
+    """Trajectory and vector field figures
+    
+    By default the trajectories are drawn as two LineCollections (DEPFactor < 0 in blue, otherwise red)
+    instead of one Line2D per particle, and every trajectory is decimated to screen resolution first,
+    so figures with thousands of particles stay fast and small.
+    matplotlib is only imported by the methods that draw, so building a Plot (eg. in dataHandler) doesn't load it.
+    
+    Attributes:
+        lineCollection : bool, batch the trajectories into LineCollections (False draws one line per particle)
+        decimation : "pixel" drops points closer than pixelTolerance (in screen pixels) to the previous kept point,
+                     "stride" keeps every k-th point so a trajectory has at most maxPoints, "none" keeps every point
+        pixelTolerance : float, size in pixels of the "pixel" decimation cells
+        maxPoints : integer, maximum points per trajectory for "stride" decimation (0 keeps every point)
+        quiverArrows : integer, maximum arrows per axis of the vector field plots (0 draws every node)
+        outputFile : string of the .png or .svg file the trajectory figure is saved to ('' doesn't save),
+                     the vector field figures are saved next to it with the field name appended
+        show : bool, show the figures (False renders with the Agg backend, eg. on headless machines)
+    """
+    def __init__(self,plotTrajectory=True,plotFields=True,scaleX=1,scaleY=1,lineCollection=True,decimation="pixel",
+                 pixelTolerance=0.5,maxPoints=0,quiverArrows=50,outputFile='',show=True):
         self.plotTrajectory = plotTrajectory
         self.plotFields = plotFields 
         self.scaleX = scaleX
         self.scaleY = scaleY
+        self.lineCollection = lineCollection
+        self.decimation = decimation
+        self.pixelTolerance = pixelTolerance
+        self.maxPoints = maxPoints
+        self.quiverArrows = quiverArrows
+        self.outputFile = outputFile
+        self.show = show
     
     def trajectory(self,plt,allData,particleList):
         if self.plotTrajectory:
-            lineList = self.buildPlot(plt,allData,particleList)
-            self.addData(lineList,particleList)
+            if self.lineCollection:
+                ax = self.buildAxes(plt,allData,particleList)
+                self.addCollections(ax,particleList,allData.get("trajectoryStore"))
+            else:
+                lineList = self.buildPlot(plt,allData,particleList)
+                self.addData(lineList,particleList,allData.get("trajectoryStore"))
+            self.save(plt.gcf())
+    
+    def addData(self,lineList,particleList,store=None):
+        """Sets the line data from Particle.positionList, or from store.particleView when a
+        TrajectoryStore/TrajectoryReader is given (trajectories streamed to disk are read lazily)"""
+        for ind,particle in enumerate(particleList):
+            if store is None:
+                lineList[ind].set_data(particle.positionList)
+            else:
+                lineList[ind].set_data(store.particleView(ind))
+    
+    def addCollections(self,ax,particleList,store=None):
+        """Adds the decimated trajectories to ax as one LineCollection per DEPFactor sign, returns the collections
         
-    def addData(self,lineList,particleList):        
+        Trajectories are read as in addData, one particle at a time, and only the decimated points are kept.
+        """
+        from matplotlib.collections import LineCollection
+        segments = {'b':[],'r':[]}
         for ind,particle in enumerate(particleList):
-            lineList[ind].set_data(particle.positionList)
+            positionList = particle.positionList if store is None else store.particleView(ind)
+            path = self.decimate(positionList[0:2].T,ax.transData)
+            segments['b' if particle.DEPFactor < 0 else 'r'].append(path)
+        collections = []
+        for color in ['r','b']:
+            if segments[color]:
+                collections.append(ax.add_collection(LineCollection(segments[color],colors=color)))
+        return collections
+    
+    def decimate(self,path,transform):
+        """Returns the points of a trajectory kept by self.decimation
         
-    def buildPlot(self,plt,allData,particleList):        
+        Args:
+            path : numpy.array of shape (T,2) of positions
+            transform : matplotlib transform from data to screen pixels (eg. ax.transData)
+        """
+        if len(path) < 3:
+            return path
+        if self.decimation == "stride" and self.maxPoints > 1 and len(path) > self.maxPoints:
+            keep = zeros(len(path),dtype=bool)
+            keep[::-(-(len(path)-1)//(self.maxPoints-1))] = True
+        elif self.decimation == "pixel":
+            # Consecutive points in the same screen cell are dropped, the drawn line stays within one cell diagonal
+            cells = floor(transform.transform(path)/self.pixelTolerance)
+            keep = empty(len(path),dtype=bool)
+            keep[0] = True
+            keep[1:] = (cells[1:] != cells[:-1]).any(axis=1)
+        else:
+            return path
+        keep[-1] = True
+        return path[keep]
+    
+    def frame(self,fig,limits,trails,negative,title):
+        """Draws one frame of a live view on fig, pyplot isn't used so frames can be drawn off the main thread
+        
+        Args:
+            fig : matplotlib Figure with a canvas (eg. FigureCanvasAgg)
+            limits : (xmin,xmax,ymin,ymax) of the axes
+            trails : numpy.array of shape (T,N,2) of the last recorded positions, oldest first (nan for empty slots)
+            negative : boolean numpy.array of shape (N,), True draws the trail in blue (DEPFactor < 0)
+            title : string of the frame title
+        """
+        from matplotlib.collections import LineCollection
+        fig.clear()
+        ax = fig.add_subplot(111)
+        ax.set_xlim(limits[0],limits[1])
+        ax.set_ylim(limits[2],limits[3])
+        ax.set_title(title)
+        ax.set_xlabel("X [m]")
+        ax.set_ylabel("Y [m]")
+        ax.grid()
+        segments = {'b':[],'r':[]}
+        for ind in range(trails.shape[1]):
+            path = trails[:,ind,0:2]
+            path = path[~isnan(path).any(axis=1)]
+            if len(path) > 1:
+                segments['b' if negative[ind] else 'r'].append(self.decimate(path,ax.transData))
+        for color in ['r','b']:
+            if segments[color]:
+                ax.add_collection(LineCollection(segments[color],colors=color))
+    
+    def buildAxes(self,plt,allData,particleList):
+        """Builds the scaled and labelled trajectory figure, returns its axes"""
         fig = plt.figure()
         ax = fig.add_subplot(111)
         ax.set_xlim(allData["X"].minValue, allData["X"].maxValue)
@@ -32,7 +141,10 @@ class Plot:
         plt.xlabel("X [m]")
         plt.ylabel("Y [m]")
         plt.grid()
-        return self.buildLineList(ax,particleList)
+        return ax
+    
+    def buildPlot(self,plt,allData,particleList):        
+        return self.buildLineList(self.buildAxes(plt,allData,particleList),particleList)
     
     def buildLineList(self,axis,particleList):
         lineList, lineStyleList = [], []
@@ -63,10 +175,24 @@ class Plot:
             pos1 = ax.get_position()  
             pos2 = [pos1.x0+((pos1.width - (pos1.width*self.scaleX))*.5), pos1.y0+((pos1.height - (pos1.height*self.scaleY))*.5),  pos1.width*self.scaleX, pos1.height*self.scaleY] 
             ax.set_position(pos2)
+            fileSuffix = '_'+''.join(c for c in title.lower().replace(' ','_') if c.isalnum() or c == '_')
             title = title + ' Vector Field'        
             plt.title(title)
             plt.xlabel("X [m]")
             plt.ylabel("Y [m]")
             plt.grid()
             
-            quiver(X.quiver,Y.quiver,U.quiver,V.quiver)                
\ No newline at end of file
+            # Subsample large grids to at most quiverArrows arrows per axis
+            rows, columns = U.quiver.shape
+            strideY, strideX = 1, 1
+            if self.quiverArrows > 0:
+                strideY, strideX = max(-(-rows//self.quiverArrows),1), max(-(-columns//self.quiverArrows),1)
+            sample = (slice(None,None,strideY),slice(None,None,strideX))
+            plt.quiver(X.quiver[sample],Y.quiver[sample],U.quiver[sample],V.quiver[sample])
+            self.save(fig,fileSuffix)
+    
+    def save(self,fig,suffix=''):
+        """Saves fig to outputFile with suffix appended to the name, the format follows the extension (eg. .png or .svg)"""
+        if self.outputFile:
+            name, extension = splitext(self.outputFile)
+            fig.savefig(name+suffix+(extension or '.png'))
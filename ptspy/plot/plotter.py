@@ -1,10 +1,33 @@
-import matplotlib.pyplot as plt
+import sys
+from ptspy.simulator.profiler import profiler
         
 def plotData(allData,particleList):
+    """Draws the figures of allData["plot"], matplotlib is imported here so runs without plots never load it"""
     print "3. Plotting Data"
     p = allData["plot"]
-    p.trajectory(plt,allData,particleList)
-    p.vectorField(plt,allData["X"],allData["Y"],allData["U"],allData["V"],"Fluid Velocity")
-    p.vectorField(plt,allData["X"],allData["Y"],allData["gradE2X"],allData["gradE2Y"],"grad(|E^2|)")
-    plt.show()
-    print "3. Done"
\ No newline at end of file
+    if not p.show and 'matplotlib.pyplot' not in sys.modules:
+        # Agg is selected before pyplot is imported, so no GUI toolkit is loaded
+        import matplotlib
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    if not p.show:
+        # Render off screen, the figures are only saved (see Plot.outputFile)
+        plt.switch_backend('Agg')
+    with profiler.phase('plotting'):
+        if allData.get("output",{}).get("recordTrajectories","True") == "True":
+            p.trajectory(plt,allData,particleList)
+        if p.plotFields and allData.get("dimensions",2) == 2 and hasattr(allData["fieldGrid"],'tiledData'):
+            # The vector field plots need a regular FieldGrid with the X repeats copied out, the simulation only keeps one tile
+            X,Y,U,V,gradE2X,gradE2Y = allData["fieldGrid"].tiledData()
+            p.vectorField(plt,X,Y,U,V,"Fluid Velocity")
+            p.vectorField(plt,X,Y,gradE2X,gradE2Y,"grad(|E^2|)")
+    if profiler.enabled:
+        print profiler.summary("3. Done (before the figures are shown)" if p.show else "3. Done")
+        if allData.get("output",{}).get("profileFile"):
+            profiler.writeReport(allData["output"]["profileFile"])
+    if p.show:
+        plt.show()
+    else:
+        plt.close('all')
+    if not profiler.enabled:
+        print "3. Done"
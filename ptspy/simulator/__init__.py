@@ -1,5 +1,19 @@
 # from simulator import Simulator
 from time import Time
+from trajectoryStore import TrajectoryStore
+from trajectoryStore import NullTrajectoryStore
+from trajectoryWriter import TrajectoryWriter
+from trajectoryWriter import TrajectoryReader
 from rungeKuttaIntegrator import RungeKuttaIntegrator
+from dormandPrinceIntegrator import DormandPrinceIntegrator
+from exponentialIntegrator import ExponentialIntegrator
+from overdampedIntegrator import OverdampedIntegrator
+from eventDetector import EventDetector
+from checkpoint import Checkpoint
+from injectionLog import InjectionLog
+from onlineStatistics import OnlineStatistics
+from outputPipeline import OutputPipeline
 from bilinearInterpolation import BilinearInterpolation
+from bilinearCoefficientInterpolation import BilinearCoefficientInterpolation
+from barycentricInterpolation import BarycentricInterpolation
 from trilinearInterpolation import TrilinearInterpolation
@@ -0,0 +1,183 @@
+from numpy import arange
+from numpy import argsort
+from numpy import array
+from numpy import clip
+from numpy import cumsum
+from numpy import full
+from numpy import hypot
+from numpy import inf
+from numpy import newaxis
+from numpy import roll
+from numpy import searchsorted
+from numpy import sqrt
+from numpy import zeros
+from ptspy.simulator.bilinearInterpolation import BilinearInterpolation
+
+class BarycentricInterpolation(BilinearInterpolation):
+    """Linear interpolation on a triangulation of scattered (unstructured or non-uniform) field nodes
+
+    Point location uses a bucketed spatial index: the bounding box of the nodes is split into a uniform
+    grid of buckets and every bucket lists the triangles whose bounding box overlaps it, so finding the
+    triangle of a point only tests the few triangles of its bucket (O(1) expected). The value is
+    the barycentric (linear) combination of the triangle's 3 nodes.
+    The default Delaunay triangulation covers the convex hull of the nodes, pass triangles (eg. the
+    exported mesh elements) to keep holes such as electrodes cut out of the domain. Points outside
+    the triangles but in a bucket with triangles take the nearest of those triangles with the weights
+    clipped to it; points in an empty bucket sample zero fields, as NaN nodes do in the grid loader.
+    Boundary handling (repeatX/repeatY) is inherited from BilinearInterpolation and uses the
+    bounding box of the nodes.
+
+    Like BilinearInterpolation, all fields are stacked into self.fields of shape (nodes,C) and
+    self.channels maps each field name to its slice of columns.
+    """
+    # Large arrays that sharded simulations place in shared memory (the integer index arrays are pickled)
+    sharedArrayNames = ['coordinates','fields','transforms']
+    # Tolerance on the barycentric coordinates for points on a triangle edge
+    tolerance = 1e-10
+
+    def __init__(self,X=array([0,0]),Y=array([0,0]),coordinates=array([0,0]),
+                    velocityTranspose=array([0,0]),gradESquaredTranspose=array([0,0]),repeatX=True,repeatY=False,
+                    triangles=None,trianglesPerBucket=2.):
+        """
+        Args:
+            X : X object for the node bounding box
+            Y : Y object for the node bounding box
+            coordinates : np.array([[x1,x2,x3,...],[y1,y2,y3,...]]) of every node
+            velocityTranspose : np.array([[x1,y1],[x2,y2],[x3,y3]...])
+            gradESquaredTranspose : np.array([[x1,y1],[x2,y2],[x3,y3]...])
+            triangles : numpy.array of shape (T,3) of node indexes (defaults to the Delaunay triangulation of the nodes)
+            trianglesPerBucket : average number of triangles per bucket of the spatial index (defaults to 2)
+        """
+        BilinearInterpolation.__init__(self,X,Y,coordinates,velocityTranspose,gradESquaredTranspose,repeatX,repeatY)
+        if triangles is None:
+            triangles = delaunayTriangles(coordinates)
+        self.buildTransforms(array(triangles,dtype=int))
+        self.buildBucketIndex(trianglesPerBucket)
+
+    def buildTransforms(self,triangles):
+        """Keeps the non-degenerate triangles and precomputes the affine map of every triangle to its barycentric coordinates
+
+        self.transforms has rows [a,b,c,d,x3,y3] with l1 = a*(x-x3)+b*(y-y3) and l2 = c*(x-x3)+d*(y-y3).
+        """
+        x, y = self.coordinates[0][triangles], self.coordinates[1][triangles]
+        determinant = (x[:,0]-x[:,2])*(y[:,1]-y[:,2])-(x[:,1]-x[:,2])*(y[:,0]-y[:,2])
+        keep = determinant != 0
+        x, y, determinant = x[keep], y[keep], determinant[keep]
+        self.triangles = triangles[keep]
+        self.transforms = array([(y[:,1]-y[:,2])/determinant,(x[:,2]-x[:,1])/determinant,
+                                 (y[:,2]-y[:,0])/determinant,(x[:,0]-x[:,2])/determinant,x[:,2],y[:,2]]).T
+
+    def buildBucketIndex(self,trianglesPerBucket=2.):
+        """Builds the bucket grid, bucketStart[b]:bucketStart[b+1] is the slice of bucketTriangles in bucket b"""
+        x, y = self.coordinates[0][self.triangles], self.coordinates[1][self.triangles]
+        width = float(self.X.maxValue-self.X.minValue) or 1.
+        height = float(self.Y.maxValue-self.Y.minValue) or 1.
+        buckets = max(len(self.triangles)/float(trianglesPerBucket),1.)
+        self.bucketsX = max(int(sqrt(buckets*width/height)),1)
+        self.bucketsY = max(int(buckets/self.bucketsX),1)
+        self.bucketScale = array([self.bucketsX/width,self.bucketsY/height])
+        bx0, bx1 = self.bucketOf(x.min(axis=1),0), self.bucketOf(x.max(axis=1),0)
+        by0, by1 = self.bucketOf(y.min(axis=1),1), self.bucketOf(y.max(axis=1),1)
+        # Every triangle is listed in every bucket of its bounding box
+        columns = bx1-bx0+1
+        counts = columns*(by1-by0+1)
+        local = arange(counts.sum())-(cumsum(counts)-counts).repeat(counts)
+        bucket = (bx0.repeat(counts)+local % columns.repeat(counts))+(by0.repeat(counts)+local // columns.repeat(counts))*self.bucketsX
+        order = argsort(bucket,kind='mergesort')
+        self.bucketTriangles = arange(len(self.triangles)).repeat(counts)[order]
+        self.bucketStart = searchsorted(bucket[order],arange(self.bucketsX*self.bucketsY+1))
+
+    def bucketOf(self,values,axis):
+        """Returns the bucket column (axis 0) or row (axis 1) of an array of x or y values"""
+        grid, length = (self.X,self.bucketsX) if axis == 0 else (self.Y,self.bucketsY)
+        return clip(((values-grid.minValue)*self.bucketScale[axis]).astype(int),0,length-1)
+
+    def barycentric(self,triangles,points):
+        """Returns the barycentric coordinates of shape (N,3) of points in triangles"""
+        t = self.transforms[triangles]
+        dx, dy = points[:,0]-t[:,4], points[:,1]-t[:,5]
+        l1 = t[:,0]*dx+t[:,1]*dy
+        l2 = t[:,2]*dx+t[:,3]*dy
+        return array([l1,l2,1-l1-l2]).T
+
+    def buildNearestIndexesBatch(self,points):
+        """Batched point location for points of shape (N,2)
+
+        Returns (triangles,weights): the triangle of every point, shape (N,) (-1 in an empty bucket),
+        and its barycentric weights, shape (N,3).
+        """
+        N = len(points)
+        bucket = self.bucketOf(points[:,0],0)+self.bucketOf(points[:,1],1)*self.bucketsX
+        start, stop = self.bucketStart[bucket], self.bucketStart[bucket+1]
+        triangles = full(N,-1,int)
+        weights = zeros((N,3))
+        best = full(N,-inf)
+        pending = arange(N)
+        k = 0
+        while True:
+            pending = pending[start[pending]+k < stop[pending]]
+            if len(pending) == 0:
+                break
+            candidates = self.bucketTriangles[start[pending]+k]
+            w = self.barycentric(candidates,points[pending])
+            worst = w.min(axis=1)
+            better = worst > best[pending]
+            found = pending[better]
+            triangles[found], weights[found], best[found] = candidates[better], w[better], worst[better]
+            pending = pending[worst < -self.tolerance]
+            k += 1
+        outside = (best < -self.tolerance) & (triangles >= 0)
+        if outside.any():
+            clipped = clip(weights[outside],0,None)
+            weights[outside] = clipped/clipped.sum(axis=1)[:,newaxis]
+        return triangles, weights
+
+    def buildNearestIndexes(self,point):
+        """Point location for one point, returns (triangles,weights) of shape (1,) and (1,3)"""
+        return self.buildNearestIndexesBatch(array(point,dtype=float)[newaxis])
+
+    def interpolate(self,point,indexList,fieldName='none'):
+        return self.interpolateBatch(array(point,dtype=float)[newaxis],indexList,fieldName)[0]
+
+    def interpolateBatch(self,points,nearest,fieldName='none'):
+        """Batched interpolation of one field, returns numpy.array of shape (N,channels)"""
+        if fieldName not in self.channels:
+            print 'no interpolation occurring\nreturning zeros\n'
+            return 0*points
+        return self.barycentricInterpolationBatch(nearest,self.fields[:,self.channels[fieldName]])
+
+    def interpolateAll(self,point,indexList):
+        return self.interpolateAllBatch(array(point,dtype=float)[newaxis],indexList)[0]
+
+    def interpolateAllBatch(self,points,nearest):
+        """Interpolates every stacked channel at points, returns numpy.array of shape (N,C) (slice with self.channels)"""
+        return self.barycentricInterpolationBatch(nearest,self.fields)
+
+    def barycentricInterpolationBatch(self,nearest,fieldTranspose):
+        """Weighted sum of the 3 node values of every point's triangle
+
+        Args:
+            nearest : (triangles,weights) from buildNearestIndexesBatch
+            fieldTranspose : numpy.array of shape (nodes,C)
+        """
+        triangles, weights = nearest
+        nodes = self.triangles[triangles]
+        f = (fieldTranspose[nodes[:,0]]*weights[:,0,newaxis]+fieldTranspose[nodes[:,1]]*weights[:,1,newaxis]+
+             fieldTranspose[nodes[:,2]]*weights[:,2,newaxis])
+        f[triangles < 0] = 0
+        return f
+
+def delaunayTriangles(coordinates,maxEdge=0.):
+    """Returns the Delaunay triangulation of shape (T,3) of the nodes np.array([[x1,x2,...],[y1,y2,...]])
+
+    The triangulation covers the convex hull of the nodes, the triangles with an edge longer than maxEdge
+    (if > 0) are dropped so holes in the nodes aren't bridged. matplotlib is only imported here, getFieldMesh
+    caches the triangles so runs with a warm cache (or a mesh elements file) don't load it.
+    """
+    from matplotlib.tri import Triangulation
+    triangles = Triangulation(coordinates[0],coordinates[1]).triangles
+    if maxEdge > 0:
+        x, y = coordinates[0][triangles], coordinates[1][triangles]
+        edges = hypot(x-roll(x,1,axis=1),y-roll(y,1,axis=1))
+        triangles = triangles[edges.max(axis=1) <= maxEdge]
+    return triangles
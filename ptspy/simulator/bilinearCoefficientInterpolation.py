@@ -0,0 +1,110 @@
+from numpy import array
+from numpy import diff
+from numpy import append
+from numpy import concatenate
+from numpy import stack
+from numpy import newaxis
+from numpy import clip
+from numpy import floor as floorArray
+from math import floor
+from ptspy.simulator.bilinearInterpolation import BilinearInterpolation
+
+class BilinearCoefficientInterpolation(BilinearInterpolation):
+    sharedArrayNames = BilinearInterpolation.sharedArrayNames+['coefficients']
+    
+    def __init__(self,X=array([0,0]),Y=array([0,0]),coordinates=array([0,0]),
+                    velocityTranspose=array([0,0]),gradESquaredTranspose=array([0,0]),repeatX=True,repeatY=False):
+        """Bilinear interpolation on a uniform grid from a per-cell coefficient table built once at load time
+        
+        Every cell stores f = a0 + a1*dx + a2*dy + a3*dx*dy for every stacked field channel, where dx and dy are measured
+        from the cell's lower-left node (cell-local offsets keep the coefficients well conditioned).
+        A lookup is then an integer cell index, one gather and one small polynomial evaluation.
+        Boundary handling is inherited from BilinearInterpolation so both can be compared directly.
+        With virtual X repeats the table has one extra cell per row joining the last column to the
+        first column of the next repeat.
+        
+        Args:
+            X : X object for grid points
+            Y : Y object for grid points
+            coordinates : np.array([[x1,x2,x3,...],[y1,y2,y3,...]])
+            velocityTranspose : np.array([[x1,y1],[x2,y2],[x3,y3]...])
+            gradESquaredTranspose : np.array([[x1,y1],[x2,y2],[x3,y3]...])
+        """
+        BilinearInterpolation.__init__(self,X,Y,coordinates,velocityTranspose,gradESquaredTranspose,repeatX,repeatY)
+        self.buildCoefficientTables()
+        
+    def buildCoefficientTables(self):
+        """Precomputes inverse grid spacing, cell origins and the coefficient table of every field"""
+        nx, ny = self.baseLengthX, self.Y.quiverLength
+        self.inverseSpacingX = (self.X.quiverLength-1)/float(self.X.maxValue-self.X.minValue)
+        self.inverseSpacingY = (ny-1)/float(self.Y.maxValue-self.Y.minValue)
+        self.nodesX = array(self.coordinates[0][:nx],dtype=float)
+        self.nodesY = array(self.coordinates[1][::nx][:ny],dtype=float)
+        self.cellsPerRow = nx if self.X.quiverLength > nx else nx-1
+        self.cellOriginX = self.nodesX[:self.cellsPerRow]
+        self.cellOriginY = self.nodesY[:-1]
+        self.coefficients = self.coefficientTable(self.fields)
+        
+    def addField(self,name,fieldTranspose):
+        BilinearInterpolation.addField(self,name,fieldTranspose)
+        if hasattr(self,'coefficients'):
+            self.buildCoefficientTables()
+        
+    def coefficientTable(self,fieldTranspose):
+        """Returns numpy.array of shape (cells,4,C) holding [a0,a1,a2,a3] of every cell
+        
+        Args:
+            fieldTranspose : numpy.array([[x1,y1],[x2,y2],[x3,y3],...])
+        """
+        nx, ny = self.baseLengthX, self.Y.quiverLength
+        f = array(fieldTranspose,dtype=float).reshape(ny,nx,-1)
+        nodesX = self.nodesX
+        if self.cellsPerRow == nx:
+            # Virtual X repeats, the last cell of a row ends on the first column of the next repeat
+            f = concatenate((f,f[:,:1]),axis=1)
+            nodesX = append(nodesX,nodesX[0]+self.periodX)
+        hx = diff(nodesX)[newaxis,:,newaxis]
+        hy = diff(self.nodesY)[:,newaxis,newaxis]
+        f00, f10, f01, f11 = f[:-1,:-1], f[:-1,1:], f[1:,:-1], f[1:,1:]
+        table = stack((f00,(f10-f00)/hx,(f01-f00)/hy,(f11-f10-f01+f00)/(hx*hy)),axis=2)
+        return table.reshape((ny-1)*self.cellsPerRow,4,-1)
+    
+    def buildNearestIndexes(self,point):
+        """Returns [cell,dx,dy] for point (cell index and offsets from the cell origin)"""
+        i = min(max(int(floor((point[0]-self.X.minValue)*self.inverseSpacingX)),0),self.X.quiverLength-2)
+        j = min(max(int(floor((point[1]-self.Y.minValue)*self.inverseSpacingY)),0),self.Y.quiverLength-2)
+        tile, i = divmod(i,self.baseLengthX)
+        return [i+j*self.cellsPerRow,point[0]-(self.cellOriginX[i]+tile*self.periodX),point[1]-self.cellOriginY[j]]
+        
+    def buildNearestIndexesBatch(self,points):
+        """Batched buildNearestIndexes, returns (cells,dx,dy) with cells of shape (N,) and offsets of shape (N,1)"""
+        i = clip(floorArray((points[:,0]-self.X.minValue)*self.inverseSpacingX).astype(int),0,self.X.quiverLength-2)
+        j = clip(floorArray((points[:,1]-self.Y.minValue)*self.inverseSpacingY).astype(int),0,self.Y.quiverLength-2)
+        tile, i = i // self.baseLengthX, i % self.baseLengthX
+        dx = (points[:,0]-(self.cellOriginX[i]+tile*self.periodX))[:,newaxis]
+        dy = (points[:,1]-self.cellOriginY[j])[:,newaxis]
+        return i+j*self.cellsPerRow, dx, dy
+    
+    def interpolate(self,point,indexList,fieldName='none'):
+        if fieldName not in self.channels:
+            return BilinearInterpolation.interpolate(self,point,indexList,fieldName)
+        cell, dx, dy = indexList
+        a = self.coefficients[cell][:,self.channels[fieldName]]
+        return a[0]+a[1]*dx+a[2]*dy+a[3]*(dx*dy)
+    
+    def interpolateBatch(self,points,indexes,fieldName='none'):
+        if fieldName not in self.channels:
+            return BilinearInterpolation.interpolateBatch(self,points,indexes,fieldName)
+        cells, dx, dy = indexes
+        a = self.coefficients[cells][:,:,self.channels[fieldName]]
+        return a[:,0]+a[:,1]*dx+a[:,2]*dy+a[:,3]*(dx*dy)
+    
+    def interpolateAll(self,point,indexList):
+        cell, dx, dy = indexList
+        a = self.coefficients[cell]
+        return a[0]+a[1]*dx+a[2]*dy+a[3]*(dx*dy)
+    
+    def interpolateAllBatch(self,points,indexes):
+        cells, dx, dy = indexes
+        a = self.coefficients[cells]
+        return a[:,0]+a[:,1]*dx+a[:,2]*dy+a[:,3]*(dx*dy)
@@ -1,10 +1,20 @@
 from numpy import isnan
 from numpy import array
+from numpy import newaxis
+from numpy import hstack
+from numpy import floor as floorArray
+from numpy import ceil as ceilArray
 from math import floor
 from math import ceil
 from ptspy.physical.particle import Particle
+from ptspy.simulator.profiler import profiler
 
 class BilinearInterpolation:
+    # Stacked field channels that are also exposed as their own attribute
+    fieldAttributes = {'velocity':'velocityTranspose','Efield':'gradESquaredTranspose'}
+    # Large arrays that sharded simulations place in shared memory
+    sharedArrayNames = ['coordinates','fields']
+    
     def __init__(self,X=array([0,0]),Y=array([0,0]),coordinates=array([0,0]),
                     velocityTranspose=array([0,0]),gradESquaredTranspose=array([0,0]),repeatX=True,repeatY=False):
         """Bilinear Interpolation class for bilinear interpolation including averageVelocity
@@ -14,19 +24,49 @@ class BilinearInterpolation:
             Y : Y object for grid points
             coordinates : np.array([[x1,x2,x3,...],[y1,y2,y3,...]])
             velocityTranspose : np.array([[x1,y1],[x2,y2],[x3,y3]...])
-            fluid : fluid object
-            forces : forces object
+            gradESquaredTranspose : np.array([[x1,y1],[x2,y2],[x3,y3]...])
+        
+        All fields are stacked into one contiguous array self.fields of shape (nodes,C) and
+        self.channels maps each field name to its slice of columns, so interpolateAll can
+        sample every field from a single gather.
         """
         self.X = X
         self.Y = Y
+        # Virtual X repeats (see utilities.dataHandler.FieldGrid), a plain X object isn't tiled
+        self.baseLengthX = getattr(X,'baseLength',getattr(X,'quiverLength',0))
+        self.periodX = getattr(X,'period',0.)
         self.coordinates = coordinates
         self.coordinatesTranspose = coordinates.T
-        self.velocityTranspose = velocityTranspose
-        self.gradESquaredTranspose = gradESquaredTranspose
+        self.fields = None
+        self.channels = {}
+        self.addField('velocity',velocityTranspose)
+        self.addField('Efield',gradESquaredTranspose)
         self.repeatX = repeatX
         self.repeatY = repeatY
         #self.time = time
 
+    def addField(self,name,fieldTranspose):
+        """Appends a field as extra channels of the stacked field array
+        
+        Args:
+            name : string used to look up the channels (eg. 'velocity', 'Efield', 'temperature')
+            fieldTranspose : np.array([[x1,y1],[x2,y2],[x3,y3]...]) or np.array([f1,f2,f3,...]) for scalar fields
+        """
+        field = array(fieldTranspose,dtype=float)
+        if field.ndim == 1:
+            field = field[:,newaxis]
+        start = 0 if self.fields is None else self.fields.shape[1]
+        self.fields = field if self.fields is None else hstack((self.fields,field))
+        self.channels[name] = slice(start,start+field.shape[1])
+        self.refreshFieldViews()
+        
+    def refreshFieldViews(self):
+        """Re-points coordinatesTranspose and the per-field attributes (eg. velocityTranspose) to views of the stacked arrays"""
+        self.coordinatesTranspose = self.coordinates.T
+        for fieldName in self.channels:
+            if fieldName in self.fieldAttributes:
+                setattr(self,self.fieldAttributes[fieldName],self.fields[:,self.channels[fieldName]])
+        
     def checkPointVsBoundaries(self,point=array([0,0]),obj=1):
         """Checks if point is within the boundaries for interpolation
         
@@ -62,6 +102,41 @@ class BilinearInterpolation:
                 point[1] = self.Y.minValue
         return point
         
+    def checkPointsVsBoundaries(self,points,ensemble=None,indexes=None):
+        """Batched checkPointVsBoundaries for an array of points (modified in place)
+        
+        Args:
+            points : numpy.array of shape (N,2)
+            ensemble : pass the ParticleEnsemble so repeated particles are counted
+            indexes : ensemble indexes of the points when they are a subset of the ensemble
+        """
+        with profiler.phase('boundaries'):
+            x, y = points[:,0], points[:,1]
+            over, under = x > self.X.maxValue, x < self.X.minValue
+            if profiler.enabled:
+                profiler.count('boundaryWraps' if self.repeatX else 'boundaryClamps',(over | under).sum())
+            if self.repeatX:
+                x[over] = self.X.minValue
+                x[under] = self.X.maxValue
+                if ensemble is not None and indexes is None:
+                    ensemble.repeatCnt += over | under
+                elif ensemble is not None:
+                    ensemble.repeatCnt[indexes] += over | under
+            else:
+                x[over] = self.X.maxValue-(1e-5*self.X.maxValue)
+                x[under] = self.X.minValue
+                
+            over, under = y > self.Y.maxValue, y < self.Y.minValue
+            if profiler.enabled:
+                profiler.count('boundaryWraps' if self.repeatY else 'boundaryClamps',(over | under).sum())
+            if self.repeatY:
+                y[over] = self.Y.minValue
+                y[under] = self.Y.maxValue
+            else:
+                y[over] = self.Y.maxValue-(1e-5*self.Y.maxValue)
+                y[under] = self.Y.minValue
+            return points
+        
     def buildNearestIndexes(self,point):
         i = (self.X.quiverLength-1)*(point[0]-self.X.minValue)/(self.X.maxValue-self.X.minValue)
         j = (self.Y.quiverLength-1)*(point[1]-self.Y.minValue)/(self.Y.maxValue-self.Y.minValue)
@@ -77,17 +152,51 @@ class BilinearInterpolation:
         ind11 = self.ijToFlatIndex(i1,j1)
         return [ind00,ind10,ind01,ind11]
     
+    def buildNearestIndexesBatch(self,points):
+        """Batched buildNearestIndexes, returns numpy.array of shape (N,4) with columns [ind00,ind10,ind01,ind11]
+        
+        Args:
+            points : numpy.array of shape (N,2)
+        """
+        i = (self.X.quiverLength-1)*(points[:,0]-self.X.minValue)/(self.X.maxValue-self.X.minValue)
+        j = (self.Y.quiverLength-1)*(points[:,1]-self.Y.minValue)/(self.Y.maxValue-self.Y.minValue)
+        i0, i1 = self.fixIndexesBatch(floorArray(i).astype(int),ceilArray(i).astype(int))
+        j0, j1 = self.fixIndexesBatch(floorArray(j).astype(int),ceilArray(j).astype(int))
+        indexes = array([self.ijToFlatIndex(i0,j0),self.ijToFlatIndex(i1,j0),
+                         self.ijToFlatIndex(i0,j1),self.ijToFlatIndex(i1,j1)])
+        return indexes.T
+    
     def ijToFlatIndex(self,i,j):
         return i+(j*self.X.quiverLength)  
     
+    def fieldIndex(self,ind):
+        """Maps a flat grid index (virtual X repeats included) to its row in the stored field arrays"""
+        return (ind % self.X.quiverLength) % self.baseLengthX + (ind // self.X.quiverLength)*self.baseLengthX
+    
+    def nodeX(self,ind):
+        """Returns the x coordinate of a flat grid index, shifted by the period of its virtual X repeat"""
+        return self.coordinates[0][self.fieldIndex(ind)] + ((ind % self.X.quiverLength)//self.baseLengthX)*self.periodX
+    
     def interpolate(self,point,indexList,fieldName='none'):
-        if fieldName=='none':
+        if fieldName not in self.channels:
             print 'no interpolation occurring\nreturning array([0,0])\n'
             return array([0,0])
-        if fieldName=='velocity':
-            return self.bilinearInterpolation(point,indexList,self.velocityTranspose)
-        if fieldName=='Efield':
-            return self.bilinearInterpolation(point,indexList,self.gradESquaredTranspose)
+        return self.bilinearInterpolation(point,indexList,self.fields[:,self.channels[fieldName]])
+            
+    def interpolateBatch(self,points,indexes,fieldName='none'):
+        """Batched interpolate for an array of points, returns numpy.array of shape (N,channels)"""
+        if fieldName not in self.channels:
+            print 'no interpolation occurring\nreturning zeros\n'
+            return 0*points
+        return self.bilinearInterpolationBatch(points,indexes,self.fields[:,self.channels[fieldName]])
+    
+    def interpolateAll(self,point,indexList):
+        """Interpolates every stacked channel at point, returns numpy.array of shape (C,) (slice with self.channels)"""
+        return self.bilinearInterpolation(point,indexList,self.fields)
+    
+    def interpolateAllBatch(self,points,indexes):
+        """Interpolates every stacked channel at points, returns numpy.array of shape (N,C) (slice with self.channels)"""
+        return self.bilinearInterpolationBatch(points,indexes,self.fields)
             
     def bilinearInterpolation(self,point,indexes,fieldTranspose):
         """Bilinear interpolation of a 2D field numpy.array([[x1,y1],[x2,y2],[x3,y3],...]) at point within a rectangular grid
@@ -99,12 +208,13 @@ class BilinearInterpolation:
             velocityTranspose : transposed velocity build from U and V objects
         """
         x,y = point
-        x1,x2 = self.coordinates[0][indexes[0]],self.coordinates[0][indexes[1]]
-        y1,y2 = self.coordinates[1][indexes[1]],self.coordinates[1][indexes[2]]
-        f11 = fieldTranspose[indexes[0]]
-        f21 = fieldTranspose[indexes[1]]
-        f12 = fieldTranspose[indexes[2]]
-        f22 = fieldTranspose[indexes[3]]
+        rows = [self.fieldIndex(ind) for ind in indexes]
+        x1,x2 = self.nodeX(indexes[0]),self.nodeX(indexes[1])
+        y1,y2 = self.coordinates[1][rows[1]],self.coordinates[1][rows[2]]
+        f11 = fieldTranspose[rows[0]]
+        f21 = fieldTranspose[rows[1]]
+        f12 = fieldTranspose[rows[2]]
+        f22 = fieldTranspose[rows[3]]
         return 1/((x2-x1)*(y2-y1))*(f11*(x2-x)*(y2-y)+f21*(x-x1)*(y2-y)+f12*(x2-x)*(y-y1)+f22*(x-x1)*(y-y1))
             
     def fixIndexes(self,ind1,ind2):
@@ -121,4 +231,31 @@ class BilinearInterpolation:
         else:
             ind2 += 1
         return ind1,ind2
-    
\ No newline at end of file
+
+    def bilinearInterpolationBatch(self,points,indexes,fieldTranspose):
+        """Batched bilinearInterpolation, same arithmetic as the scalar version applied to every row
+        
+        Args:
+            points : numpy.array of shape (N,2)
+            indexes : numpy.array of shape (N,4) from buildNearestIndexesBatch
+            fieldTranspose : numpy.array([[x1,y1],[x2,y2],[x3,y3],...])
+        """
+        x, y = points[:,0,newaxis], points[:,1,newaxis]
+        rows = self.fieldIndex(indexes)
+        x1,x2 = self.nodeX(indexes[:,0])[:,newaxis],self.nodeX(indexes[:,1])[:,newaxis]
+        y1,y2 = self.coordinates[1][rows[:,1],newaxis],self.coordinates[1][rows[:,2],newaxis]
+        f11 = fieldTranspose[rows[:,0]]
+        f21 = fieldTranspose[rows[:,1]]
+        f12 = fieldTranspose[rows[:,2]]
+        f22 = fieldTranspose[rows[:,3]]
+        return 1/((x2-x1)*(y2-y1))*(f11*(x2-x)*(y2-y)+f21*(x-x1)*(y2-y)+f12*(x2-x)*(y-y1)+f22*(x-x1)*(y-y1))
+        
+    def fixIndexesBatch(self,ind1,ind2):
+        """Batched fixIndexes for numpy.arrays of lower and upper indexes (modified in place)"""
+        same = ind1 == ind2
+        if profiler.enabled:
+            profiler.count('fixIndexesCorrections',same.sum())
+        lower = same & (ind1 > 0)
+        ind1[lower] -= 1
+        ind2[same & ~lower] += 1
+        return ind1,ind2
@@ -0,0 +1,105 @@
+import json
+import re
+from glob import glob
+from os import rename
+from os.path import isfile
+from timeit import default_timer
+from numpy import array
+from numpy import load
+from numpy import savez
+
+class Checkpoint:
+    """Periodic checkpoints of a fixed step run (see RungeKuttaIntegrator.integrate), each written atomically as one .npz file
+
+    A checkpoint holds everything needed to continue the run bit-exactly: the index of the next step,
+    every ParticleEnsemble array, the active particle indexes and stagnant step counts when events are
+    detected, the state of the OnlineStatistics accumulators and the trajectory store state (the records
+    so far of an in-memory TrajectoryStore, or the record count, buffered records and written blocks of
+    a TrajectoryWriter, whose block files are already on disk). The simulation has no random number
+    generator, so there is no RNG state to save.
+
+    Attributes:
+        fileName : string of the checkpoint file
+        everySteps : integer, a checkpoint is written every everySteps steps (0 disables)
+        everySeconds : a checkpoint is written once everySeconds of wall time passed since the last one (0 disables)
+        resume : bool, restore continues from the checkpoint file if it exists (defaults to False)
+    """
+    # ParticleEnsemble arrays that change during a run
+    ensembleArrays = ['positions','velocities','accelerations','repeatCnt','event','eventTime','eventPositions']
+    
+    def __init__(self,fileName,everySteps=0,everySeconds=0.,resume=False):
+        self.fileName = fileName
+        self.everySteps = int(everySteps)
+        self.everySeconds = everySeconds
+        self.resume = resume
+        self.lastStep = 0
+        self.lastTime = default_timer()
+
+    def due(self,stepIndex):
+        """Returns True if a checkpoint should be written before step stepIndex"""
+        if self.everySteps > 0 and stepIndex-self.lastStep >= self.everySteps:
+            return True
+        return self.everySeconds > 0 and default_timer()-self.lastTime >= self.everySeconds
+
+    def write(self,stepIndex,numberOfSteps,ensemble,store,active=None,events=None,statistics=None):
+        """Atomically writes the state of the run before step stepIndex
+
+        Args:
+            stepIndex : integer index of the next step
+            numberOfSteps : integer of the steps of the whole run
+            ensemble : ParticleEnsemble object, holding the state of every particle
+            store : TrajectoryStore, TrajectoryWriter or OutputPipeline
+            active : numpy.array of the indexes of the particles still stepped (with events)
+            events : EventDetector object (with events)
+            statistics : OnlineStatistics object (with statistics)
+        """
+        meta = {"stepIndex":stepIndex,"numberOfSteps":numberOfSteps,"numberOfParticles":len(ensemble)}
+        arrays = dict(('ensemble_'+name,getattr(ensemble,name)) for name in self.ensembleArrays)
+        arrays.update(('store_'+name,value) for name,value in store.saveState().items())
+        if active is not None:
+            arrays['active'] = active
+            arrays['stagnantSteps'] = events.stagnantSteps
+        if statistics is not None:
+            arrays.update(('statistics_'+name,value) for name,value in statistics.saveState().items())
+        with open(self.fileName+'.tmp','wb') as outFile:
+            savez(outFile,meta=array(json.dumps(meta)),**arrays)
+        rename(self.fileName+'.tmp',self.fileName)
+        self.lastStep = stepIndex
+        self.lastTime = default_timer()
+
+    def restore(self,numberOfSteps,ensemble,store,active=None,events=None,statistics=None):
+        """Loads the checkpoint into ensemble, store, events and statistics if resume is set and the file exists
+
+        Returns (stepIndex,active): the index of the next step and the active particle indexes
+        (0 and the given active if there's nothing to restore). Raises ValueError if the file is missing
+        but checkpoints of another number of workers exist (see otherCheckpoints).
+        """
+        if self.resume and not isfile(self.fileName) and self.otherCheckpoints():
+            raise ValueError("checkpoint %s doesn't exist but %s do, resume with the number of workers that wrote them" % (
+                self.fileName,', '.join(self.otherCheckpoints())))
+        if not (self.resume and isfile(self.fileName)):
+            return 0, active
+        with load(self.fileName) as data:
+            meta = json.loads(str(data['meta']))
+            if meta["numberOfSteps"] != numberOfSteps or meta["numberOfParticles"] != len(ensemble):
+                raise ValueError("checkpoint %s is for %d steps of %d particles, not %d steps of %d particles" % (
+                    self.fileName,meta["numberOfSteps"],meta["numberOfParticles"],numberOfSteps,len(ensemble)))
+            for name in self.ensembleArrays:
+                setattr(ensemble,name,data['ensemble_'+name].copy())
+            store.loadState(dict((name[6:],data[name]) for name in data.files if name.startswith('store_')))
+            if 'active' in data.files:
+                active = data['active'].copy()
+                events.stagnantSteps = data['stagnantSteps'].copy()
+            if statistics is not None:
+                statistics.loadState(dict((name[11:],data[name]) for name in data.files if name.startswith('statistics_')))
+        print "Resuming from step %d of %d (%s)" % (meta["stepIndex"],numberOfSteps,self.fileName)
+        self.lastStep = meta["stepIndex"]
+        return meta["stepIndex"], active
+
+    def otherCheckpoints(self):
+        """Returns the sorted checkpoint files of the same run written with another number of workers
+        (the serial checkpointFile and the checkpointFile.part<n> files of sharded runs, except fileName)"""
+        base = re.sub(r'\.part\d{3}$','',self.fileName)
+        names = [base]+glob(base+'.part[0-9][0-9][0-9]')
+        return sorted(name for name in names if name != self.fileName and isfile(name))
+
@@ -0,0 +1,197 @@
+from numpy import abs as absolute
+from numpy import array
+from numpy import empty
+from numpy import full
+from numpy import hstack
+from numpy import maximum
+from numpy import minimum
+from numpy import newaxis
+from numpy import flatnonzero
+from numpy import searchsorted
+from numpy import sqrt
+from numpy import zeros
+from numpy import where
+from ptspy.simulator.rungeKuttaIntegrator import RungeKuttaIntegrator
+from ptspy.simulator.profiler import profiler
+
+class DormandPrinceIntegrator(RungeKuttaIntegrator):
+    """Adaptive Dormand-Prince 5(4) integrator with per-particle step size control
+
+    Every particle carries its own time and step size. A step is accepted when the embedded
+    4th order error estimate is within rtol/atol, and the next step size follows from the error.
+    Positions are produced on the regular output grid (the times recorded by the fixed step
+    integrator) with the 4th order dense output of Hairer's DOPRI5, so steps are not limited
+    by the output spacing.
+
+    The state of a particle is [position,velocity] (eg. [x,y,vx,vy] in 2D) with dx/dt = v and
+    dv/dt = (stokes + DEP + weight)/mass (see ForceModel).
+    There is no terminal velocity clamp, the error control keeps the steps stable.
+    Events (RungeKuttaIntegrator.events) aren't detected, every particle is advanced to the end of the run
+    (simulator.buildIntegrator refuses dopri5 with events).
+    Checkpoints aren't written, an interrupted adaptive run starts again from the beginning.
+    Statistics (RungeKuttaIntegrator.statistics) only see the final positions, plane crossings aren't detected.
+
+    Attributes:
+        rtol : relative tolerance
+        atol : absolute tolerances [positionTolerance,velocityTolerance] (from a number or a pair)
+        minimumStep : steps at or below this size are always accepted
+    """
+    # Butcher tableau, the last row is also the 5th order solution
+    a = [[],
+         [1/5.],
+         [3/40.,9/40.],
+         [44/45.,-56/15.,32/9.],
+         [19372/6561.,-25360/2187.,64448/6561.,-212/729.],
+         [9017/3168.,-355/33.,46732/5247.,49/176.,-5103/18656.],
+         [35/384.,0,500/1113.,125/192.,-2187/6784.,11/84.]]
+    # 5th order solution minus the embedded 4th order solution
+    e = array([71/57600.,0,-71/16695.,71/1920.,-17253/339200.,22/525.,-1/40.])
+    # Dense output coefficients
+    d = array([-12715105075/11282082432.,0,87487479700/32700410799.,-10690763975/1880347072.,
+               701980252875/199316789632.,-1453857185/822651844.,69997945/29380423.])
+
+    def __init__(self,X,Y,rtol=1e-6,atol=1e-9,**kwargs):
+        """
+        Args:
+            X : X object data
+            Y : Y object data
+            rtol : relative tolerance (defaults to 1e-6)
+            atol : absolute tolerance, a number or [positionTolerance,velocityTolerance] (defaults to 1e-9)
+            kwargs : RungeKuttaIntegrator arguments
+        """
+        RungeKuttaIntegrator.__init__(self,X,Y,**kwargs)
+        self.rtol = rtol
+        if isinstance(atol,(list,tuple)):
+            self.atol = array(atol[0:2],dtype=float)
+        else:
+            self.atol = full(2,atol,dtype=float)
+        self.minimumStep = 1e-6*self.dt
+
+    def stateDerivative(self,state,model):
+        """Returns d[position,velocity]/dt of shape (n,2D), fields are sampled at boundary checked positions
+
+        Args:
+            state : numpy.array of shape (n,2D)
+            model : ForceModel of the n particles
+        """
+        d = state.shape[1]//2
+        points = self.BI.checkPointsVsBoundaries(state[:,0:d].copy())
+        return hstack((state[:,d:],model.acceleration(points,state[:,d:],self.sampleFields(points))))
+
+    def integrate(self,ensemble,stepList,store,checkpoint=None):
+        """Advances ensemble to the end of the last step in stepList, recording on the same grid as RungeKuttaIntegrator
+
+        The position recorded for stepList[k] is the position at stepList[k]+dt (as in the fixed step integrator).
+
+        Args:
+            ensemble : ParticleEnsemble object
+            stepList : numpy.array of step start times
+            store : TrajectoryStore, TrajectoryWriter or OutputPipeline
+            checkpoint : not supported, a note is printed if it is set
+        """
+        if checkpoint is not None:
+            print 'checkpoints are only written by the fixed step integrators\nrunning without checkpoints\n'
+        N = len(ensemble)
+        if self.statistics is not None:
+            self.statistics.start(N)
+        if len(stepList) == 0 or N == 0:
+            return
+        recordIndexes = [k for k in range(len(stepList)) if k % store.stride == 0]
+        recordTimes = stepList[recordIndexes]+self.dt
+        endTime = stepList[-1]+self.dt
+        model = self.compileForces(ensemble)
+        state = hstack((ensemble.positions,ensemble.velocities))
+        derivative = self.stateDerivative(state,model)
+        t = zeros(N)
+        h = full(N,self.dt)
+        pending = {}
+        for r,k in enumerate(recordIndexes):
+            active = flatnonzero(t < recordTimes[r])
+            while len(active) > 0:
+                self.profiledStep(active,t,h,state,derivative,model,endTime,ensemble,recordTimes,pending)
+                active = flatnonzero(t < recordTimes[r])
+            with profiler.phase('recording'):
+                store.record(k,stepList[k],pending.pop(r))
+            if self.progress is not None:
+                self.progress.update(k+1,N)
+        if len(recordIndexes) == 0 or recordTimes[-1] < endTime:
+            active = flatnonzero(t < endTime)
+            while len(active) > 0:
+                self.profiledStep(active,t,h,state,derivative,model,endTime,ensemble,recordTimes,pending)
+                active = flatnonzero(t < endTime)
+        d = ensemble.positions.shape[1]
+        ensemble.positions = state[:,0:d].copy()
+        ensemble.velocities = state[:,d:].copy()
+        self.finishStatistics(ensemble,stepList)
+
+    def profiledStep(self,active,*args):
+        """adaptiveStep timed as 'stepping', counting every attempted step"""
+        profiler.count('steps')
+        profiler.count('particleSteps',len(active))
+        with profiler.phase('stepping'):
+            self.adaptiveStep(active,*args)
+
+    def adaptiveStep(self,active,t,h,state,derivative,model,endTime,ensemble,recordTimes,pending):
+        """Attempts one step for the active particles, updating t, h, state and derivative in place
+
+        Accepted steps write their dense output positions for every record time they pass into pending.
+        """
+        activeModel = model.select(active)
+        y0 = state[active]
+        t0 = t[active]
+        step = minimum(h[active],endTime-t0)
+        hColumn = step[:,newaxis]
+        k = [derivative[active]]
+        for stage in range(1,7):
+            y1 = y0+hColumn*sum(a*ki for a,ki in zip(self.a[stage],k) if a != 0)
+            k.append(self.stateDerivative(y1,activeModel))
+        errorEstimate = hColumn*sum(e*ki for e,ki in zip(self.e,k) if e != 0)
+        d = y0.shape[1]//2
+        scale = self.atol.repeat(d)+self.rtol*maximum(absolute(y0),absolute(y1))
+        error = sqrt(((errorEstimate/scale)**2).mean(axis=1))
+
+        accepted = (error <= 1) | (step <= self.minimumStep)
+        factor = minimum(5.,maximum(0.2,0.9*maximum(error,1e-10)**-0.2))
+        h[active] = maximum(step*factor,self.minimumStep)
+        if not accepted.any():
+            return
+
+        acc = active[accepted]
+        y0, y1, step, t0 = y0[accepted], y1[accepted], step[accepted], t0[accepted]
+        k = [ki[accepted] for ki in k]
+        t1 = where(step >= endTime-t0,endTime,t0+step)
+        self.denseOutput(acc,t0,t1,step,y0,y1,k,ensemble,recordTimes,pending)
+
+        t[acc] = t1
+        positions = y1[:,0:d].copy()
+        self.BI.checkPointsVsBoundaries(positions,ensemble,acc)
+        moved = (positions != y1[:,0:d]).any(axis=1)
+        y1[:,0:d] = positions
+        state[acc] = y1
+        derivative[acc] = k[6]
+        if moved.any():
+            # First same as last doesn't hold after a boundary wrap or clamp
+            derivative[acc[moved]] = self.stateDerivative(y1[moved],model.select(acc[moved]))
+
+    def denseOutput(self,acc,t0,t1,step,y0,y1,k,ensemble,recordTimes,pending):
+        """Writes the boundary checked dense output positions at every record time in (t0,t1] into pending"""
+        first = searchsorted(recordTimes,t0,'right')
+        last = searchsorted(recordTimes,t1,'right')
+        if not (last > first).any():
+            return
+        hColumn = step[:,newaxis]
+        difference = y1-y0
+        bspl = hColumn*k[0]-difference
+        rcont4 = difference-hColumn*k[6]-bspl
+        rcont5 = hColumn*sum(d*ki for d,ki in zip(self.d,k) if d != 0)
+        for r in range(first.min(),last.max()):
+            inside = (first <= r) & (r < last)
+            if not inside.any():
+                continue
+            theta = minimum((recordTimes[r]-t0[inside])/step[inside],1.)[:,newaxis]
+            theta1 = 1-theta
+            y = y0[inside]+theta*(difference[inside]+theta1*(bspl[inside]+theta*(rcont4[inside]+theta1*rcont5[inside])))
+            d = y.shape[1]//2
+            if r not in pending:
+                pending[r] = empty((len(ensemble),d))
+            pending[r][acc[inside]] = self.BI.checkPointsVsBoundaries(y[:,0:d].copy())
@@ -0,0 +1,74 @@
+from numpy import concatenate
+from numpy import flatnonzero
+from numpy import where
+from numpy import zeros
+from ptspy.physical.particleEnsemble import ParticleEnsemble
+
+class EventDetector:
+    """Detects the particles that are done after a step (see RungeKuttaIntegrator.integrateActive)
+
+    Events, in increasing priority:
+        stagnation : speed below stagnationSpeed for stagnationSteps consecutive steps
+        capture : particle inside the capture mask (the 'captureMask' field channel is >= 0.5)
+        wall : particle pinned to a Y boundary (only if repeatY is off)
+        exit : particle pinned to the outlet at X.maxValue (only if repeatX is off)
+
+    The event name code, time and position are written into the ensemble (ParticleEnsemble.event,
+    eventTime, eventPositions). The event time is the label of the step the event happened in,
+    the same time the step is recorded under in the TrajectoryStore.
+
+    Attributes:
+        outletExit : bool, detect outlet exits (defaults to True)
+        wallCapture : bool, detect wall captures (defaults to False)
+        stagnationSpeed : speed threshold for stagnation, 0 disables it (defaults to 0)
+        stagnationSteps : integer of consecutive slow steps before stagnation (defaults to 1)
+        stagnantSteps : numpy.array of consecutive slow steps of every active particle
+    """
+    def __init__(self,outletExit=True,wallCapture=False,stagnationSpeed=0.,stagnationSteps=1):
+        self.outletExit = outletExit
+        self.wallCapture = wallCapture
+        self.stagnationSpeed = stagnationSpeed
+        self.stagnationSteps = max(int(stagnationSteps),1)
+        self.stagnantSteps = zeros(0,int)
+
+    def start(self,numberOfParticles):
+        """Resets the per-particle state before a run of numberOfParticles active particles"""
+        self.stagnantSteps = zeros(numberOfParticles,int)
+
+    def add(self,numberOfParticles):
+        """Appends the per-particle state of numberOfParticles newly active particles (eg. injected particles)"""
+        self.stagnantSteps = concatenate((self.stagnantSteps,zeros(numberOfParticles,int)))
+
+    def detect(self,ensemble,t,BI):
+        """Marks the events of the active ensemble after a step, returns the boolean mask of finished particles
+
+        The per-particle state is compacted to the particles that are still active.
+
+        Args:
+            ensemble : ParticleEnsemble of the active particles
+            t : time of the step
+            BI : interpolation object with the boundaries and field channels
+        """
+        names = ParticleEnsemble.eventNames
+        x, y = ensemble.positions[:,0], ensemble.positions[:,1]
+        event = zeros(len(ensemble),int)
+        if self.stagnationSpeed > 0:
+            slow = (ensemble.velocities**2).sum(axis=1) < self.stagnationSpeed**2
+            self.stagnantSteps = where(slow,self.stagnantSteps+1,0)
+            event[self.stagnantSteps >= self.stagnationSteps] = names.index('stagnation')
+        if 'captureMask' in BI.channels:
+            mask = BI.interpolateBatch(ensemble.positions,BI.buildNearestIndexesBatch(ensemble.positions),'captureMask')
+            event[mask[:,0] >= 0.5] = names.index('capture')
+        if self.wallCapture and not BI.repeatY:
+            event[(y <= BI.Y.minValue) | (y >= BI.Y.maxValue-(1e-5*BI.Y.maxValue))] = names.index('wall')
+        if self.outletExit and not BI.repeatX:
+            event[x >= BI.X.maxValue-(1e-5*BI.X.maxValue)] = names.index('exit')
+
+        finished = event > 0
+        if finished.any():
+            done = flatnonzero(finished)
+            ensemble.event[done] = event[done]
+            ensemble.eventTime[done] = t
+            ensemble.eventPositions[done] = ensemble.positions[done]
+            self.stagnantSteps = self.stagnantSteps[~finished]
+        return finished
@@ -0,0 +1,52 @@
+from numpy import exp
+from numpy import expm1
+from ptspy.simulator.rungeKuttaIntegrator import RungeKuttaIntegrator
+
+class ExponentialIntegrator(RungeKuttaIntegrator):
+    """2nd order exponential (drag exact) integrator for stiff Stokes relaxation
+
+    With the fields frozen over a step, dv/dt = (terminalVelocity-v)/tau where
+    terminalVelocity = fluidVelocity + (DEP+weight)/(6*pi*viscosity*radius) and tau = mass/(6*pi*viscosity*radius).
+    The linear drag term is integrated exactly:
+
+        v(t+h) = terminalVelocity + (v-terminalVelocity)*exp(-h/tau)
+        x(t+h) = x + terminalVelocity*h + (v-terminalVelocity)*tau*(1-exp(-h/tau))
+
+    The fields are sampled at the start and at the predicted midpoint (exponential midpoint rule),
+    so the update stays stable for dt much larger than tau without checkParticleVsTerminalVelocity.
+    Falls back to the Runge-Kutta step when stokes is disabled (there is no relaxation to integrate).
+    """
+    def ensembleStep(self,ensemble,model=None):
+        """Exponential midpoint step for every particle of a ParticleEnsemble, returns the new positions
+
+        Args:
+            ensemble : ParticleEnsemble object
+            model : ForceModel of ensemble (defaults to compiling it, see compileForces)
+        """
+        if model is None:
+            model = self.compileForces(ensemble)
+        if model.drag is None:
+            return RungeKuttaIntegrator.ensembleStep(self,ensemble,model)
+        chkPvsBnd = self.BI.checkPointsVsBoundaries
+        dt = self.dt
+
+        tau = model.mass/model.drag
+        positions, velocities = ensemble.positions, ensemble.velocities
+
+        terminalVelocity = self.terminalVelocity(positions,model)
+        positionTmp = positions+terminalVelocity*dt/2-(velocities-terminalVelocity)*tau*expm1(-dt/2/tau)
+
+        positionTmp = chkPvsBnd(positionTmp)
+        terminalVelocityTmp = self.terminalVelocity(positionTmp,model)
+
+        ensemble.velocities = terminalVelocityTmp+(velocities-terminalVelocityTmp)*exp(-dt/tau)
+        return chkPvsBnd(positions+terminalVelocityTmp*dt-(velocities-terminalVelocityTmp)*tau*expm1(-dt/tau),ensemble=ensemble)
+
+    def terminalVelocity(self,positions,model):
+        """Returns the local terminal velocity of shape (N,D) (see ForceModel.terminalVelocity)
+
+        Args:
+            positions : numpy.array of shape (N,D) inside the boundaries
+            model : ForceModel of the particles
+        """
+        return model.terminalVelocity(self.sampleFields(positions))
@@ -0,0 +1,68 @@
+import csv
+from numpy import full
+from numpy import nan
+from numpy import zeros
+from ptspy.physical.particleEnsemble import ParticleEnsemble
+
+class InjectionLog:
+    """Outcome of every injected particle of a continuous injection run (see RungeKuttaIntegrator.integrateInjection)
+
+    The injection time and position of the particle in every slot are kept until it finishes, then its
+    row is written to fileName and the slot is free again. Only the counts are kept in memory, so the
+    log doesn't grow with the number of injected particles.
+
+    Attributes:
+        fileName : string of the .csv file of one row per finished particle ('' keeps the counts only)
+        injected : integer of particles written into a slot
+        dropped : integer of arriving particles dropped because every slot was in use
+        finished : numpy.array of the finished particles per event code (see ParticleEnsemble.eventNames)
+    """
+    def __init__(self,slots,dimensions=2,fileName=''):
+        self.fileName = fileName
+        self.dimensions = dimensions
+        self.particleIds = full(slots,-1,int)
+        self.injectionTime = full(slots,nan)
+        self.injectionPositions = full((slots,dimensions),nan)
+        self.injected = 0
+        self.dropped = 0
+        self.finished = zeros(len(ParticleEnsemble.eventNames),int)
+        self.outFile, self.writer = None, None
+        if fileName:
+            axes = 'xyz'[0:dimensions]
+            self.outFile = open(fileName,'wb')
+            self.writer = csv.writer(self.outFile)
+            self.writer.writerow(['particle','slot','injectionTime']+[axis+'0' for axis in axes]+['radius','DEPFactor',
+                                 'event','eventTime']+list(axes))
+
+    def inject(self,slots,t,ensemble):
+        """Records the particles just written into slots of ensemble at time t, naming them injected<id>"""
+        ids = range(self.injected,self.injected+len(slots))
+        self.particleIds[slots] = ids
+        self.injectionTime[slots] = t
+        self.injectionPositions[slots] = ensemble.positions[slots]
+        for slot,particleId in zip(slots,ids):
+            ensemble.names[slot] = 'injected'+str(particleId)
+        self.injected += len(slots)
+
+    def finish(self,slots,ensemble):
+        """Writes the rows of the finished particles in slots of ensemble"""
+        for slot in slots:
+            self.finished[ensemble.event[slot]] += 1
+            if self.writer is not None:
+                self.writer.writerow([self.particleIds[slot],slot,self.injectionTime[slot]]+
+                                     list(self.injectionPositions[slot])+[ensemble.radius[slot],ensemble.DEPFactor[slot],
+                                     ParticleEnsemble.eventNames[ensemble.event[slot]],ensemble.eventTime[slot]]+
+                                     list(ensemble.eventPositions[slot]))
+        self.particleIds[slots] = -1
+
+    def close(self):
+        if self.outFile is not None:
+            self.outFile.close()
+            self.outFile, self.writer = None, None
+
+    def summary(self):
+        """Returns a short report of the injected, dropped, finished and in flight particles"""
+        names = ParticleEnsemble.eventNames
+        finished = ', '.join('%s %d' % (names[code],self.finished[code]) for code in range(1,len(names)) if self.finished[code])
+        return "Injected %d particles (%d dropped, no free slot), %d finished (%s), %d in flight" % (
+            self.injected,self.dropped,self.finished.sum(),finished or 'none',(self.particleIds >= 0).sum())
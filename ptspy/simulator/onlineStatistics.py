@@ -0,0 +1,454 @@
+import json
+from numpy import array
+from numpy import bincount
+from numpy import concatenate
+from numpy import inf
+from numpy import linspace
+from numpy import maximum
+from numpy import minimum
+from numpy import nan
+from numpy import newaxis
+from numpy import ones
+from numpy import searchsorted
+from numpy import where
+from numpy import zeros
+from ptspy.physical.particleEnsemble import ParticleEnsemble
+
+class OnlineStatistics:
+    """Streaming outcome statistics of a run, updated inside the step loop in constant memory
+
+    Every particle is split into a DEPFactor class by classEdges (eg. [0] gives 'DEPFactor<0' and
+    'DEPFactor>=0', DEPFactor includes voltageScale). The accumulators see every step of the active
+    particles (step) and the outcome of every particle once (outcome), either when its event is detected
+    or at the end of the run (event 'none'). An outcome holds the event code, the event (or final)
+    position 'x','y'(,'z'), 'time', 'residenceTime' (time from the start of its first step to the end
+    of its last step), 'DEPFactor' and 'class' of every particle.
+
+    Accumulators are pluggable, any object with the methods of Accumulator can be added.
+    EventCounts is always the first accumulator.
+
+    Attributes:
+        accumulators : list of Accumulator objects
+        classEdges : numpy.array of the DEPFactor class edges
+        dt : time step of the run
+    """
+    def __init__(self,accumulators=(),classEdges=(0,),dt=0.):
+        self.accumulators = [EventCounts('events')]+list(accumulators)
+        self.classEdges = array(classEdges,dtype=float)
+        self.dt = dt
+
+    def classNames(self):
+        """Returns the list of the DEPFactor class names"""
+        edges = ['%g' % edge for edge in self.classEdges]
+        if len(edges) == 0:
+            return ['all']
+        return (['DEPFactor<'+edges[0]]+['%s<=DEPFactor<%s' % pair for pair in zip(edges[:-1],edges[1:])]+
+                ['DEPFactor>='+edges[-1]])
+
+    def start(self,numberOfParticles):
+        """Resets every accumulator before a run of numberOfParticles active particles"""
+        for accumulator in self.accumulators:
+            accumulator.start(numberOfParticles,self.classEdges,self.dt)
+
+    def add(self,numberOfParticles):
+        """Appends the per-particle state of numberOfParticles newly active particles (eg. injected particles)"""
+        for accumulator in self.accumulators:
+            accumulator.add(numberOfParticles)
+
+    def step(self,t,previousPositions,ensemble,finished=None):
+        """Updates the accumulators after the step at time t of the active ensemble
+
+        Args:
+            t : time of the step
+            previousPositions : numpy.array of shape (N,D) of the positions before the step
+            ensemble : ParticleEnsemble of the active particles after the step
+            finished : boolean numpy.array of the particles that finished in the step, their per-particle
+                       state is dropped (None if events aren't detected)
+        """
+        for accumulator in self.accumulators:
+            accumulator.step(t,previousPositions,ensemble,finished)
+
+    def outcome(self,ensemble,startTimes,endTime):
+        """Records the outcome of every particle of ensemble, its event or still in flight at endTime (event 'none')
+
+        Args:
+            ensemble : ParticleEnsemble of the particles
+            startTimes : time of the first step of every particle (a number or numpy.array of shape (N,))
+            endTime : time of the last step of the run
+        """
+        if len(ensemble) == 0:
+            return
+        done = ensemble.event > 0
+        positions = where(done[:,newaxis],ensemble.eventPositions,ensemble.positions)
+        times = where(done,ensemble.eventTime,endTime)
+        outcomes = {"event":ensemble.event,"time":times,"residenceTime":times+self.dt-startTimes,
+                    "DEPFactor":ensemble.DEPFactor,"class":searchsorted(self.classEdges,ensemble.DEPFactor,'right')}
+        for axis,name in enumerate('xyz'[0:positions.shape[1]]):
+            outcomes[name] = positions[:,axis]
+        for accumulator in self.accumulators:
+            accumulator.outcome(outcomes)
+
+    def merge(self,statistics):
+        """Adds the accumulated values of the same statistics of another run (eg. a shard)"""
+        for accumulator,other in zip(self.accumulators,statistics.accumulators):
+            accumulator.merge(other)
+
+    def saveState(self):
+        """Returns the state of every accumulator as a dictionary of numpy.arrays (see simulator.Checkpoint)"""
+        state = {}
+        for index,accumulator in enumerate(self.accumulators):
+            state.update(('%d_%s' % (index,name),value) for name,value in accumulator.saveState().items())
+        return state
+
+    def loadState(self,state):
+        """Restores the state of saveState"""
+        for index,accumulator in enumerate(self.accumulators):
+            prefix = '%d_' % index
+            accumulator.loadState(dict((name[len(prefix):],value) for name,value in state.items() if name.startswith(prefix)))
+
+    def report(self):
+        """Returns the final values as a dictionary of the class names and the report of every accumulator by name"""
+        report = {"classes":self.classNames()}
+        for accumulator in self.accumulators:
+            report[accumulator.name] = accumulator.report(self.classNames())
+        return report
+
+    def summary(self):
+        """Returns a compact text report of the outcome counts and every accumulator"""
+        lines = []
+        for accumulator in self.accumulators:
+            lines.extend(accumulator.summary(self.classNames()))
+        return '\n'.join(lines)
+
+    def writeReport(self,fileName):
+        """Writes report() as a .json file"""
+        with open(fileName,'w') as outFile:
+            json.dump(self.report(),outFile,indent=1,sort_keys=True)
+
+class Accumulator:
+    """Base class of the OnlineStatistics accumulators, every method does nothing
+
+    Attributes:
+        name : string of the accumulator in the report
+        event : name of the event whose outcomes are accumulated ('any' for every outcome)
+    """
+    def __init__(self,name,event='any'):
+        self.name = name
+        self.event = event
+
+    def start(self,numberOfParticles,classEdges,dt):
+        self.classes = len(classEdges)+1
+
+    def add(self,numberOfParticles):
+        pass
+
+    def step(self,t,previousPositions,ensemble,finished):
+        pass
+
+    def outcome(self,outcomes):
+        pass
+
+    def merge(self,other):
+        pass
+
+    def saveState(self):
+        return {}
+
+    def loadState(self,state):
+        pass
+
+    def report(self,classNames):
+        return {}
+
+    def summary(self,classNames):
+        return []
+
+    def selected(self,outcomes):
+        """Returns the boolean mask of the outcomes of self.event"""
+        if self.event == 'any':
+            return outcomes["event"] >= 0
+        return outcomes["event"] == ParticleEnsemble.eventNames.index(self.event)
+
+class EventCounts(Accumulator):
+    """Number of particles per DEPFactor class and event (including 'none' for particles still in flight)"""
+    def start(self,numberOfParticles,classEdges,dt):
+        Accumulator.start(self,numberOfParticles,classEdges,dt)
+        self.counts = zeros((self.classes,len(ParticleEnsemble.eventNames)),int)
+
+    def outcome(self,outcomes):
+        events = len(ParticleEnsemble.eventNames)
+        self.counts += bincount(outcomes["class"]*events+outcomes["event"],minlength=self.classes*events).reshape(self.counts.shape)
+
+    def merge(self,other):
+        self.counts += other.counts
+
+    def saveState(self):
+        return {"counts":self.counts}
+
+    def loadState(self,state):
+        if "counts" in state:
+            self.counts = state["counts"].copy()
+
+    def report(self,classNames):
+        return dict((name,dict(zip(ParticleEnsemble.eventNames,counts.tolist()))) for name,counts in zip(classNames,self.counts))
+
+    def summary(self,classNames):
+        names = ParticleEnsemble.eventNames
+        return ['%s: %d particles (%s)' % (name,counts.sum(),', '.join('%s %d' % (names[code],counts[code])
+                for code in range(len(names)) if counts[code])) for name,counts in zip(classNames,self.counts)]
+
+class Histogram(Accumulator):
+    """Histogram of one quantity of the outcomes of an event per DEPFactor class (eg. the outlet y or the residence time)
+
+    Values below and above range are counted as underflow and overflow.
+    """
+    def __init__(self,name,quantity='y',bins=20,range=(0.,1.),event='exit'):
+        Accumulator.__init__(self,name,event)
+        self.quantity = quantity
+        self.edges = linspace(range[0],range[1],int(bins)+1)
+
+    def start(self,numberOfParticles,classEdges,dt):
+        Accumulator.start(self,numberOfParticles,classEdges,dt)
+        self.counts = zeros((self.classes,len(self.edges)+1),int)
+
+    def outcome(self,outcomes):
+        self.accumulate(outcomes[self.quantity],outcomes["class"],self.selected(outcomes))
+
+    def accumulate(self,values,classes,selected):
+        values, classes = values[selected], classes[selected]
+        # 0 is the underflow and len(edges) the overflow, the last edge belongs to the last bin
+        index = searchsorted(self.edges,values,'right')
+        index[values == self.edges[-1]] = len(self.edges)-1
+        columns = self.counts.shape[1]
+        self.counts += bincount(classes*columns+index,minlength=self.classes*columns).reshape(self.counts.shape)
+
+    def merge(self,other):
+        self.counts += other.counts
+
+    def saveState(self):
+        return {"counts":self.counts}
+
+    def loadState(self,state):
+        if "counts" in state:
+            self.counts = state["counts"].copy()
+
+    def report(self,classNames):
+        report = {"quantity":self.quantity,"event":self.event,"edges":self.edges.tolist()}
+        for name,counts in zip(classNames,self.counts):
+            report[name] = {"counts":counts[1:-1].tolist(),"underflow":int(counts[0]),"overflow":int(counts[-1])}
+        return report
+
+    def summary(self,classNames):
+        return ['%s (%s of %s): %s' % (self.name,self.quantity,self.event,', '.join('%s %d' % (name,counts.sum())
+                for name,counts in zip(classNames,self.counts)))]
+
+class RunningMoments(Accumulator):
+    """Count, mean, standard deviation, minimum and maximum of one quantity of the outcomes of an event per DEPFactor class
+
+    Batches are combined with the parallel variance update of Chan et al., shards merge to the values of one run up to rounding.
+    """
+    def __init__(self,name,quantity='y',event='exit'):
+        Accumulator.__init__(self,name,event)
+        self.quantity = quantity
+
+    def start(self,numberOfParticles,classEdges,dt):
+        Accumulator.start(self,numberOfParticles,classEdges,dt)
+        self.moments = zeros((self.classes,3))
+        self.minimum = zeros(self.classes)+inf
+        self.maximum = zeros(self.classes)-inf
+
+    def outcome(self,outcomes):
+        self.accumulate(outcomes[self.quantity],outcomes["class"],self.selected(outcomes))
+
+    def accumulate(self,values,classes,selected):
+        values, classes = values[selected], classes[selected]
+        batch = zeros((self.classes,3))
+        batch[:,0] = bincount(classes,minlength=self.classes)
+        seen = batch[:,0] > 0
+        batch[seen,1] = bincount(classes,values,self.classes)[seen]/batch[seen,0]
+        batch[:,2] = bincount(classes,(values-batch[classes,1])**2,self.classes)
+        self.combine(batch)
+        minimum.at(self.minimum,classes,values)
+        maximum.at(self.maximum,classes,values)
+
+    def combine(self,batch):
+        """Adds the [count,mean,M2] rows of batch into self.moments"""
+        n, nb = self.moments[:,0], batch[:,0]
+        total = n+nb
+        seen = total > 0
+        delta = batch[:,1]-self.moments[:,1]
+        self.moments[seen,1] += delta[seen]*nb[seen]/total[seen]
+        self.moments[seen,2] += batch[seen,2]+delta[seen]**2*n[seen]*nb[seen]/total[seen]
+        self.moments[:,0] = total
+
+    def merge(self,other):
+        self.combine(other.moments)
+        self.minimum = minimum(self.minimum,other.minimum)
+        self.maximum = maximum(self.maximum,other.maximum)
+
+    def saveState(self):
+        return {"moments":self.moments,"minimum":self.minimum,"maximum":self.maximum}
+
+    def loadState(self,state):
+        if "moments" in state:
+            self.moments, self.minimum, self.maximum = state["moments"].copy(), state["minimum"].copy(), state["maximum"].copy()
+
+    def values(self):
+        """Returns numpy.arrays (count,mean,std,minimum,maximum) per class, nan without values"""
+        count = self.moments[:,0]
+        seen = count > 0
+        mean = where(seen,self.moments[:,1],nan)
+        std = where(seen,(self.moments[:,2]/maximum(count,1))**0.5,nan)
+        return count, mean, std, where(seen,self.minimum,nan), where(seen,self.maximum,nan)
+
+    def report(self,classNames):
+        report = {"quantity":self.quantity,"event":self.event}
+        for name,values in zip(classNames,zip(*self.values())):
+            report[name] = dict(zip(["count","mean","std","min","max"],[int(values[0])]+[jsonNumber(v) for v in values[1:]]))
+        return report
+
+    def summary(self,classNames):
+        count, mean, std = self.values()[0:3]
+        return ['%s (%s of %s): %s' % (self.name,self.quantity,self.event,', '.join('%s %.4g +- %.3g (%d)' % (name,m,s,n)
+                for name,n,m,s in zip(classNames,count,mean,std)))]
+
+class CrossingDetector(Accumulator):
+    """First crossing of every particle through the plane x = position (moving towards +x)
+
+    The crossing point and time are interpolated linearly within the step. Counts and the histogram of
+    the crossing y per DEPFactor class, and the moments of the crossing time, are accumulated.
+    Crossings are only seen by the fixed step integrators.
+    """
+    def __init__(self,name,position,bins=20,range=(0.,1.)):
+        Accumulator.__init__(self,name)
+        self.position = position
+        self.histogram = Histogram(name,'y',bins,range,'any')
+        self.times = RunningMoments(name,'time','any')
+
+    def start(self,numberOfParticles,classEdges,dt):
+        Accumulator.start(self,numberOfParticles,classEdges,dt)
+        self.classEdges, self.dt = classEdges, dt
+        self.histogram.start(numberOfParticles,classEdges,dt)
+        self.times.start(numberOfParticles,classEdges,dt)
+        self.crossed = zeros(numberOfParticles,bool)
+
+    def add(self,numberOfParticles):
+        self.crossed = concatenate((self.crossed,zeros(numberOfParticles,bool)))
+
+    def step(self,t,previousPositions,ensemble,finished):
+        x0, x1 = previousPositions[:,0], ensemble.positions[:,0]
+        hit = (~self.crossed) & (x0 < self.position) & (x1 >= self.position)
+        if hit.any():
+            fraction = (self.position-x0[hit])/(x1[hit]-x0[hit])
+            y = previousPositions[hit,1]+fraction*(ensemble.positions[hit,1]-previousPositions[hit,1])
+            classes = searchsorted(self.classEdges,ensemble.DEPFactor[hit],'right')
+            selected = ones(len(y),bool)
+            self.histogram.accumulate(y,classes,selected)
+            self.times.accumulate(t+fraction*self.dt,classes,selected)
+            self.crossed[hit] = True
+        if finished is not None:
+            self.crossed = self.crossed[~finished]
+
+    def merge(self,other):
+        self.histogram.merge(other.histogram)
+        self.times.merge(other.times)
+
+    def saveState(self):
+        state = {"crossed":self.crossed}
+        state.update(('histogram_'+name,value) for name,value in self.histogram.saveState().items())
+        state.update(('times_'+name,value) for name,value in self.times.saveState().items())
+        return state
+
+    def loadState(self,state):
+        if "crossed" in state:
+            self.crossed = state["crossed"].copy()
+        self.histogram.loadState(dict((name[10:],value) for name,value in state.items() if name.startswith('histogram_')))
+        self.times.loadState(dict((name[6:],value) for name,value in state.items() if name.startswith('times_')))
+
+    def report(self,classNames):
+        report = self.histogram.report(classNames)
+        del report["quantity"], report["event"]
+        times = self.times.report(classNames)
+        report["x"] = self.position
+        for name in classNames:
+            report[name]["time"] = times[name]
+        return report
+
+    def summary(self,classNames):
+        count, mean = self.times.values()[0:2]
+        return ['%s (crossing x=%g): %s' % (self.name,self.position,', '.join('%s %d at t=%.4g' % (name,n,m)
+                for name,n,m in zip(classNames,count,mean)))]
+
+class SeparationMetrics(Accumulator):
+    """Separation efficiency and purity of a two outlet split at y = splitY
+
+    Outcomes of the event (eg. 'exit') below splitY go to outlet 0 and the others to outlet 1.
+    targets[c] is the outlet DEPFactor class c should reach. The efficiency of a class is the fraction
+    of all its particles (every outcome) that reached its target, the purity is the fraction of the
+    particles in its target outlet that belong to it.
+    """
+    def __init__(self,name,splitY,targets=(0,1),event='exit'):
+        Accumulator.__init__(self,name,event)
+        self.splitY = splitY
+        self.targets = list(targets)
+
+    def start(self,numberOfParticles,classEdges,dt):
+        Accumulator.start(self,numberOfParticles,classEdges,dt)
+        if len(self.targets) != self.classes:
+            raise ValueError("separation %s needs one target outlet per DEPFactor class (%d)" % (self.name,self.classes))
+        self.counts = zeros((self.classes,2),int)
+        self.totals = zeros(self.classes,int)
+
+    def outcome(self,outcomes):
+        selected = self.selected(outcomes)
+        outlet = (outcomes["y"][selected] >= self.splitY).astype(int)
+        self.counts += bincount(outcomes["class"][selected]*2+outlet,minlength=self.classes*2).reshape(self.counts.shape)
+        self.totals += bincount(outcomes["class"],minlength=self.classes)
+
+    def merge(self,other):
+        self.counts += other.counts
+        self.totals += other.totals
+
+    def saveState(self):
+        return {"counts":self.counts,"totals":self.totals}
+
+    def loadState(self,state):
+        if "counts" in state:
+            self.counts, self.totals = state["counts"].copy(), state["totals"].copy()
+
+    def values(self):
+        """Returns numpy.arrays (efficiency,purity) per class, nan without particles"""
+        classes = range(self.classes)
+        reached = self.counts[classes,self.targets].astype(float)
+        inTarget = self.counts.sum(axis=0)[self.targets]
+        efficiency = where(self.totals > 0,reached/maximum(self.totals,1),nan)
+        purity = where(inTarget > 0,reached/maximum(inTarget,1),nan)
+        return efficiency, purity
+
+    def report(self,classNames):
+        efficiency, purity = self.values()
+        report = {"splitY":self.splitY,"event":self.event}
+        for c,name in enumerate(classNames):
+            report[name] = {"target":self.targets[c],"outlets":self.counts[c].tolist(),"total":int(self.totals[c]),
+                            "efficiency":jsonNumber(efficiency[c]),"purity":jsonNumber(purity[c])}
+        return report
+
+    def summary(self,classNames):
+        efficiency, purity = self.values()
+        return ['%s (split y=%g): %s' % (self.name,self.splitY,', '.join('%s efficiency %.3f purity %.3f' % values
+                for values in zip(classNames,efficiency,purity)))]
+
+# Accumulator classes of the statistics_data "type" names
+accumulatorTypes = {'histogram':Histogram,'moments':RunningMoments,'crossing':CrossingDetector,'separation':SeparationMetrics}
+
+def buildAccumulator(spec):
+    """Returns the accumulator of a statistics_data.accumulators entry, eg. {"type":"histogram","name":"outletY","quantity":"y"}"""
+    spec = dict(spec)
+    accumulatorType = spec.pop("type")
+    if accumulatorType not in accumulatorTypes:
+        raise ValueError("unknown accumulator type '%s'" % accumulatorType)
+    return accumulatorTypes[accumulatorType](**dict((str(key),value) for key,value in spec.items()))
+
+def jsonNumber(value):
+    """Returns value as a float, None for nan (json has no nan)"""
+    return None if value != value else float(value)
@@ -0,0 +1,293 @@
+import sys
+from os import rename
+from os.path import splitext
+from Queue import Empty
+from Queue import Queue
+from threading import Event
+from threading import Lock
+from threading import Thread
+from timeit import default_timer
+from numpy import empty
+from numpy import full
+from numpy import nan
+from numpy import roll
+from ptspy.simulator.profiler import profiler
+
+class ProgressReport:
+    """Progress of a run, updated by the integrator every step (see RungeKuttaIntegrator.progress)
+
+    update only stores two integers, the rates and the ETA are worked out by the OutputPipeline thread
+    that prints the report. They are measured from the first update, so a resumed run doesn't count the
+    steps of the checkpoint.
+
+    Attributes:
+        numberOfSteps : integer of the steps of the whole run
+        stepIndex : integer of the steps done so far
+        active : integer of the particles still stepped
+        label : string printed before every report line (eg. the shard of a sharded run)
+    """
+    def __init__(self,numberOfSteps,numberOfParticles,label=''):
+        self.numberOfSteps = numberOfSteps
+        self.stepIndex = 0
+        self.active = numberOfParticles
+        self.label = label
+        self.firstStep = None
+        self.firstTime = None
+
+    def update(self,stepIndex,active):
+        """Records that stepIndex steps are done and active particles are still stepped"""
+        if self.firstStep is None:
+            self.firstStep, self.firstTime = stepIndex, default_timer()
+        self.stepIndex = stepIndex
+        self.active = active
+
+    def line(self):
+        """Returns the report line: steps done, steps per second, active particles and the estimated time left"""
+        stepIndex, active = self.stepIndex, self.active
+        percent = 100.*stepIndex/self.numberOfSteps if self.numberOfSteps > 0 else 100.
+        rate, eta = 0., '?'
+        if self.firstStep is not None and default_timer() > self.firstTime:
+            rate = (stepIndex-self.firstStep)/(default_timer()-self.firstTime)
+            if rate > 0:
+                seconds = int((self.numberOfSteps-stepIndex)/rate)
+                eta = '%d:%02d:%02d' % (seconds//3600,seconds//60 % 60,seconds % 60)
+        return "%sstep %d of %d (%.0f%%), %.0f steps/s, %d active particles, ETA %s" % (
+            self.label,stepIndex,self.numberOfSteps,percent,rate,active,eta)
+
+class LiveView:
+    """Live trajectory view, rendered off screen by an OutputPipeline thread into fileName
+
+    Every seconds the last trail records of every particle are drawn with Plot.frame, and fileName is
+    replaced atomically, so an image viewer that reloads it shows the run as an animation. The frames are
+    drawn on a matplotlib Figure with the Agg canvas, without pyplot, so they don't need the main thread.
+
+    Attributes:
+        plot : Plot object (decimation settings of the trails)
+        fileName : string of the .png or .svg file of the frames
+        limits : (xmin,xmax,ymin,ymax) of the axes
+        trail : integer of the records drawn per particle
+        seconds : wall time between frames
+    """
+    def __init__(self,plot,fileName,limits,trail=200,seconds=5.):
+        self.plot = plot
+        self.fileName = fileName
+        self.limits = limits
+        self.trail = max(int(trail),2)
+        self.seconds = seconds
+        self.figure = None
+
+    def render(self,trails,DEPFactor,title):
+        """Draws trails (numpy.array of shape (T,N,D), oldest first) colored by the sign of DEPFactor and replaces fileName"""
+        if self.figure is None:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            self.figure = Figure()
+            FigureCanvasAgg(self.figure)
+        self.plot.frame(self.figure,self.limits,trails,DEPFactor < 0,title)
+        name, extension = splitext(self.fileName)
+        extension = extension or '.png'
+        self.figure.savefig(name+'.tmp'+extension,format=extension[1:])
+        rename(name+'.tmp'+extension,name+extension)
+
+class OutputPipeline:
+    """Background output of a run: the recorded steps go through a bounded queue to a writer thread
+
+    Stands in for the TrajectoryStore (or TrajectoryWriter) of a run. record copies the positions into a
+    block of blockSize records, full blocks are queued and the writer thread hands them to the store, so
+    the TrajectoryWriter compresses and writes its block files while the integrator keeps stepping.
+    There are queueBlocks+1 block buffers, recycled once written: when the writer falls queueBlocks blocks
+    behind, record waits for a free buffer (counted as 'outputWaits' by the profiler), which keeps memory
+    bounded. A second thread prints the ProgressReport every progressSeconds and renders the LiveView.
+
+    Errors of the writer thread are raised again in the integrator's thread by the next record or by close.
+
+    Attributes:
+        store : TrajectoryStore, TrajectoryWriter or NullTrajectoryStore the records are written to
+        stride : integer record stride of store
+        progress : ProgressReport object, update it from the integrator
+        progressSeconds : wall time between progress reports (0 disables them)
+        live : LiveView object, or None
+    """
+    def __init__(self,store,progress,ensemble,blockSize=100,queueBlocks=4,progressSeconds=0.,live=None):
+        """
+        Args:
+            store : TrajectoryStore, TrajectoryWriter or NullTrajectoryStore
+            progress : ProgressReport object
+            ensemble : ParticleEnsemble of the run (its DEPFactor colors the live view)
+            blockSize : integer of the records per queued block (defaults to 100)
+            queueBlocks : integer of the blocks queued at most (defaults to 4)
+            progressSeconds : wall time between progress reports, 0 disables them (defaults to 0)
+            live : LiveView object, or None (defaults to None)
+        """
+        self.store = store
+        self.stride = store.stride
+        self.progress = progress
+        self.progressSeconds = progressSeconds
+        self.live = live
+        self.ensemble = ensemble
+        numberOfParticles, dimensions = ensemble.positions.shape
+        blockSize = max(int(blockSize),1)
+        self.queue = Queue()
+        self.free = Queue()
+        if self.stride < sys.maxint:
+            for _ in range(max(int(queueBlocks),1)+1):
+                self.free.put(Block(blockSize,numberOfParticles,dimensions))
+        self.block = None
+        self.error = None
+        self.trails = None
+        self.records = 0
+        self.trailLock = Lock()
+        if live is not None:
+            self.trails = full((live.trail,numberOfParticles,dimensions),nan)
+        self.done = Event()
+        self.writer = Thread(target=self.write,name='trajectory writer')
+        self.writer.daemon = True
+        self.writer.start()
+        self.monitor = None
+        if progressSeconds > 0 or live is not None:
+            self.monitor = Thread(target=self.watch,name='progress report')
+            self.monitor.daemon = True
+            self.monitor.start()
+
+    def record(self,stepIndex,t,positions):
+        """Copies positions into the current block if stepIndex falls on the record stride, queueing full blocks
+
+        Args:
+            stepIndex : integer index of the integration step
+            t : time of the step
+            positions : numpy.array of shape (N,2)
+        """
+        if self.stride == sys.maxint:
+            # NullTrajectoryStore, there are no block buffers and nothing to record
+            return
+        if stepIndex % self.stride == 0:
+            if self.error is not None:
+                self.raiseError()
+            if self.block is None:
+                try:
+                    self.block = self.free.get_nowait()
+                except Empty:
+                    profiler.count('outputWaits')
+                    self.block = self.free.get()
+            block = self.block
+            block.positions[block.count] = positions
+            block.times[block.count] = t
+            block.steps[block.count] = stepIndex
+            block.count += 1
+            if block.count == len(block.times):
+                self.queue.put(block)
+                self.block = None
+
+    def flush(self):
+        """Queues the records of the current block"""
+        if self.block is not None and self.block.count > 0:
+            self.queue.put(self.block)
+            self.block = None
+
+    def write(self):
+        """Writer thread, hands the queued blocks to the store until the None block, then closes the store"""
+        while True:
+            block = self.queue.get()
+            try:
+                if block is None:
+                    if self.error is None:
+                        self.store.close()
+                    return
+                if self.error is None:
+                    for k in range(block.count):
+                        self.store.record(block.steps[k],block.times[k],block.positions[k])
+                    if self.trails is not None:
+                        self.keepTrails(block)
+            except:
+                self.error = sys.exc_info()
+            finally:
+                if block is not None:
+                    block.count = 0
+                    self.free.put(block)
+                self.queue.task_done()
+
+    def keepTrails(self,block):
+        """Keeps the last records of block in the ring buffer of the live view"""
+        with self.trailLock:
+            length = len(self.trails)
+            for k in range(max(block.count-length,0),block.count):
+                self.trails[self.records % length] = block.positions[k]
+                self.records += 1
+
+    def watch(self):
+        """Progress thread, prints the progress report and renders the live view until the run is closed"""
+        seconds = [s for s in [self.progressSeconds,self.live.seconds if self.live is not None else 0] if s > 0]
+        interval = min(seconds) if seconds else 1.
+        nextReport = nextFrame = default_timer()+interval
+        while not self.done.wait(interval):
+            now = default_timer()
+            if self.progressSeconds > 0 and now >= nextReport:
+                print self.report()
+                nextReport = now+self.progressSeconds
+            if self.live is not None and now >= nextFrame:
+                self.renderFrame()
+                nextFrame = now+self.live.seconds
+
+    def report(self):
+        """Returns the progress report line with the output queue filling"""
+        return "%s, output queue %d blocks" % (self.progress.line(),self.queue.qsize())
+
+    def renderFrame(self):
+        """Renders the live view of the trails kept so far (errors are printed, the run goes on)"""
+        with self.trailLock:
+            if self.records == 0:
+                return
+            trails = self.trails.copy()
+            if self.records >= len(trails):
+                trails = roll(trails,-(self.records % len(trails)),axis=0)
+            else:
+                trails = trails[0:self.records]
+        try:
+            self.live.render(trails,self.ensemble.DEPFactor,
+                             '%d Particle Trajectories (step %d)' % (trails.shape[1],self.progress.stepIndex))
+        except Exception as e:
+            print 'live view not rendered: %s' % e
+
+    def saveState(self):
+        """Waits for every queued record to be written, returns store.saveState() (see simulator.Checkpoint)"""
+        self.flush()
+        self.queue.join()
+        if self.error is not None:
+            self.raiseError()
+        return self.store.saveState()
+
+    def loadState(self,state):
+        """Restores the store state of saveState, before the first record"""
+        self.store.loadState(state)
+
+    def close(self):
+        """Writes the last records, closes the store and stops the threads, returns the store"""
+        self.flush()
+        self.queue.put(None)
+        self.writer.join()
+        self.stop()
+        if self.progressSeconds > 0:
+            print self.report()
+        if self.live is not None:
+            self.renderFrame()
+        if self.error is not None:
+            self.raiseError()
+        return self.store
+
+    def stop(self):
+        """Stops the progress thread (eg. after an error in the integrator, the writer thread is a daemon)"""
+        self.done.set()
+        if self.monitor is not None:
+            self.monitor.join()
+
+    def raiseError(self):
+        errorType, error, traceback = self.error
+        raise errorType, error, traceback
+
+class Block:
+    """Buffer of blockSize records of an OutputPipeline"""
+    def __init__(self,blockSize,numberOfParticles,dimensions):
+        self.positions = empty((blockSize,numberOfParticles,dimensions))
+        self.times = empty(blockSize)
+        self.steps = empty(blockSize,int)
+        self.count = 0
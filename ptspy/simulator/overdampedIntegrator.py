@@ -0,0 +1,42 @@
+from ptspy.simulator.exponentialIntegrator import ExponentialIntegrator
+
+class OverdampedIntegrator(ExponentialIntegrator):
+    """Integrator for the overdamped, inertialess limit, 1st order (explicit Euler) or 2nd order (midpoint)
+
+    The particle moves at its local terminal velocity, v = fluidVelocity + (DEP+weight)/(6*pi*viscosity*radius),
+    so only the position is integrated (dx/dt = v) and no velocity or acceleration stages are needed.
+    This is the limit of ExponentialIntegrator for mass/(6*pi*viscosity*radius) << dt.
+    The stokes drag always balances the other forces here, even if includeStokes is "False".
+
+    The explicit Euler step samples the fields once per step, half the interpolations of the RK2 step.
+    Its error is 1st order in dt, so it needs smaller steps for the same accuracy near field gradients.
+    With midpoint set (time_data.integrator "overdampedMidpoint") the fields are also sampled at the
+    predicted midpoint. That is 2nd order, but two samples per step like RK2, so it only saves the velocity
+    and acceleration stages.
+
+    Attributes:
+        midpoint : bool, True for the 2nd order midpoint step (defaults to False)
+    """
+    midpoint = False
+
+    def ensembleStep(self,ensemble,model=None):
+        """Euler (or midpoint) step for every particle of a ParticleEnsemble, returns the new positions
+
+        ensemble.velocities is set to the terminal velocity used for the step.
+
+        Args:
+            ensemble : ParticleEnsemble object
+            model : ForceModel of ensemble (defaults to compiling it, see compileForces)
+        """
+        if model is None:
+            model = self.compileForces(ensemble)
+        chkPvsBnd = self.BI.checkPointsVsBoundaries
+        dt = self.dt
+
+        terminalVelocity = self.terminalVelocity(ensemble.positions,model)
+        if self.midpoint:
+            positionTmp = chkPvsBnd(ensemble.positions+terminalVelocity*dt/2)
+            terminalVelocity = self.terminalVelocity(positionTmp,model)
+
+        ensemble.velocities = terminalVelocity
+        return chkPvsBnd(ensemble.positions+ensemble.velocities*dt,ensemble=ensemble)
@@ -0,0 +1,129 @@
+import json
+from timeit import default_timer
+
+class Profiler:
+    """Opt-in wall time per phase and event counters for a run (see the module-level profiler).
+    
+    Phases are timed with `with profiler.phase(name):` and counters with profiler.count(name,value).
+    While disabled, phase returns a shared no-op phase and count returns at once, so the hooks in
+    the integrator and interpolation hot paths cost a method call per batched operation.
+    Phases may be nested, their times are inclusive. Sharded runs merge the workers' phases, so
+    phases inside 'simulation' add up the time of every worker. Every worker times its shard as
+    'workers', and the summary gives the shares of the other phases inside 'simulation' out of
+    that summed worker time, not out of the wall time of 'simulation'.
+    
+    Attributes:
+        enabled : bool, phases and counters are only recorded when True (defaults to False)
+        seconds : dictionary of phase name to its total wall time
+        calls : dictionary of phase name to its number of calls
+        counters : dictionary of counter name to its total
+    """
+    # Phases in report order, with the phase they're nested in
+    # 'stepping' is the whole integration step, it holds the interpolation, boundaries and forces phases
+    phases = [('load',None),('setup',None),('simulation',None),('workers','simulation'),('stepping','simulation'),
+              ('interpolation','simulation'),('boundaries','simulation'),('recording','simulation'),('forces','simulation'),
+              ('statistics','simulation'),('plotting',None)]
+    
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+        
+    def reset(self):
+        self.seconds = {}
+        self.calls = {}
+        self.counters = {}
+        
+    def phase(self,name):
+        """Returns a context manager that adds its wall time to the phase name"""
+        if not self.enabled:
+            return noPhase
+        return Phase(self,name)
+    
+    def add(self,name,seconds,calls=1):
+        self.seconds[name] = self.seconds.get(name,0.)+seconds
+        self.calls[name] = self.calls.get(name,0)+calls
+        
+    def count(self,name,value=1):
+        """Adds value to the counter name (eg. 'steps', 'terminalVelocityClamps')"""
+        if self.enabled:
+            self.counters[name] = self.counters.get(name,0)+int(value)
+            
+    def snapshot(self):
+        """Returns the recorded phases and counters as a dictionary (eg. to send back from a worker)"""
+        return {"seconds":dict(self.seconds),"calls":dict(self.calls),"counters":dict(self.counters)}
+    
+    def merge(self,snapshot):
+        """Adds the phases and counters of a snapshot"""
+        for name,seconds in snapshot["seconds"].items():
+            self.add(name,seconds,snapshot["calls"][name])
+        for name,value in snapshot["counters"].items():
+            self.count(name,value)
+            
+    def report(self):
+        """Returns a dictionary of every phase (seconds and calls) and counter
+        
+        'forces' is the time of the integration steps ('stepping') not spent in interpolation or
+        boundary checks, ie. force evaluation, the state update and event checks.
+        """
+        seconds = dict(self.seconds)
+        calls = dict(self.calls)
+        if 'stepping' in seconds:
+            seconds['forces'] = seconds['stepping']-seconds.get('interpolation',0.)-seconds.get('boundaries',0.)
+            calls['forces'] = calls['stepping']
+        phases = {}
+        for name,parent in self.phases:
+            if name in seconds:
+                phases[name] = {"seconds":seconds[name],"calls":calls[name]}
+        return {"phases":phases,"counters":dict(self.counters)}
+    
+    def summary(self,title):
+        """Returns a printable summary of the report, starting with title"""
+        report = self.report()
+        lines = [title]
+        for name,parent in self.phases:
+            if name not in report["phases"]:
+                continue
+            seconds = report["phases"][name]["seconds"]
+            if parent is None:
+                lines.append('   %-16s %9.3f s' % (name,seconds))
+            elif name == 'workers':
+                lines.append('     %-14s %9.3f s (%d shards, summed)' % (name,seconds,report["phases"][name]["calls"]))
+                continue
+            else:
+                if parent == 'simulation' and 'workers' in report["phases"]:
+                    total, parent = report["phases"]["workers"]["seconds"], 'worker time'
+                else:
+                    total = report["phases"].get(parent,{"seconds":0.})["seconds"]
+                share = ' (%4.1f%% of %s)' % (100*seconds/total,parent) if total > 0 else ''
+                lines.append('     %-14s %9.3f s%s' % (name,seconds,share))
+        for name in sorted(report["counters"]):
+            lines.append('   %-24s %d' % (name,report["counters"][name]))
+        return '\n'.join(lines)
+    
+    def writeReport(self,fileName):
+        with open(fileName,'w') as outFile:
+            json.dump(self.report(),outFile,indent=1,sort_keys=True)
+
+class Phase:
+    def __init__(self,profiler,name):
+        self.profiler = profiler
+        self.name = name
+        
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+    
+    def __exit__(self,*args):
+        self.profiler.add(self.name,default_timer()-self.start)
+        
+class NoPhase:
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,*args):
+        pass
+    
+noPhase = NoPhase()
+
+# Shared by every module of a run, enabled by config.profile
+profiler = Profiler()
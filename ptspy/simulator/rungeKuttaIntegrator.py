@@ -1,7 +1,16 @@
+from numpy import arange
 from numpy import array
+from numpy import concatenate
+from numpy import flatnonzero
+from numpy import nan
 from numpy import pi
+from numpy import minimum
 from ptspy.simulator.bilinearInterpolation import BilinearInterpolation
+from ptspy.simulator.bilinearCoefficientInterpolation import BilinearCoefficientInterpolation
 from ptspy.simulator.trilinearInterpolation import TrilinearInterpolation
+from ptspy.simulator.barycentricInterpolation import BarycentricInterpolation
+from ptspy.simulator.eventDetector import EventDetector
+from ptspy.simulator.profiler import profiler
 
 class RungeKuttaIntegrator:
     """2nd Order Runge Kutta Integrator for specific Objects (Tracker,Particle,ParticleAdvanced)
@@ -10,6 +19,10 @@ class RungeKuttaIntegrator:
         tracker : Tracker object with only velocity interpolation
         particle : Particle object with stokes and gravitational forces
         particleAdvanced : Particle object with stokes, gravitational, and buoyant forces
+        ensembleStep : ParticleEnsemble object advanced for all particles at once
+        integrate : ParticleEnsemble object advanced over a list of times, recorded into a TrajectoryStore
+        integrateActive : integrate that stops stepping particles once an event is detected
+        integrateInjection : integrate for particles injected over time into reused ensemble slots
     
     Attributes:        
         X : X object data
@@ -17,16 +30,39 @@ class RungeKuttaIntegrator:
         coordinates : np.array([[x1,x2,x3,...],[y1,y2,y3,...]])
         velocityTranspose : np.array([[x1,y1],[x2,y2],[x3,y3]...])
         dt : time step value
+        interpolation : name of the interpolation engine in RungeKuttaIntegrator.interpolators (defaults to 'bilinear'),
+                        'trilinear' runs the ensemble methods in 3D on Z and fieldGrid,
+                        'barycentric' interpolates scattered nodes on the triangulation of fieldGrid (a FieldMesh)
+        events : EventDetector object, or None to step every particle for the whole run (defaults to None)
+        statistics : OnlineStatistics object updated in the step loop, or None (defaults to None)
+        progress : ProgressReport object updated after every step, or None (set by simulator.runEnsemble)
     """
-    def __init__(self,X,Y,Z=array([0,0,0]),coordinates=array([0,0]),velocityTranspose=array([0,0]),dt=.1,gradESquaredTranspose=array([0,0]),fluid=1,forces=1,physConsts=1,repeatX=True,repeatY=False):
+    interpolators = {'bilinear':BilinearInterpolation,'coefficient':BilinearCoefficientInterpolation}
+    
+    def __init__(self,X,Y,Z=array([0,0,0]),coordinates=array([0,0]),velocityTranspose=array([0,0]),dt=.1,gradESquaredTranspose=array([0,0]),fluid=1,forces=1,physConsts=1,repeatX=True,repeatY=False,interpolation='bilinear',events=None,repeatZ=False,fieldGrid=None,statistics=None):
         self.dt = dt
         rx = (repeatX == "True" or repeatX == True) 
         ry = (repeatY == "True" or repeatY == True)
-        self.BI = BilinearInterpolation(X,Y,coordinates,velocityTranspose,gradESquaredTranspose,repeatX=rx,repeatY=ry)
-        self.TI = TrilinearInterpolation(X,Y,Z,coordinates,velocityTranspose,gradESquaredTranspose)
+        rz = (repeatZ == "True" or repeatZ == True)
+        if interpolation == 'trilinear':
+            # The batched methods of TrilinearInterpolation match BilinearInterpolation, so ensembleStep runs unchanged in 3D
+            self.BI = TrilinearInterpolation(X,Y,Z,coordinates,velocityTranspose,gradESquaredTranspose,
+                                             repeatX=rx,repeatY=ry,repeatZ=rz,fieldGrid=fieldGrid)
+            self.TI = self.BI
+        elif interpolation == 'barycentric':
+            # Scattered field nodes, the triangulation of a FieldMesh is reused
+            self.BI = BarycentricInterpolation(X,Y,coordinates,velocityTranspose,gradESquaredTranspose,repeatX=rx,repeatY=ry,
+                                               triangles=getattr(fieldGrid,'triangles',None))
+            self.TI = None
+        else:
+            self.BI = self.interpolators[interpolation](X,Y,coordinates,velocityTranspose,gradESquaredTranspose,repeatX=rx,repeatY=ry)
+            self.TI = None
         self.fluid = fluid
         self.forces = forces
         self.physConsts = physConsts
+        self.events = events
+        self.statistics = statistics
+        self.progress = None
         
     def tracker(self,tracker):
         """Does not include any force calculations, only velocity tracing"""
@@ -59,14 +95,14 @@ class RungeKuttaIntegrator:
         chkPvsBnd = self.BI.checkPointVsBoundaries
         chkPvsTV = self.checkParticleVsTerminalVelocity
         nearInds = self.BI.buildNearestIndexes
-        interp = self.BI.interpolate
+        interpAll = self.BI.interpolateAll
+        vel, Efield = self.BI.channels['velocity'], self.BI.channels['Efield']
         stokes = self.forces.stokes
         DEP = self.forces.DEP
         dt = self.dt
         
-        nearestIndexes = nearInds(particle.position)
-        avgVel = interp(point=particle.position,indexList=nearestIndexes,fieldName='velocity')
-        avgEField = interp(point=particle.position,indexList=nearestIndexes,fieldName='Efield')
+        sampled = interpAll(point=particle.position,indexList=nearInds(particle.position))
+        avgVel, avgEField = sampled[vel], sampled[Efield]
         
         particle.velocity = chkPvsTV(particleVelocity=particle.velocity,fluidVelocity=avgVel
                                             ,DEPFactor=DEPFactor,radius=radius,Efield=avgEField)
@@ -79,9 +115,8 @@ class RungeKuttaIntegrator:
         positionTmp = particle.position+particle.velocity*dt/2
         
         positionTmp = chkPvsBnd(point = positionTmp)
-        nearestIndexes = nearInds(positionTmp)
-        avgVelTmp = interp(point=positionTmp,indexList=nearestIndexes,fieldName='velocity')
-        avgEFieldTmp = interp(point=positionTmp,indexList=nearestIndexes,fieldName='Efield')
+        sampled = interpAll(point=positionTmp,indexList=nearInds(positionTmp))
+        avgVelTmp, avgEFieldTmp = sampled[vel], sampled[Efield]
         
         particle.velocity = chkPvsTV(particleVelocity=velocityTmp,fluidVelocity=avgVelTmp
                                             ,DEPFactor=DEPFactor,radius=radius,Efield=avgEFieldTmp)       
@@ -93,6 +128,211 @@ class RungeKuttaIntegrator:
         particle.velocity = particle.velocity + accelerationTmp*dt
         return chkPvsBnd(point=(particle.position+velocityTmp*dt),obj=particle)
         
+    def ensembleStep(self,ensemble,model=None):
+        """2nd order Runge-Kutta integrator for every particle of a ParticleEnsemble at once
+        
+        Same scheme as particle(), but interpolation, forces, terminal velocity and boundaries
+        are evaluated as array operations over all N particles. Updates ensemble.velocities
+        and returns the new positions as numpy.array of shape (N,2).
+        
+        Args:
+            ensemble : ParticleEnsemble object
+            model : ForceModel of ensemble (defaults to compiling it, see compileForces)
+        """
+        if model is None:
+            model = self.compileForces(ensemble)
+        chkPvsBnd = self.BI.checkPointsVsBoundaries
+        chkPvsTV = self.checkEnsembleVsTerminalVelocity
+        sampleFields = self.sampleFields
+        dt = self.dt
+        
+        sampled = sampleFields(ensemble.positions)
+        velocity = chkPvsTV(ensemble.velocities,sampled,model)
+        acceleration = model.acceleration(ensemble.positions,velocity,sampled)
+        
+        velocityTmp = velocity+acceleration*dt/2
+        positionTmp = ensemble.positions+velocity*dt/2
+        
+        positionTmp = chkPvsBnd(positionTmp)
+        sampled = sampleFields(positionTmp)
+        velocityTmp = chkPvsTV(velocityTmp,sampled,model)
+        accelerationTmp = model.acceleration(positionTmp,velocityTmp,sampled)
+        
+        ensemble.velocities = velocityTmp + accelerationTmp*dt
+        return chkPvsBnd(ensemble.positions+velocityTmp*dt,ensemble=ensemble)
+        
+    def compileForces(self,ensemble):
+        """Returns the ForceModel of the enabled forces with the per-particle coefficients of ensemble (see Forces.compile)"""
+        return self.forces.compile(self.fluid,self.BI.channels,ensemble)
+        
+    def sampleFields(self,points):
+        """Interpolates every stacked field channel at points, returns numpy.array of shape (N,C) (slice with self.BI.channels)"""
+        with profiler.phase('interpolation'):
+            return self.BI.interpolateAllBatch(points,self.BI.buildNearestIndexesBatch(points))
+        
+    def integrate(self,ensemble,stepList,store,checkpoint=None):
+        """Advances ensemble one fixed step of dt for every time in stepList, recording into store
+        
+        Args:
+            ensemble : ParticleEnsemble object
+            stepList : numpy.array of step start times
+            store : TrajectoryStore, TrajectoryWriter or OutputPipeline
+            checkpoint : Checkpoint object to write checkpoints and resume from (defaults to None)
+        """
+        if self.events is not None:
+            return self.integrateActive(ensemble,stepList,store,checkpoint)
+        start, statistics = 0, self.statistics
+        if statistics is not None:
+            statistics.start(len(ensemble))
+        if checkpoint is not None:
+            start, _ = checkpoint.restore(len(stepList),ensemble,store,statistics=statistics)
+        model = self.compileForces(ensemble)
+        for stepIndex,t in enumerate(stepList[start:],start):
+            with profiler.phase('stepping'):
+                previousPositions = ensemble.positions
+                ensemble.positions = self.ensembleStep(ensemble,model)
+            if statistics is not None:
+                with profiler.phase('statistics'):
+                    statistics.step(t,previousPositions,ensemble)
+            with profiler.phase('recording'):
+                store.record(stepIndex,t,ensemble.positions)
+            if self.progress is not None:
+                self.progress.update(stepIndex+1,len(ensemble))
+            if checkpoint is not None and checkpoint.due(stepIndex+1):
+                checkpoint.write(stepIndex+1,len(stepList),ensemble,store,statistics=statistics)
+        profiler.count('steps',len(stepList)-start)
+        profiler.count('particleSteps',(len(stepList)-start)*len(ensemble))
+        self.finishStatistics(ensemble,stepList)
+            
+    def integrateActive(self,ensemble,stepList,store,checkpoint=None):
+        """integrate with active-set compaction, particles are no longer stepped after self.events detects an event
+        
+        Only the active particles are kept in the stepped arrays. Finished particles are written back into
+        ensemble and stay at their event position in the recorded trajectory.
+        
+        Args:
+            ensemble : ParticleEnsemble object
+            stepList : numpy.array of step start times
+            store : TrajectoryStore, TrajectoryWriter or OutputPipeline
+            checkpoint : Checkpoint object to write checkpoints and resume from (defaults to None)
+        """
+        active, start, statistics = arange(len(ensemble)), 0, self.statistics
+        self.events.start(len(ensemble))
+        if statistics is not None:
+            statistics.start(len(ensemble))
+        if checkpoint is not None:
+            start, active = checkpoint.restore(len(stepList),ensemble,store,active,self.events,statistics)
+        live = ensemble.select(active)
+        model = self.compileForces(live)
+        for stepIndex,t in enumerate(stepList[start:],start):
+            if len(active) > 0:
+                profiler.count('particleSteps',len(active))
+                with profiler.phase('stepping'):
+                    previousPositions = live.positions
+                    live.positions = self.ensembleStep(live,model)
+                    finished = self.events.detect(live,t,self.BI)
+                if statistics is not None:
+                    with profiler.phase('statistics'):
+                        statistics.step(t,previousPositions,live,finished)
+                if finished.any():
+                    done = live.select(flatnonzero(finished))
+                    ensemble.assign(active[finished],done)
+                    if statistics is not None:
+                        statistics.outcome(done,stepList[0],stepList[-1])
+                    keep = flatnonzero(~finished)
+                    active, live, model = active[keep], live.select(keep), model.select(keep)
+            with profiler.phase('recording'):
+                if stepIndex % store.stride == 0:
+                    ensemble.positions[active] = live.positions
+                store.record(stepIndex,t,ensemble.positions)
+            if self.progress is not None:
+                self.progress.update(stepIndex+1,len(active))
+            if checkpoint is not None and checkpoint.due(stepIndex+1):
+                ensemble.assign(active,live)
+                checkpoint.write(stepIndex+1,len(stepList),ensemble,store,active,self.events,statistics)
+        profiler.count('steps',len(stepList)-start)
+        ensemble.assign(active,live)
+        self.finishStatistics(live,stepList)
+        
+    def integrateInjection(self,ensemble,stepList,store,generator,log):
+        """integrate for a continuous injection source, the particles in flight occupy the slots of ensemble
+        
+        Before every step the particles arriving from generator are written into free slots (arrivals are
+        dropped and counted in log.dropped if every slot is in use). Once a particle finishes (self.events,
+        or outlet exits if events aren't set) its row is written to log and the slot is free again, so memory
+        follows the particles in flight instead of the number injected. Empty slots are recorded as nan.
+        
+        Args:
+            ensemble : ParticleEnsemble of the slots (ParticleGenerator.slotEnsemble)
+            stepList : numpy.array of step start times
+            store : TrajectoryStore or TrajectoryWriter of the slots
+            generator : ParticleGenerator object
+            log : InjectionLog object
+        """
+        events = self.events if self.events is not None else EventDetector()
+        events.start(0)
+        statistics = self.statistics
+        if statistics is not None:
+            statistics.start(0)
+        generator.reset()
+        free = range(len(ensemble)-1,-1,-1)
+        active = arange(0)
+        live = ensemble.select(active)
+        model = self.compileForces(live)
+        for stepIndex,t in enumerate(stepList):
+            arriving = generator.generate(t,self.dt)
+            if len(arriving) > 0:
+                slots = array([free.pop() for _ in range(min(len(arriving),len(free)))],dtype=int)
+                log.dropped += len(arriving)-len(slots)
+                if len(slots) > 0:
+                    arriving = arriving.select(arange(len(slots)))
+                    ensemble.place(slots,arriving)
+                    log.inject(slots,t,ensemble)
+                    events.add(len(slots))
+                    if statistics is not None:
+                        statistics.add(len(slots))
+                    active, live = concatenate((active,slots)), live.append(arriving)
+                    model = self.compileForces(live)
+            if len(active) > 0:
+                profiler.count('particleSteps',len(active))
+                with profiler.phase('stepping'):
+                    previousPositions = live.positions
+                    live.positions = self.ensembleStep(live,model)
+                    finished = events.detect(live,t,self.BI)
+                if statistics is not None:
+                    with profiler.phase('statistics'):
+                        statistics.step(t,previousPositions,live,finished)
+                if finished.any():
+                    done = active[finished]
+                    ensemble.assign(done,live.select(flatnonzero(finished)))
+                    log.finish(done,ensemble)
+                    if statistics is not None:
+                        statistics.outcome(ensemble.select(done),log.injectionTime[done],stepList[-1])
+                    ensemble.positions[done] = nan
+                    free.extend(done[::-1])
+                    keep = flatnonzero(~finished)
+                    active, live, model = active[keep], live.select(keep), model.select(keep)
+            with profiler.phase('recording'):
+                if stepIndex % store.stride == 0:
+                    ensemble.positions[active] = live.positions
+                store.record(stepIndex,t,ensemble.positions)
+            if self.progress is not None:
+                self.progress.update(stepIndex+1,len(active))
+        profiler.count('steps',len(stepList))
+        ensemble.assign(active,live)
+        self.finishStatistics(live,stepList,log.injectionTime[active])
+        
+    def finishStatistics(self,ensemble,stepList,startTimes=None):
+        """Records the particles still in flight at the end of the run into self.statistics (event 'none')
+        
+        Args:
+            ensemble : ParticleEnsemble of the particles still in flight
+            stepList : numpy.array of step start times
+            startTimes : time of the first step of every particle (defaults to the start of the run)
+        """
+        if self.statistics is not None and len(stepList) > 0:
+            self.statistics.outcome(ensemble,stepList[0] if startTimes is None else startTimes,stepList[-1])
+        
     def particle3D(self,particle):
         """2nd order Runge-Kutta integrator for a particle
         
@@ -146,6 +386,19 @@ class RungeKuttaIntegrator:
             particleVelocity[1] = terminalVelocity[1]
         return particleVelocity
         
+    def checkEnsembleVsTerminalVelocity(self,particleVelocity,sampledFields,model):
+        """Batched checkParticleVsTerminalVelocity with the terminal velocity of the compiled ForceModel
+        
+        Args:
+            particleVelocity : numpy.array of shape (N,D)
+            sampledFields : numpy.array of shape (N,C) of the stacked field channels at the particles
+            model : ForceModel of the particles
+        """
+        terminalVelocity = model.terminalVelocity(sampledFields)
+        if profiler.enabled:
+            profiler.count('terminalVelocityClamps',(particleVelocity > terminalVelocity).sum())
+        return minimum(particleVelocity,terminalVelocity)
+        
     def checkParticleVsTerminalVelocity3D(self,particleVelocity,fluidVelocity):
         terminalVelocity = fluidVelocity
         if particleVelocity[0] > terminalVelocity[0]:
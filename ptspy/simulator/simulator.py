@@ -1,33 +1,393 @@
 from ptspy.simulator.rungeKuttaIntegrator import RungeKuttaIntegrator
+from ptspy.simulator.dormandPrinceIntegrator import DormandPrinceIntegrator
+from ptspy.simulator.exponentialIntegrator import ExponentialIntegrator
+from ptspy.simulator.overdampedIntegrator import OverdampedIntegrator
+from ptspy.simulator.eventDetector import EventDetector
+from ptspy.simulator.checkpoint import Checkpoint
+from ptspy.simulator.injectionLog import InjectionLog
+from ptspy.simulator.onlineStatistics import OnlineStatistics
+from ptspy.simulator.onlineStatistics import buildAccumulator
+from ptspy.simulator.outputPipeline import OutputPipeline
+from ptspy.simulator.outputPipeline import ProgressReport
+from ptspy.simulator.outputPipeline import LiveView
+from ptspy.simulator.trajectoryStore import TrajectoryStore
+from ptspy.simulator.trajectoryStore import NullTrajectoryStore
+from ptspy.simulator.trajectoryWriter import TrajectoryWriter
+from ptspy.simulator.trajectoryWriter import TrajectoryReader
+from ptspy.simulator.trajectoryWriter import writeTrajectoryIndex
+from ptspy.simulator.profiler import profiler
+from ptspy.physical.particleEnsemble import ParticleEnsemble
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
 from numpy import arange
-from numpy import append
-from numpy import newaxis
-    
-def startSimulation(allData):
+from numpy import array_split
+from numpy import ascontiguousarray
+from numpy import frombuffer
+from copy import copy
+
+def startSimulation(allData,workers=None,resume=False):
+    """Runs the simulation for every particle in allData["particleList"]
+
+    Args:
+        allData : dictionary built by dataHandler.getAllData
+        workers : integer number of processes, particles are split into one shard per process
+                  (defaults to allData["workers"])
+        resume : bool, continue from the checkpoint of output_data.checkpointFile if it exists (defaults to False)
+    """
+    if allData.get("injection") is not None:
+        return startInjection(allData,workers,resume)
     print "2. Starting Simulation"
 
     time = allData["time"]
     particleList = allData["particleList"]
+    output = allData.get("output",{})
+    if workers is None:
+        workers = allData.get("workers",1)
+
+    with profiler.phase('simulation'):
+        integrator = buildIntegrator(allData)
+
+        # All particles are advanced together as arrays (see RungeKuttaIntegrator.ensembleStep)
+        ensemble = ParticleEnsemble.fromParticleList(particleList)
+        dimensions = ensemble.positions.shape[1]
+        stepList = time.stepList()
+        if output.get("checkpointFile") and output.get("recordTrajectories","True") == "True" and not writesTrajectories(output):
+            print ('checkpoints hold the whole in-memory trajectory history, so long runs write more with every checkpoint\n'
+                   'set output_data.trajectoryDirectory to stream trajectories to disk (a checkpoint then holds one block)\n')
+        if workers > 1 and len(ensemble) > 1:
+            if output.get("liveFile"):
+                print 'the live view is only drawn by runs with 1 worker\nrunning without the live view\n'
+            shards, stores = runShardedEnsemble(integrator,ensemble,stepList,time.recordStride,output,workers,resume)
+        else:
+            shards = [arange(len(ensemble))]
+            stores = [buildTrajectoryStore(output,len(stepList),len(ensemble),time.recordStride,dimensions=dimensions)]
+            runEnsemble(integrator,ensemble,stepList,stores[0],buildCheckpoint(output,resume),output,buildLiveView(allData))
+    
+        ensemble.updateParticles(particleList)
+        if writesTrajectories(output):
+            # Trajectories stay on disk, read them lazily through the TrajectoryReader
+            writeTrajectoryIndex(output["trajectoryDirectory"],[s.part for s in stores],len(ensemble),
+                                 time.recordStride,ensemble.names,dimensions)
+            store = TrajectoryReader(output["trajectoryDirectory"])
+        else:
+            store = mergeTrajectoryStores(shards,stores,len(stepList),len(ensemble),time.recordStride,dimensions)
+            store.attachToParticles(particleList)
+        time.list = store.timeList()
+        allData["trajectoryStore"] = store
+
+    reportStatistics(allData,integrator.statistics)
+    finishSimulation(output)
+    return particleList
+
+def startInjection(allData,workers=None,resume=False):
+    """Runs a continuous injection simulation, particles enter from allData["injection"] (a ParticleGenerator)
+    
+    The particles in flight occupy a fixed number of slots (injection_data.maxParticles) that are reused once
+    their particle finishes, see RungeKuttaIntegrator.integrateInjection. Particles only free their slot by an
+    event (exit at the outlet), so repeatX has to be off. One row per finished particle is written to
+    output_data.injectionLogFile (allData["injectionLog"]). The slots are recorded to output_data.trajectoryDirectory,
+    in memory (steps x maxParticles) only if injection_data.recordInMemory is "True", otherwise not at all.
+    Returns one Particle per slot with its last state.
+    """
+    print "2. Starting Simulation (continuous injection)"
+    
+    time = allData["time"]
+    output = allData.get("output",{})
+    generator = allData["injection"]
+    if allData.get("integrator","rk2") == "dopri5":
+        raise ValueError("continuous injection needs a fixed step integrator, not dopri5")
+    if allData.get("repeatX") in ["True",True]:
+        raise ValueError("continuous injection needs repeatX off, particles free their slot by exiting at the outlet")
+    if (workers or allData.get("workers",1)) > 1:
+        print 'continuous injection runs in one process\nrunning with 1 worker\n'
+    if resume or output.get("checkpointFile"):
+        print 'checkpoints are not written for continuous injection\nrunning without checkpoints\n'
+    if (output.get("recordTrajectories","True") == "True" and not writesTrajectories(output) and
+            not allData.get("injectionInMemory",False)):
+        print 'slot trajectories are not kept in memory for continuous injection\nset injection_data.recordInMemory to "True" to record them\n'
+        output = allData["output"] = dict(output,recordTrajectories="False")
+    
+    with profiler.phase('simulation'):
+        integrator = buildIntegrator(allData)
+        ensemble = generator.slotEnsemble()
+        dimensions = ensemble.positions.shape[1]
+        stepList = time.stepList()
+        store = buildTrajectoryStore(output,len(stepList),len(ensemble),time.recordStride,dimensions=dimensions)
+        log = InjectionLog(len(ensemble),dimensions,output.get("injectionLogFile",""))
+        pipeline = buildOutputPipeline(output,store,len(stepList),ensemble,buildLiveView(allData))
+        if pipeline is not None:
+            integrator.progress = pipeline.progress
+        try:
+            integrator.integrateInjection(ensemble,stepList,pipeline or store,generator,log)
+        finally:
+            integrator.progress = None
+            if pipeline is not None:
+                pipeline.close()
+            else:
+                store.close()
+            log.close()
+        
+        particleList = ensemble.updateParticles(ensemble.particles())
+        if writesTrajectories(output):
+            writeTrajectoryIndex(output["trajectoryDirectory"],[store.part],len(ensemble),time.recordStride,
+                                 ensemble.names,dimensions)
+            store = TrajectoryReader(output["trajectoryDirectory"])
+        else:
+            store.attachToParticles(particleList)
+        time.list = store.timeList()
+        allData["trajectoryStore"] = store
+        allData["particleList"] = particleList
+        allData["injectionLog"] = log
+    
+    print log.summary()
+    reportStatistics(allData,integrator.statistics)
+    finishSimulation(output)
+    return particleList
 
-    integrator = RungeKuttaIntegrator(
-        X = allData["X"], 
+def reportStatistics(allData,statistics):
+    """Prints the compact statistics report, keeps it in allData["statisticsReport"] and writes output_data.statisticsFile"""
+    if statistics is None:
+        return
+    allData["statisticsReport"] = statistics.report()
+    print statistics.summary()
+    if allData.get("output",{}).get("statisticsFile"):
+        statistics.writeReport(allData["output"]["statisticsFile"])
+
+def finishSimulation(output):
+    """Prints the end of the simulation, with the profiler summary (and report file) when profiling"""
+    if profiler.enabled:
+        print profiler.summary("2. Done")
+        if output.get("profileFile"):
+            profiler.writeReport(output["profileFile"])
+    else:
+        print "2. Done"
+
+def resumeSimulation(allData,workers=None):
+    """startSimulation continuing from the last checkpoint (output_data.checkpointFile), run with the same workers"""
+    return startSimulation(allData,workers,resume=True)
+
+def buildIntegrator(allData):
+    """Builds the integrator named by allData["integrator"] ('rk2' fixed step, 'dopri5' adaptive,
+    'exponential' drag exact, 'overdamped' inertialess Euler or 'overdampedMidpoint'), in 3D if allData["dimensions"] is 3
+    
+    Raises ValueError for dopri5 with events_data.detectEvents "True", the adaptive integrator doesn't detect events.
+    """
+    kwargs = {}
+    if allData.get("dimensions",2) == 3:
+        kwargs = {"Z":allData["Z"],"repeatZ":allData["repeatZ"],"fieldGrid":allData["fieldGrid"]}
+    elif allData.get("interpolation") == "barycentric":
+        kwargs = {"fieldGrid":allData["fieldGrid"]}
+    if allData.get("integrator","rk2") == "dopri5":
+        if allData.get("events",{}).get("detectEvents","False") == "True":
+            raise ValueError("events are only detected by the fixed step integrators, not dopri5 (set events_data.detectEvents to \"False\")")
+        integratorClass = DormandPrinceIntegrator
+        kwargs.update(rtol=allData["rtol"],atol=allData["atol"])
+    elif allData.get("integrator","rk2") == "exponential":
+        integratorClass = ExponentialIntegrator
+    elif allData.get("integrator","rk2") in ["overdamped","overdampedMidpoint"]:
+        integratorClass = OverdampedIntegrator
+    else:
+        integratorClass = RungeKuttaIntegrator
+    integrator = integratorClass(
+        X = allData["X"],
         Y = allData["Y"],
-        coordinates = allData["coordinates"], 
+        coordinates = allData["coordinates"],
         velocityTranspose = allData["fluid"].velocity,
-        dt = allData["time"].step, 
+        dt = allData["time"].step,
         gradESquaredTranspose = allData["gradE2"],
-        fluid = allData["fluid"], 
-        forces = allData["forces"], 
+        fluid = allData["fluid"],
+        forces = allData["forces"],
         physConsts = allData["physicalConstants"],
         repeatX = allData["repeatX"],
-        repeatY = allData["repeatY"])
+        repeatY = allData["repeatY"],
+        interpolation = allData["interpolation"],
+        events = buildEventDetector(allData.get("events",{})),
+        statistics = buildStatistics(allData.get("statistics",{}),allData["time"].step),
+        **kwargs)
+    if allData.get("integrator","rk2") == "overdampedMidpoint":
+        integrator.midpoint = True
+    if allData.get("captureMask") is not None:
+        integrator.BI.addField('captureMask',allData["captureMask"])
+    return integrator
 
-    for t in arange(0,time.stop,time.step):
-        time.list = append(time.list,t)
-        for index,particle in enumerate(particleList):
-            particle.position = integrator.particle(particle=particle)
-            particle.positionList = append(particle.positionList,particle.position[:,newaxis],1)
+def buildEventDetector(events):
+    """Returns an EventDetector from the events_data settings, or None unless events.detectEvents is 'True'"""
+    if events.get("detectEvents","False") != "True":
+        return None
+    return EventDetector(
+        outletExit = events.get("outletExit","True") == "True",
+        wallCapture = events.get("wallCapture","False") == "True",
+        stagnationSpeed = events.get("stagnationSpeed",0.),
+        stagnationSteps = events.get("stagnationSteps",1))
 
-    print "2. Done"
-    return particleList
-    
\ No newline at end of file
+def buildStatistics(statistics,dt):
+    """Returns the OnlineStatistics of the statistics_data settings, or None unless statistics.collectStatistics is 'True'"""
+    if statistics.get("collectStatistics","False") != "True":
+        return None
+    return OnlineStatistics(
+        accumulators = [buildAccumulator(spec) for spec in statistics.get("accumulators",[])],
+        classEdges = statistics.get("classEdges",[0]),
+        dt = dt)
+
+def buildCheckpoint(output,resume=False,part=None):
+    """Returns a Checkpoint if output["checkpointFile"] is set, otherwise None
+    
+    Checkpoints are written every output["checkpointSteps"] steps and/or output["checkpointSeconds"] seconds.
+    Every shard of a sharded run has its own file, checkpointFile.part<part>.
+    """
+    if not output.get("checkpointFile"):
+        return None
+    fileName = output["checkpointFile"] if part is None else '%s.part%03d' % (output["checkpointFile"],part)
+    return Checkpoint(fileName,output.get("checkpointSteps",0),output.get("checkpointSeconds",0),resume)
+
+def writesTrajectories(output):
+    """Returns True if trajectories are recorded into output["trajectoryDirectory"]"""
+    return output.get("recordTrajectories","True") == "True" and bool(output.get("trajectoryDirectory"))
+
+def buildTrajectoryStore(output,numberOfSteps,numberOfParticles,recordStride=1,part=0,firstParticle=0,dimensions=2):
+    """Returns a TrajectoryWriter if output["trajectoryDirectory"] is set, otherwise an in-memory TrajectoryStore
+    (a NullTrajectoryStore that records nothing if output["recordTrajectories"] is "False")"""
+    if output.get("recordTrajectories","True") != "True":
+        return NullTrajectoryStore(numberOfParticles,dimensions)
+    if writesTrajectories(output):
+        return TrajectoryWriter(output["trajectoryDirectory"],numberOfParticles,stride=recordStride,
+                                blockSize=output.get("blockSize",100),part=part,firstParticle=firstParticle,
+                                dimensions=dimensions,compress=output.get("compressBlocks","False") == "True")
+    return TrajectoryStore(numberOfSteps,numberOfParticles,stride=recordStride,dimensions=dimensions)
+
+def buildOutputPipeline(output,store,numberOfSteps,ensemble,live=None,label=''):
+    """Returns an OutputPipeline around store if output["backgroundOutput"] is "True", otherwise None
+    
+    The pipeline queues at most output["queueBlocks"] blocks of output["blockSize"] records and prints
+    a progress report every output["progressSeconds"] seconds (0 disables it), starting with label.
+    """
+    if output.get("backgroundOutput","False") != "True":
+        return None
+    return OutputPipeline(store,ProgressReport(numberOfSteps,len(ensemble),label),ensemble,
+                          blockSize=output.get("blockSize",100),queueBlocks=output.get("queueBlocks",4),
+                          progressSeconds=output.get("progressSeconds",0),live=live)
+
+def buildLiveView(allData):
+    """Returns the LiveView of output_data.liveFile, or None if it isn't set or there's no background output"""
+    output = allData.get("output",{})
+    if not output.get("liveFile") or output.get("backgroundOutput","False") != "True":
+        return None
+    return LiveView(allData["plot"],output["liveFile"],
+                    (allData["X"].minValue,allData["X"].maxValue,allData["Y"].minValue,allData["Y"].maxValue),
+                    trail=output.get("liveTrail",200),seconds=output.get("liveSeconds",5))
+
+def mergeTrajectoryStores(shards,stores,numberOfSteps,numberOfParticles,recordStride=1,dimensions=2):
+    """Joins the in-memory stores of every shard into one TrajectoryStore in the original particle order"""
+    if len(stores) == 1:
+        return stores[0]
+    if isinstance(stores[0],NullTrajectoryStore):
+        return NullTrajectoryStore(numberOfParticles,dimensions)
+    store = TrajectoryStore(numberOfSteps,numberOfParticles,stride=recordStride,dimensions=dimensions)
+    for indexes,shardStore in zip(shards,stores):
+        store.assign(indexes,shardStore)
+    return store
+
+def runEnsemble(integrator,ensemble,stepList,store,checkpoint=None,output=None,live=None,label=''):
+    """Advances ensemble over every time in stepList, recording into store (closed at the end)
+    
+    With output["backgroundOutput"] "True" the records go through an OutputPipeline, store is written
+    by its writer thread while the integrator steps (see buildOutputPipeline).
+    """
+    pipeline = buildOutputPipeline(output or {},store,len(stepList),ensemble,live,label)
+    if pipeline is None:
+        integrator.integrate(ensemble,stepList,store,checkpoint)
+        store.close()
+        return store
+    integrator.progress = pipeline.progress
+    try:
+        integrator.integrate(ensemble,stepList,pipeline,checkpoint)
+    except:
+        pipeline.stop()
+        raise
+    finally:
+        integrator.progress = None
+    return pipeline.close()
+
+def runShardedEnsemble(integrator,ensemble,stepList,recordStride,output,workers,resume=False):
+    """Splits ensemble into shards that run in a process pool, results are merged in the original particle order
+
+    Particles don't interact, so every shard follows exactly the same arithmetic as the serial run.
+    The large interpolation arrays are copied into shared memory once instead of being pickled to every worker.
+    Returns the shard particle indexes and the TrajectoryStore (or TrajectoryWriter) of every shard.
+    The workers' profiler phases and counters are merged into the profiler, and their statistics into integrator.statistics.
+    """
+    sharedIntegrator, sharedArrays = shareIntegrator(integrator)
+    shards = [indexes for indexes in array_split(arange(len(ensemble)),workers) if len(indexes) > 0]
+    pool = Pool(len(shards),initShardWorker,(sharedIntegrator,sharedArrays,profiler.enabled))
+    try:
+        results = pool.map(runShard,[(ensemble.select(indexes),stepList,recordStride,output,part,indexes[0],resume)
+                                     for part,indexes in enumerate(shards)])
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    if integrator.statistics is not None:
+        integrator.statistics.start(0)
+    for indexes,(shardStore,shardEnsemble,shardProfile,shardStatistics) in zip(shards,results):
+        ensemble.assign(indexes,shardEnsemble)
+        profiler.merge(shardProfile)
+        if shardStatistics is not None:
+            integrator.statistics.merge(shardStatistics)
+    return shards, [result[0] for result in results]
+
+def shareIntegrator(integrator):
+    """Returns a copy of integrator without its large arrays, and the arrays copied into shared memory"""
+    BI = integrator.BI
+    sharedArrays = dict((name,toSharedArray(getattr(BI,name))) for name in BI.sharedArrayNames)
+    sharedBI = copy(BI)
+    for name in BI.sharedArrayNames+BI.fieldAttributes.values()+['coordinatesTranspose']:
+        setattr(sharedBI,name,None)
+    sharedBI.X, sharedBI.Y = gridParameters(BI.X), gridParameters(BI.Y)
+    if hasattr(BI,'Z'):
+        sharedBI.Z = gridParameters(BI.Z)
+    sharedIntegrator = copy(integrator)
+    sharedIntegrator.BI = sharedBI
+    sharedIntegrator.TI = sharedBI if integrator.TI is BI else None
+    sharedIntegrator.fluid = copy(integrator.fluid)
+    sharedIntegrator.fluid.velocity = None
+    return sharedIntegrator, sharedArrays
+
+def gridParameters(data):
+    """Returns a copy of an X or Y Data object without its quiver and trace arrays"""
+    parameters = copy(data)
+    parameters.quiver, parameters.trace = None, None
+    return parameters
+
+def toSharedArray(a):
+    """Copies a numpy.array into shared memory, returns (RawArray, shape)"""
+    a = ascontiguousarray(a,dtype=float)
+    raw = RawArray('d',a.size)
+    fromSharedArray(raw,a.shape)[...] = a
+    return raw, a.shape
+
+def fromSharedArray(raw,shape):
+    """Returns a numpy.array view of a RawArray"""
+    return frombuffer(raw,dtype=float).reshape(shape)
+
+# Per-process state of a shard worker, set by initShardWorker
+shardWorker = {}
+
+def initShardWorker(integrator,sharedArrays,profile=False):
+    for name,(raw,shape) in sharedArrays.items():
+        setattr(integrator.BI,name,fromSharedArray(raw,shape))
+    integrator.BI.refreshFieldViews()
+    integrator.fluid.velocity = integrator.BI.velocityTranspose
+    shardWorker["integrator"] = integrator
+    profiler.enabled = profile
+
+def runShard(args):
+    ensemble, stepList, recordStride, output, part, firstParticle, resume = args
+    profiler.reset()
+    store = buildTrajectoryStore(output,len(stepList),len(ensemble),recordStride,part,int(firstParticle),
+                                 ensemble.positions.shape[1])
+    with profiler.phase('workers'):
+        runEnsemble(shardWorker["integrator"],ensemble,stepList,store,buildCheckpoint(output,resume,part),output,
+                    label='part %d: ' % part)
+    return store, ensemble, profiler.snapshot(), shardWorker["integrator"].statistics
@@ -1,8 +1,14 @@
 from numpy import array
+from numpy import arange
 
 class Time:
-    def __init__(self,start,stop,step):
+    def __init__(self,start,stop,step,recordStride=1):
         self.start = start
         self.stop = stop
         self.step = step
-        self.list = array([])
\ No newline at end of file
+        self.recordStride = recordStride
+        self.list = array([])
+        
+    def stepList(self):
+        """Returns numpy.array of the time of every integration step"""
+        return arange(0,self.stop,self.step)
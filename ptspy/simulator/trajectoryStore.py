@@ -0,0 +1,101 @@
+from sys import maxint
+from numpy import empty
+
+class TrajectoryStore:
+    """Preallocated trajectory storage for an ensemble of particles.
+    
+    Positions are written into one (T,N,2) numpy.array allocated up front, so recording a step
+    never copies the history (unlike numpy.append on every step).
+    
+    Attributes:
+        positions : numpy.array of shape (T,N,2) for recorded particle positions
+        times : numpy.array of shape (T,) for recorded times
+        stride : integer, only every stride-th step is recorded (defaults to 1)
+        count : integer of the number of records written so far
+    """
+    def __init__(self,numberOfSteps,numberOfParticles,stride=1,dimensions=2):
+        """
+        Args:
+            numberOfSteps : integer of the number of integration steps in the run
+            numberOfParticles : integer of the number of particles
+            stride : integer record stride (defaults to 1)
+            dimensions : integer of the spatial dimensions (defaults to 2)
+        """
+        self.stride = max(int(stride),1)
+        length = (numberOfSteps+self.stride-1)//self.stride
+        self.positions = empty((length,numberOfParticles,dimensions))
+        self.times = empty(length)
+        self.count = 0
+        
+    def record(self,stepIndex,t,positions):
+        """Stores positions if stepIndex falls on the record stride
+        
+        Args:
+            stepIndex : integer index of the integration step
+            t : time of the step
+            positions : numpy.array of shape (N,2)
+        """
+        if stepIndex % self.stride == 0:
+            self.positions[self.count] = positions
+            self.times[self.count] = t
+            self.count += 1
+            
+    def close(self):
+        """Nothing to flush for in-memory storage (same interface as TrajectoryWriter)"""
+        pass
+        
+    def saveState(self):
+        """Returns the records so far as a dictionary of numpy.arrays (see simulator.Checkpoint), every checkpoint
+        holds the whole history, long checkpointed runs should stream to a TrajectoryWriter instead"""
+        return {"positions":self.positions[:self.count],"times":self.times[:self.count]}
+        
+    def loadState(self,state):
+        """Restores the records of saveState"""
+        self.count = len(state["times"])
+        self.positions[:self.count] = state["positions"]
+        self.times[:self.count] = state["times"]
+        
+    def assign(self,indexes,store):
+        """Copies the records of a store holding a subset of the particles into this store
+        
+        Args:
+            indexes : numpy.array of integer particle indexes
+            store : TrajectoryStore with len(indexes) particles and the same steps and stride
+        """
+        self.positions[:store.count,indexes] = store.positions[:store.count]
+        self.times[:store.count] = store.times[:store.count]
+        self.count = store.count
+            
+    def timeList(self):
+        """Returns a view of the recorded times"""
+        return self.times[:self.count]
+            
+    def particleView(self,index):
+        """Returns a (2,T) view of one particle's recorded positions (same layout as Particle.positionList)
+        
+        Args:
+            index : integer index of the particle in the ensemble
+        """
+        return self.positions[:self.count,index,:].T
+    
+    def attachToParticles(self,particleList):
+        """Points every Particle.positionList to its view into the store
+        
+        Args:
+            particleList : list of Particle objects in the same order as the ensemble
+        """
+        for index,particle in enumerate(particleList):
+            particle.positionList = self.particleView(index)
+        return particleList
+
+class NullTrajectoryStore(TrajectoryStore):
+    """TrajectoryStore that records nothing, for runs that only collect statistics (output_data.recordTrajectories "False")
+    
+    The stride is longer than any run, so the integrators don't gather the positions for recording either.
+    """
+    def __init__(self,numberOfParticles,dimensions=2):
+        TrajectoryStore.__init__(self,0,numberOfParticles,dimensions=dimensions)
+        self.stride = maxint
+        
+    def record(self,stepIndex,t,positions):
+        pass
@@ -0,0 +1,195 @@
+import json
+from os import makedirs
+from os.path import isdir
+from os.path import join
+from numpy import arange
+from numpy import array
+from numpy import asarray
+from numpy import concatenate
+from numpy import empty
+from numpy import load
+from numpy import save
+from numpy import savez_compressed
+from numpy import searchsorted
+
+class TrajectoryWriter:
+    """Streams recorded positions to .npy block files instead of keeping the history in memory.
+
+    Only one block of blockSize records is buffered; when it's full it is flushed to
+    directory/part<part>_block<n>.npy (shape (K,N,2)) with its times in a matching _times.npy.
+    With compress the positions are written compressed to part<part>_block<n>.npz instead, which
+    TrajectoryReader reads whole rather than memory-mapped.
+    A run may be split into several parts (one per shard), each covering a contiguous range
+    of particles. writeTrajectoryIndex joins the parts into index.json for TrajectoryReader.
+
+    Attributes:
+        directory : string of the output directory
+        stride : integer, only every stride-th step is recorded (defaults to 1)
+        count : integer of the number of records written so far
+        part : dictionary describing the written blocks (see writeTrajectoryIndex)
+        compress : bool, write the positions of every block compressed (.npz)
+    """
+    def __init__(self,directory,numberOfParticles,stride=1,blockSize=100,part=0,firstParticle=0,dimensions=2,compress=False):
+        """
+        Args:
+            directory : string of the output directory (created if missing)
+            numberOfParticles : integer of the number of particles in this part
+            stride : integer record stride (defaults to 1)
+            blockSize : integer of the records per block file (defaults to 100)
+            part : integer part number used in the block file names (defaults to 0)
+            firstParticle : integer index of this part's first particle in the full ensemble (defaults to 0)
+            dimensions : integer of the spatial dimensions (defaults to 2)
+            compress : bool, write compressed .npz block files (defaults to False)
+        """
+        if not isdir(directory):
+            makedirs(directory)
+        self.directory = directory
+        self.stride = max(int(stride),1)
+        self.buffer = empty((max(int(blockSize),1),numberOfParticles,dimensions))
+        self.bufferTimes = empty(len(self.buffer))
+        self.bufferCount = 0
+        self.count = 0
+        self.part = {"particles":[firstParticle,firstParticle+numberOfParticles],"blocks":[]}
+        self.partName = 'part%03d' % part
+        self.compress = compress
+
+    def record(self,stepIndex,t,positions):
+        """Buffers positions if stepIndex falls on the record stride, flushing full blocks
+
+        Args:
+            stepIndex : integer index of the integration step
+            t : time of the step
+            positions : numpy.array of shape (N,2)
+        """
+        if stepIndex % self.stride == 0:
+            self.buffer[self.bufferCount] = positions
+            self.bufferTimes[self.bufferCount] = t
+            self.bufferCount += 1
+            self.count += 1
+            if self.bufferCount == len(self.buffer):
+                self.flush()
+
+    def flush(self):
+        """Writes the buffered records to the next block file"""
+        if self.bufferCount == 0:
+            return
+        name = '%s_block%05d' % (self.partName,len(self.part["blocks"]))
+        positions = name+('.npz' if self.compress else '.npy')
+        if self.compress:
+            savez_compressed(join(self.directory,positions),positions=self.buffer[:self.bufferCount])
+        else:
+            save(join(self.directory,positions),self.buffer[:self.bufferCount])
+        save(join(self.directory,name+'_times.npy'),self.bufferTimes[:self.bufferCount])
+        self.part["blocks"].append({"positions":positions,"times":name+'_times.npy',
+                                    "start":self.count-self.bufferCount,"count":self.bufferCount})
+        self.bufferCount = 0
+
+    def close(self):
+        """Flushes the last block and releases the buffer, returns the part dictionary"""
+        self.flush()
+        self.buffer, self.bufferTimes = None, None
+        return self.part
+        
+    def saveState(self):
+        """Returns the record count, the buffered records and the written blocks as a dictionary of numpy.arrays
+        (see simulator.Checkpoint), the block files themselves are already on disk"""
+        return {"count":array(self.count),"buffer":self.buffer[:self.bufferCount],
+                "bufferTimes":self.bufferTimes[:self.bufferCount],"part":array(json.dumps(self.part))}
+        
+    def loadState(self,state):
+        """Restores the state of saveState, blocks flushed after it are written again under the same names"""
+        self.count = int(state["count"])
+        self.bufferCount = len(state["bufferTimes"])
+        self.buffer[:self.bufferCount] = state["buffer"]
+        self.bufferTimes[:self.bufferCount] = state["bufferTimes"]
+        self.part = json.loads(str(state["part"]))
+
+def writeTrajectoryIndex(directory,parts,numberOfParticles,stride=1,names=None,dimensions=2):
+    """Writes directory/index.json describing the blocks written by one or more TrajectoryWriters
+
+    Args:
+        directory : string of the output directory
+        parts : list of TrajectoryWriter.part dictionaries
+        numberOfParticles : integer of the number of particles in the full ensemble
+        stride : integer record stride
+        names : list of particle names
+        dimensions : integer of the spatial dimensions (defaults to 2)
+    """
+    index = {"format":"npy","numberOfParticles":numberOfParticles,"dimensions":dimensions,
+             "stride":stride,"names":names or [],"parts":parts}
+    with open(join(directory,'index.json'),'w') as outFile:
+        json.dump(index,outFile,indent=1)
+
+class TrajectoryReader:
+    """Lazy reader for trajectories written by TrajectoryWriter.
+
+    Block files are memory-mapped, so only the requested particles and time window are read.
+    Exposes timeList and particleView like TrajectoryStore so Plot can use either one.
+    """
+    def __init__(self,directory):
+        """
+        Args:
+            directory : string of the directory holding index.json
+        """
+        self.directory = directory
+        with open(join(directory,'index.json'),'r') as inFile:
+            index = json.load(inFile)
+        self.numberOfParticles = index["numberOfParticles"]
+        self.dimensions = index["dimensions"]
+        self.stride = index["stride"]
+        self.names = index["names"]
+        self.parts = index["parts"]
+        self.count = sum(block["count"] for block in self.parts[0]["blocks"]) if self.parts else 0
+        self.times = None
+
+    def loadBlock(self,fileName):
+        if fileName.endswith('.npz'):
+            with load(join(self.directory,fileName)) as data:
+                return data['positions']
+        return load(join(self.directory,fileName),mmap_mode='r')
+
+    def timeList(self):
+        """Returns numpy.array of the recorded times"""
+        if self.times is None:
+            blocks = self.parts[0]["blocks"] if self.parts else []
+            self.times = concatenate([self.loadBlock(block["times"]) for block in blocks] or [empty(0)])
+        return self.times
+
+    def timeWindow(self,startTime,stopTime):
+        """Returns the (start,stop) record indexes of the records with startTime <= t < stopTime"""
+        times = self.timeList()
+        return int(searchsorted(times,startTime)), int(searchsorted(times,stopTime))
+
+    def positions(self,particles=None,start=0,stop=None):
+        """Returns numpy.array of shape (T,n,2) for a subset of particles and records
+
+        Args:
+            particles : list or numpy.array of particle indexes (defaults to every particle)
+            start : integer index of the first record (defaults to 0)
+            stop : integer index after the last record (defaults to the number of records)
+        """
+        particles = arange(self.numberOfParticles) if particles is None else asarray(particles,dtype=int)
+        stop = self.count if stop is None else min(stop,self.count)
+        out = empty((max(stop-start,0),len(particles),self.dimensions))
+        for part in self.parts:
+            first, last = part["particles"]
+            inPart = (particles >= first) & (particles < last)
+            if not inPart.any():
+                continue
+            local = particles[inPart]-first
+            for block in part["blocks"]:
+                lo, hi = max(start,block["start"]), min(stop,block["start"]+block["count"])
+                if lo < hi:
+                    data = self.loadBlock(block["positions"])
+                    out[lo-start:hi-start,inPart] = data[lo-block["start"]:hi-block["start"]][:,local]
+        return out
+
+    def particleView(self,index):
+        """Returns a (2,T) array of one particle's recorded positions (same layout as Particle.positionList)"""
+        return self.positions([index])[:,0,:].T
+
+    def attachToParticles(self,particleList):
+        """Loads every particle's recorded positions into Particle.positionList"""
+        for index,particle in enumerate(particleList):
+            particle.positionList = self.particleView(index)
+        return particleList
@@ -1,22 +1,122 @@
+from math import ceil
+from math import floor
 from numpy import array
+from numpy import ceil as ceilArray
+from numpy import floor as floorArray
+from numpy import hstack
+from numpy import newaxis
+from ptspy.simulator.profiler import profiler
 
 class TrilinearInterpolation:
+    # Stacked field channels that are also exposed as their own attribute
+    fieldAttributes = {'velocity':'velocityTranspose','Efield':'gradESquaredTranspose'}
+    # Large arrays that sharded simulations place in shared memory (a memory-mapped FieldGrid3D is mapped again instead)
+    sharedArrayNames = ['fields']
+
     def __init__(self,X=array([0,0,0]),Y=array([0,0,0]),Z=array([0,0,0]),coordinates=array([0,0,0]),
-                    velocityTranspose=array([0,0,0]),gradESquaredTranspose=array([0,0,0])):
+                    velocityTranspose=array([0,0,0]),gradESquaredTranspose=array([0,0,0]),
+                    repeatX=False,repeatY=False,repeatZ=False,fieldGrid=None):
+        """Trilinear Interpolation class for uniform 3D grids (X fastest, then Y, then Z)
+
+        Args:
+            X : X object for grid points
+            Y : Y object for grid points
+            Z : Z object for grid points
+            coordinates : np.array([[x1,x2,x3,...],[y1,y2,y3,...],[z1,z2,z3,...]])
+            velocityTranspose : np.array([[x1,y1,z1],[x2,y2,z2],...])
+            gradESquaredTranspose : np.array([[x1,y1,z1],[x2,y2,z2],...])
+            fieldGrid : FieldGrid3D, its (memory-mapped) stacked fields are used without copying
+                        and replace velocityTranspose and gradESquaredTranspose
+
+        Like BilinearInterpolation, all fields are stacked into self.fields of shape (nodes,C)
+        and self.channels maps each field name to its slice of columns.
+        """
         self.X = X
         self.Y = Y
         self.Z = Z
         self.coordinates = coordinates
-        self.velocityTranspose = velocityTranspose
-        self.gradESquaredTranspose = gradESquaredTranspose
-        
+        self.repeatX = repeatX
+        self.repeatY = repeatY
+        self.repeatZ = repeatZ
+        self.fieldGrid = fieldGrid
+        if fieldGrid is not None:
+            self.sharedArrayNames = []
+            self.fields = fieldGrid.fields
+            self.channels = dict(fieldGrid.channels)
+            self.refreshFieldViews()
+        else:
+            self.fields = None
+            self.channels = {}
+            self.addField('velocity',velocityTranspose)
+            self.addField('Efield',gradESquaredTranspose)
+
+    def addField(self,name,fieldTranspose):
+        """Appends a field as extra channels of the stacked field array (see BilinearInterpolation.addField)"""
+        field = array(fieldTranspose,dtype=float)
+        if field.ndim == 1:
+            field = field[:,newaxis]
+        start = 0 if self.fields is None else self.fields.shape[1]
+        self.fields = field if self.fields is None else hstack((self.fields,field))
+        self.channels[name] = slice(start,start+field.shape[1])
+        self.refreshFieldViews()
+
+    def refreshFieldViews(self):
+        """Rebuilds the per-field attribute views into the stacked field array"""
+        for name,attribute in self.fieldAttributes.items():
+            if name in self.channels:
+                setattr(self,attribute,self.fields[:,self.channels[name]])
+
+    def __getstate__(self):
+        """Fields and coordinates of a FieldGrid3D aren't pickled, they are taken from the unpickled grid again"""
+        state = dict(self.__dict__)
+        if self.fieldGrid is not None:
+            state['fields'], state['coordinates'] = None, None
+            for attribute in self.fieldAttributes.values():
+                state.pop(attribute,None)
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        if self.fieldGrid is not None:
+            self.fields, self.coordinates = self.fieldGrid.fields, self.fieldGrid.coordinates
+            self.refreshFieldViews()
+
+    def checkPointsVsBoundaries(self,points,ensemble=None,indexes=None):
+        """Batched boundary check for an array of points of shape (N,3) (modified in place)
+
+        Same rules as BilinearInterpolation.checkPointsVsBoundaries on every axis: points that leave
+        a repeated axis come back on the opposite side, otherwise they are held at the boundary.
+
+        Args:
+            points : numpy.array of shape (N,3)
+            ensemble : pass the ParticleEnsemble so repeats in X are counted
+            indexes : ensemble indexes of the points when they are a subset of the ensemble
+        """
+        with profiler.phase('boundaries'):
+            for axis,(grid,repeat) in enumerate([(self.X,self.repeatX),(self.Y,self.repeatY),(self.Z,self.repeatZ)]):
+                p = points[:,axis]
+                over, under = p > grid.maxValue, p < grid.minValue
+                if profiler.enabled:
+                    profiler.count('boundaryWraps' if repeat else 'boundaryClamps',(over | under).sum())
+                if repeat:
+                    p[over] = grid.minValue
+                    p[under] = grid.maxValue
+                    if axis == 0 and ensemble is not None and indexes is None:
+                        ensemble.repeatCnt += over | under
+                    elif axis == 0 and ensemble is not None:
+                        ensemble.repeatCnt[indexes] += over | under
+                else:
+                    p[over] = grid.maxValue-(1e-5*grid.maxValue)
+                    p[under] = grid.minValue
+            return points
+
     def buildNearestIndexes3D(self,point):
         i = (self.X.quiverLength-1)*(point[0]-self.X.minValue)/(self.X.maxValue-self.X.minValue)
         j = (self.Y.quiverLength-1)*(point[1]-self.Y.minValue)/(self.Y.maxValue-self.Y.minValue)
         k = (self.Z.quiverLength-1)*(point[2]-self.Z.minValue)/(self.Z.maxValue-self.Z.minValue)
-        i0, i1 = int(floor(i)),int(ceil(i))  
+        i0, i1 = int(floor(i)),int(ceil(i))
         j0, j1 = int(floor(j)),int(ceil(j))
-        k0, k1 = int(floor(k)),int(ceil(k))         
+        k0, k1 = int(floor(k)),int(ceil(k))
         if i0 == i1:
             i0,i1 = self.fixIndexes(i0,i1)
         if j0 == j1:
@@ -24,17 +124,42 @@ class TrilinearInterpolation:
         if k0 == k1:
             k0,k1 = self.fixIndexes(k0,k1)
         return [i0,i1,j0,j1,k0,k1]
-        
+
+    def buildNearestIndexesBatch(self,points):
+        """Batched nearest grid cell for points of shape (N,3)
+
+        Returns (corner,fractions): the flat index of every cell's lower corner node, shape (N,),
+        and the position inside the cell along x, y and z in [0,1], shape (N,3).
+        """
+        corner = []
+        fractions = []
+        for axis,grid in enumerate([self.X,self.Y,self.Z]):
+            i = (grid.quiverLength-1)*(points[:,axis]-grid.minValue)/(grid.maxValue-grid.minValue)
+            i0, i1 = self.fixIndexesBatch(floorArray(i).astype(int),ceilArray(i).astype(int))
+            corner.append(i0)
+            fractions.append((i-i0)/(i1-i0))
+        return self.ijkToFlatIndex(*corner), array(fractions).T
+
     def fixIndexes(self,ind1,ind2):
         if ind1 > 0:
             ind1 -= 1
         else:
             ind2 += 1
         return ind1,ind2
-        
+
+    def fixIndexesBatch(self,ind1,ind2):
+        """Batched fixIndexes for numpy.arrays of lower and upper indexes (modified in place)"""
+        same = ind1 == ind2
+        if profiler.enabled:
+            profiler.count('fixIndexesCorrections',same.sum())
+        lower = same & (ind1 > 0)
+        ind1[lower] -= 1
+        ind2[same & ~lower] += 1
+        return ind1,ind2
+
     def trilinearInterpolation(self,point,indexList):
         i0,i1,j0,j1,k0,k1 = indexList
-        x,y,z = point        
+        x,y,z = point
         ind000 = self.ijkToFlatIndex(i0,j0,k0)
         ind100 = self.ijkToFlatIndex(i1,j0,k0)
         ind010 = self.ijkToFlatIndex(i0,j1,k0)
@@ -64,6 +189,40 @@ class TrilinearInterpolation:
         f0 = f00*(1-yd)+(f10*yd)
         f1 = f01*(1-yd)+(f11*yd)
         return f0*(1-zd)+(f1*zd)
-    
+
+    def interpolateBatch(self,points,nearest,fieldName='none'):
+        """Batched interpolation of one field, returns numpy.array of shape (N,channels)"""
+        if fieldName not in self.channels:
+            print 'no interpolation occurring\nreturning zeros\n'
+            return 0*points
+        return self.trilinearInterpolationBatch(nearest,self.fields[:,self.channels[fieldName]])
+
+    def interpolateAllBatch(self,points,nearest):
+        """Interpolates every stacked channel at points, returns numpy.array of shape (N,C) (slice with self.channels)"""
+        return self.trilinearInterpolationBatch(nearest,self.fields)
+
+    def trilinearInterpolationBatch(self,nearest,fieldTranspose):
+        """Batched trilinearInterpolation, same arithmetic as the scalar version applied to every row
+
+        The 8 corner rows of every cell are gathered in one indexing operation, so with a memory-mapped
+        field only the pages holding those cells are read.
+
+        Args:
+            nearest : (corner,fractions) from buildNearestIndexesBatch
+            fieldTranspose : numpy.array (or memmap) of shape (nodes,C)
+        """
+        corner, fractions = nearest
+        XQ, XYQ = self.X.quiverLength, self.X.quiverLength*self.Y.quiverLength
+        offsets = array([0,1,XQ,XQ+1,XYQ,XYQ+1,XYQ+XQ,XYQ+XQ+1])
+        f = fieldTranspose[corner[:,newaxis]+offsets]
+        xd, yd, zd = fractions[:,0,newaxis], fractions[:,1,newaxis], fractions[:,2,newaxis]
+        f00 = f[:,0]*(1-xd)+(f[:,1]*xd)
+        f10 = f[:,2]*(1-xd)+(f[:,3]*xd)
+        f01 = f[:,4]*(1-xd)+(f[:,5]*xd)
+        f11 = f[:,6]*(1-xd)+(f[:,7]*xd)
+        f0 = f00*(1-yd)+(f10*yd)
+        f1 = f01*(1-yd)+(f11*yd)
+        return f0*(1-zd)+(f1*zd)
+
     def ijkToFlatIndex(self,i,j,k):
-        return i+(j*self.X.quiverLength)+(k*self.X.quiverLength*self.Y.quiverLength)
\ No newline at end of file
+        return i+(j*self.X.quiverLength)+(k*self.X.quiverLength*self.Y.quiverLength)
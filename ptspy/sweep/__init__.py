@@ -0,0 +1,5 @@
+from parameterSweep import expandGrid
+from parameterSweep import runParameterSweep
+from parameterSweep import writeResultsTable
+from jobQueue import JobQueue
+from jobQueue import runWorker
@@ -0,0 +1,60 @@
+import argparse
+import json
+from collections import OrderedDict
+from ptspy.sweep.jobQueue import JobQueue
+from ptspy.sweep.jobQueue import runWorker
+from ptspy.sweep.parameterSweep import runParameterSweep
+from ptspy.sweep.parameterSweep import writeResultsTable
+from ptspy.utilities.dataHandler import jsonFromFile
+
+def parseValue(text):
+    """Parses a sweep value as json (numbers, lists), otherwise keeps the string (eg. True for the config flags)"""
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return text
+    return str(value) if isinstance(value,bool) else value
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description="Sweeps config parameters over one loaded field and writes a tidy results table.")
+    parser.add_argument("configFile", type=str, nargs="?", help="The configuration file (not needed by --work and --merge).")
+    parser.add_argument("-p", "--parameter", nargs="+", action="append", default=[], metavar=("NAME","VALUE"),
+                        help="Dotted config path and its values, eg. -p electrode_data.voltageScale 1 2 5 (repeatable).")
+    parser.add_argument("--output", type=str, default="sweep.csv", help="Results table (.csv).")
+    parser.add_argument("--workers", type=int, default=None, help="Simulation processes (defaults to config.workers).")
+    parser.add_argument("--queue", type=str, default=None,
+                        help="Shared job queue directory, distributes the sweep with --submit, --work and --merge.")
+    parser.add_argument("--submit", action="store_true", help="Write the sweep points as jobs into --queue.")
+    parser.add_argument("--pointsPerJob", type=int, default=10, help="Sweep points per job of --submit (0 for whole batches).")
+    parser.add_argument("--work", action="store_true", help="Run jobs of --queue until none is left (start one per core/node).")
+    parser.add_argument("--merge", action="store_true", help="Write the results of the done jobs of --queue to --output.")
+    parser.add_argument("--partial", action="store_true", help="Merge even if jobs aren't done or failed.")
+    parser.add_argument("--lease", type=float, default=600., help="Seconds without a heartbeat before a job is taken back.")
+    parser.add_argument("--attempts", type=int, default=3, help="Runs of a failing job before it is failed.")
+    parser.add_argument("--poll", type=float, default=10., help="Seconds between looks at the queue while jobs run elsewhere.")
+    return parser.parse_args()
+
+def main(args):
+    parameters = OrderedDict((parameter[0],[parseValue(value) for value in parameter[1:]]) for parameter in args.parameter)
+    if args.queue is not None:
+        return mainQueue(args,parameters)
+    table = runParameterSweep(jsonFromFile(args.configFile),parameters,args.workers)
+    writeResultsTable(table,args.output)
+    print "%d sweep points, %d rows written to %s" % (len(set(row[0] for row in table["rows"])),len(table["rows"]),args.output)
+
+def mainQueue(args,parameters):
+    queue = JobQueue(args.queue,args.lease,args.attempts)
+    if args.submit:
+        print "%d jobs written to %s" % (queue.submit(jsonFromFile(args.configFile),parameters,args.pointsPerJob),args.queue)
+    if args.work:
+        completed = runWorker(args.queue,args.workers,args.lease,args.attempts,args.poll)
+        print "Worker %s: %d jobs done" % (queue.workerId,completed)
+    if args.merge:
+        table = queue.merge(args.partial)
+        writeResultsTable(table,args.output)
+        print "%d sweep points, %d rows written to %s" % (len(set(row[0] for row in table["rows"])),len(table["rows"]),args.output)
+    if not (args.submit or args.work or args.merge):
+        print ', '.join('%d %s' % (count,folder) for folder,count in queue.status().items() if folder != 'results')
+
+if __name__ == "__main__":
+    main(parseArgs())
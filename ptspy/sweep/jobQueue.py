@@ -0,0 +1,298 @@
+import errno
+import json
+import socket
+import traceback
+from collections import OrderedDict
+from copy import deepcopy
+from os import getpid
+from os import listdir
+from os import makedirs
+from os import rename
+from os import stat
+from os import utime
+from os.path import abspath
+from os.path import isdir
+from os.path import isfile
+from os.path import join
+from random import Random
+from threading import Event
+from threading import Thread
+from time import sleep
+from time import time
+
+from ptspy.sweep.parameterSweep import expandGrid
+from ptspy.sweep.parameterSweep import groupPoints
+from ptspy.sweep.parameterSweep import runGroup
+from ptspy.sweep.parameterSweep import sweepColumns
+from ptspy.utilities import dataHandler
+
+class JobQueue:
+    """Parameter sweep distributed over any number of workers through a shared directory (no other service)
+
+    submit writes the groups of sweep points (see parameterSweep.groupPoints) as job files of at most
+    pointsPerJob points into directory/pending, so a sweep of folded parameters only (one group) still
+    spreads over the workers. A worker claims a job by renaming it to directory/running/<job>--<worker>.json,
+    rename is atomic, so exactly one of the workers racing for a job gets it. While the job runs, a
+    heartbeat thread touches the running file every leaseSeconds/4 (the lease). When it's done the rows are
+    written to directory/results/<job>.json and the job moves to directory/done. A failed job goes back to
+    pending until it has failed maxAttempts times, then it moves to directory/failed with its tracebacks.
+
+    A running file not touched for leaseSeconds belongs to a worker that died (or lost its node), any
+    worker renames it back to pending (recoverStale). A worker that finds its lease gone drops its result.
+    leaseSeconds should be well above the clock skew between the nodes and the heartbeat interval.
+    submit loads the field once to build its cache, every worker then loads it (dataHandler.setupData) before
+    claiming a job and reuses it for all its jobs, so a worker that can't load the field claims nothing.
+    merge joins the results into the table of parameterSweep.runParameterSweep.
+
+    Attributes:
+        directory : string of the shared queue directory
+        leaseSeconds : seconds without a heartbeat before a running job is taken back (defaults to 600)
+        maxAttempts : integer of the runs of a job before it is failed (defaults to 3)
+        workerId : string naming this worker in the running files (defaults to <host>-<pid>)
+    """
+    folders = ['pending','running','done','failed','results']
+
+    def __init__(self,directory,leaseSeconds=600.,maxAttempts=3,workerId=None):
+        self.directory = directory
+        self.leaseSeconds = float(leaseSeconds)
+        self.maxAttempts = max(int(maxAttempts),1)
+        self.workerId = workerId or '%s-%d' % (socket.gethostname(),getpid())
+        self.random = Random()
+
+    def path(self,folder,name=''):
+        return join(self.directory,folder,name)
+
+    def submit(self,config,parameters,pointsPerJob=10):
+        """Writes the sweep of config and parameters (see runParameterSweep) as job files, returns the number of jobs
+        
+        Every group of sweep points is split into jobs of at most pointsPerJob points (0 keeps whole groups),
+        the points of one job still run as one particle batch.
+
+        The file locations and the trajectory directory are made absolute, so workers may run from any directory.
+        The field is loaded once here, which builds its cache (config.cacheFieldData) before any worker starts.
+        """
+        if isfile(join(self.directory,'queue.json')):
+            raise ValueError("%s already holds a sweep" % self.directory)
+        config = deepcopy(config)
+        for name,value in config.get("file_locations",{}).items():
+            if isinstance(value,basestring) and value:
+                config["file_locations"][name] = abspath(value)
+        if config.get("output_data",{}).get("trajectoryDirectory"):
+            config["output_data"]["trajectoryDirectory"] = abspath(config["output_data"]["trajectoryDirectory"])
+        print "1. Importing and Configurating Data"
+        dataHandler.setupData(config)
+        for folder in self.folders:
+            if not isdir(self.path(folder)):
+                makedirs(self.path(folder))
+        parameters = OrderedDict(parameters)
+        jobs = 0
+        for key,members in groupPoints(expandGrid(parameters)).items():
+            chunk = int(pointsPerJob) if pointsPerJob > 0 else len(members)
+            for first in range(0,len(members),chunk):
+                # The job index names the trajectoryDirectory of the job (see parameterSweep.runGroup)
+                job = {"group":jobs,"overrides":json.loads(key),"members":members[first:first+chunk],"attempts":0,"errors":[]}
+                self.writeFile(self.path('pending','job%05d.json' % jobs),job)
+                jobs += 1
+        # queue.json is written last, workers start once it exists
+        self.writeFile(join(self.directory,'queue.json'),{"config":config,"parameters":parameters.items(),"jobs":jobs})
+        return jobs
+
+    def sweep(self):
+        """Returns (config,parameters) of the submitted sweep"""
+        sweep = self.readFile(join(self.directory,'queue.json'))
+        return sweep["config"], OrderedDict(sweep["parameters"])
+
+    def claim(self):
+        """Claims a pending job, returns a Lease (heartbeat running), or None if there's no pending job
+
+        The pending jobs are tried in random order, so hundreds of workers rarely race for the same file.
+        """
+        names = [name for name in listdir(self.path('pending')) if name.endswith('.json')]
+        self.random.shuffle(names)
+        for name in names:
+            runningFile = self.path('running','%s--%s.json' % (name[:-5],self.workerId))
+            try:
+                rename(self.path('pending',name),runningFile)
+                # rename keeps the mtime of the pending file, the lease starts now
+                utime(runningFile,None)
+                job = self.readFile(runningFile)
+                job["attempts"] += 1
+                job["worker"] = self.workerId
+                self.writeFile(runningFile,job)
+            except (IOError,OSError) as e:
+                # Claimed by another worker, or taken back by recoverStale before the utime
+                if e.errno == errno.ENOENT:
+                    continue
+                raise
+            return Lease(name,runningFile,job,self.leaseSeconds/4.)
+        return None
+
+    def complete(self,lease,rows,columns):
+        """Writes the rows of a finished job and moves it to done, returns False if the lease was lost meanwhile"""
+        lease.stop()
+        return self.release(lease,'done',lease.job,{"columns":columns,"rows":[jsonRow(row) for row in rows]})
+
+    def fail(self,lease,error):
+        """Records error (a traceback string) and moves the job back to pending, or to failed after maxAttempts"""
+        lease.stop()
+        job = dict(lease.job,errors=lease.job["errors"]+[{"worker":self.workerId,"error":error}])
+        return self.release(lease,'failed' if job["attempts"] >= self.maxAttempts else 'pending',job)
+
+    def release(self,lease,folder,job,result=None):
+        """Moves the job of lease to folder with its new contents (and writes its result), returns False if it was taken back
+
+        The running file is first renamed to a name recoverStale ignores, so a job can't be taken back halfway.
+        """
+        releasing = lease.runningFile+'.release'
+        try:
+            rename(lease.runningFile,releasing)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return False
+            raise
+        if result is not None:
+            self.writeFile(self.path('results',lease.name),result)
+        self.writeFile(releasing,job)
+        rename(releasing,self.path(folder,lease.name))
+        return True
+
+    def recoverStale(self):
+        """Moves the running jobs without a heartbeat for leaseSeconds back to pending, returns how many"""
+        recovered = 0
+        now = time()
+        for name in listdir(self.path('running')):
+            if '--' not in name or not name.endswith('.json'):
+                continue
+            try:
+                if now-stat(self.path('running',name)).st_mtime < self.leaseSeconds:
+                    continue
+                rename(self.path('running',name),self.path('pending',name.split('--')[0]+'.json'))
+                recovered += 1
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        return recovered
+
+    def status(self):
+        """Returns the number of jobs in every folder"""
+        return OrderedDict((folder,len([name for name in listdir(self.path(folder)) if name.endswith('.json')]))
+                           for folder in self.folders)
+
+    def merge(self,partial=False):
+        """Returns the results table of every done job, as runParameterSweep
+
+        Raises ValueError if jobs aren't done yet or failed, unless partial is set.
+        """
+        sweep = self.readFile(join(self.directory,'queue.json'))
+        names = sorted(name for name in listdir(self.path('results')) if name.endswith('.json'))
+        if len(names) < sweep["jobs"] and not partial:
+            status = self.status()
+            raise ValueError("%d of %d jobs are done (%d pending, %d running, %d failed)" % (
+                len(names),sweep["jobs"],status["pending"],status["running"],status["failed"]))
+        columns, rows = None, []
+        for name in names:
+            result = self.readFile(self.path('results',name))
+            columns = result["columns"]
+            rows.extend(result["rows"])
+        if columns is None:
+            # No results yet, the columns of a 2D sweep
+            columns = sweepColumns(OrderedDict(sweep["parameters"]),sweep["config"].get("config",{}).get("dimensions",2))
+        rows.sort(key=lambda row: (row[0],row[len(sweep["parameters"])+1]))
+        return {"columns":columns,"rows":rows}
+
+    def writeFile(self,fileName,data):
+        """Atomically writes data as json (a temporary file renamed over fileName)"""
+        temporary = '%s.%s.tmp' % (fileName,self.workerId)
+        with open(temporary,'w') as outFile:
+            json.dump(data,outFile)
+        rename(temporary,fileName)
+
+    def readFile(self,fileName):
+        with open(fileName,'r') as inFile:
+            return json.load(inFile,object_pairs_hook=OrderedDict)
+
+class Lease:
+    """A claimed job, its running file is touched every heartbeatSeconds by a daemon thread until stop
+
+    Attributes:
+        name : string of the job file name
+        runningFile : string of the claimed running file
+        job : dictionary of the job (group, overrides, members, attempts, errors)
+        lost : bool, True once the running file was taken back by recoverStale
+    """
+    def __init__(self,name,runningFile,job,heartbeatSeconds):
+        self.name = name
+        self.runningFile = runningFile
+        self.job = job
+        self.lost = False
+        self.done = Event()
+        self.heartbeatSeconds = heartbeatSeconds
+        self.thread = Thread(target=self.heartbeat,name='lease heartbeat')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def heartbeat(self):
+        while not self.done.wait(self.heartbeatSeconds):
+            try:
+                utime(self.runningFile,None)
+            except OSError:
+                self.lost = True
+                return
+
+    def stop(self):
+        self.done.set()
+        self.thread.join()
+
+def jsonRow(row):
+    """Returns a results table row with the numpy scalars converted to python numbers"""
+    return [value.item() if hasattr(value,'item') else value for value in row]
+
+def runWorker(directory,workers=None,leaseSeconds=600.,maxAttempts=3,pollSeconds=10.,exitWhenIdle=True):
+    """Runs the jobs of a JobQueue until none is left, returns the number of jobs this worker completed
+
+    Once there's no pending job the worker takes back stale jobs, and waits pollSeconds for the running jobs
+    of other workers (one may fail and go back to pending) until every job is done or failed.
+
+    Args:
+        directory : string of the shared queue directory (see JobQueue.submit)
+        workers : integer number of processes per simulation (defaults to config.workers)
+        leaseSeconds : see JobQueue (defaults to 600)
+        maxAttempts : see JobQueue (defaults to 3)
+        pollSeconds : wall time between looks at the queue while other workers still run jobs (defaults to 10)
+        exitWhenIdle : bool, return once no job is pending or running (False keeps polling for new work)
+    """
+    queue = JobQueue(directory,leaseSeconds,maxAttempts)
+    while not isfile(join(directory,'queue.json')):
+        sleep(pollSeconds)
+    config, parameters = queue.sweep()
+    # Loaded before claiming, a field that can't be loaded stops the worker without failing a job
+    print "1. Importing and Configurating Data"
+    base, completed = dataHandler.setupData(config), 0
+    while True:
+        lease = queue.claim()
+        if lease is None:
+            if queue.recoverStale() > 0:
+                continue
+            if exitWhenIdle and queue.status()["running"] == 0:
+                return completed
+            sleep(pollSeconds)
+            continue
+        print "Worker %s: job %s (attempt %d)" % (queue.workerId,lease.name[:-5],lease.job["attempts"])
+        try:
+            rows = runGroup(base,config,parameters.keys(),lease.job["group"],lease.job["overrides"],
+                            lease.job["members"],workers)
+        except Exception:
+            error = traceback.format_exc()
+            print "Worker %s: job %s failed\n%s" % (queue.workerId,lease.name[:-5],error)
+            queue.fail(lease,error)
+            continue
+        except:
+            # Interrupted (eg. KeyboardInterrupt), the job goes back to pending without counting as failed
+            lease.job["attempts"] -= 1
+            lease.stop()
+            queue.release(lease,'pending',lease.job)
+            raise
+        if queue.complete(lease,rows,sweepColumns(parameters,base["dimensions"])):
+            completed += 1
+        else:
+            print "Worker %s: lease of job %s was lost, result dropped" % (queue.workerId,lease.name[:-5])
@@ -0,0 +1,192 @@
+import csv
+import json
+from collections import OrderedDict
+from copy import deepcopy
+from itertools import product
+from os.path import join
+
+from numpy import array
+
+from ptspy.simulator import simulator
+from ptspy.utilities import dataHandler
+
+# Sweep parameters that only change per-particle scalars, every value of them runs in the same batch
+foldedParameters = ['electrode_data.voltageScale','particle_data.DEPFactor','particle_data.radius']
+# Settings of the loaded field, a sweep loads the field once so they can't be swept
+fieldParameters = ['file_locations.vectorFieldFile','file_locations.meshElementsFile','config.dimensions',
+                   'config.interpolation','config.multiplyFieldX','config.maxTriangleEdge']
+
+def expandGrid(parameters):
+    """Returns the list of sweep points (dictionaries of parameter name to value) of every combination
+
+    Args:
+        parameters : OrderedDict (or list of pairs) of dotted config path (eg. 'electrode_data.voltageScale')
+                     to the list of its values
+    """
+    parameters = OrderedDict(parameters)
+    return [OrderedDict(zip(parameters.keys(),values)) for values in product(*parameters.values())]
+
+def setOverride(config,name,value):
+    """Sets the dotted config path name (eg. 'fluid_data.scaleX') to value in config"""
+    keys = name.split('.')
+    section = config
+    for key in keys[:-1]:
+        section = section.setdefault(key,{})
+    section[keys[-1]] = value
+
+def groupPoints(points):
+    """Groups sweep points by their overrides that aren't in foldedParameters
+
+    Returns an OrderedDict of the json of the group overrides to [(pointIndex,point),...].
+    Points of one group share the field and settings and are simulated as one particle batch.
+    Raises ValueError if a point overrides a setting of the loaded field (see checkOverrides).
+    """
+    groups = OrderedDict()
+    for index,point in enumerate(points):
+        overrides = [(name,value) for name,value in point.items() if name not in foldedParameters]
+        checkOverrides(overrides)
+        groups.setdefault(json.dumps(overrides),[]).append((index,point))
+    return groups
+
+def checkOverrides(overrides):
+    """Raises ValueError if the list of (name,value) overrides changes a setting of the loaded field (fieldParameters)"""
+    fixed = [name for name,value in overrides if name in fieldParameters]
+    if fixed:
+        raise ValueError("a sweep reuses one loaded field, %s can't be swept" % ', '.join(fixed))
+
+def groupData(base,config,overrides):
+    """Returns (allData,config) for one group of sweep points, reusing the field loaded in base
+
+    Flow scaling (fluid_data.scaleX/scaleY) rescales the velocity rows of the loaded 2D field (FieldGrid or FieldMesh) in memory.
+    A 3D field is memory-mapped, so it is loaded again through its cache instead.
+
+    Args:
+        base : allData of the unmodified config (dataHandler.setupData)
+        config : unmodified config dictionary
+        overrides : list of (name,value) group overrides
+    """
+    if not overrides:
+        return base, config
+    cf = deepcopy(config)
+    for name,value in overrides:
+        setOverride(cf,name,value)
+    checkOverrides(overrides)
+    allData = {"dimensions":base["dimensions"]}
+    grid = base["fieldGrid"]
+    scales = [config["fluid_data"]["scaleX"],config["fluid_data"]["scaleY"]]
+    newScales = [cf["fluid_data"]["scaleX"],cf["fluid_data"]["scaleY"]]
+    if base["dimensions"] == 3:
+        scales.append(config["fluid_data"].get("scaleZ",1))
+        newScales.append(cf["fluid_data"].get("scaleZ",1))
+        if newScales != scales:
+            grid = dataHandler.getFieldGrid3D(cf["file_locations"]["vectorFieldFile"],cf)
+        allData["Z"] = grid.Z
+    elif newScales != scales:
+        mesh = isinstance(grid,dataHandler.FieldMesh)
+        if 0 in scales:
+            load = dataHandler.getFieldMesh if mesh else dataHandler.getFieldGrid
+            grid = load(cf["file_locations"]["vectorFieldFile"],cf)
+        else:
+            table = array(grid.table)
+            table[2] *= newScales[0]/float(scales[0])
+            table[3] *= newScales[1]/float(scales[1])
+            if mesh:
+                grid = dataHandler.FieldMesh(table,grid.triangles)
+            else:
+                grid = dataHandler.FieldGrid(table,grid.shape[1],grid.shape[0],grid.X.tiles)
+    allData["fieldGrid"] = grid
+    dataHandler.setupParameters(allData,cf)
+    return allData, cf
+
+def pointParticles(particleData,config,dimensions,pointIndex,point):
+    """Returns the particles of the particle file with the folded parameters of one sweep point applied
+
+    electrode_data.voltageScale scales the DEPFactor column as in the simulation, particle_data.DEPFactor
+    replaces the column (it is still multiplied by voltageScale) and particle_data.radius replaces every
+    radius, scaling the mass by (radius/fileRadius)**3 so the density stays the same.
+    """
+    voltageScale = point.get('electrode_data.voltageScale',config["electrode_data"]["voltageScale"])
+    pointConfig = {"electrode_data":{"voltageScale":voltageScale}}
+    if dimensions == 3:
+        particleList = dataHandler.buildParticleList3D(particleData,pointConfig)
+    else:
+        particleList = dataHandler.buildParticleList(particleData,pointConfig)
+    for particle in particleList:
+        if 'particle_data.DEPFactor' in point:
+            particle.DEPFactor = point['particle_data.DEPFactor']*voltageScale
+        if 'particle_data.radius' in point:
+            particle.mass = particle.mass*(point['particle_data.radius']/float(particle.radius))**3
+            particle.radius = point['particle_data.radius']
+        particle.name = 'point%d_%s' % (pointIndex,particle.name)
+    return particleList
+
+def runParameterSweep(config,parameters,workers=None):
+    """Runs every point of a parameter grid, loading and preparing the field only once
+
+    Points are grouped by their overrides that change the field or the settings (eg. fluid_data.scaleX,
+    time_data.stop). Every group runs one simulation whose particle batch holds the particles of
+    every point in the group, since voltageScale, DEPFactor and radius are per-particle scalars.
+
+    Returns the tidy results table {"columns":[...],"rows":[[...],...]} with one row per point and particle:
+    the point index, the swept parameters, the particle index, its start and final positions,
+    repeatCnt and its event and event time (see events_data).
+
+    Args:
+        config : config dictionary (eg. dataHandler.jsonFromFile('config.json'))
+        parameters : OrderedDict (or list of pairs) of dotted config path to the list of its values,
+                     folded into the batch: electrode_data.voltageScale, particle_data.DEPFactor
+                     and particle_data.radius
+        workers : integer number of processes per simulation (defaults to config.workers)
+    """
+    parameters = OrderedDict(parameters)
+    points = expandGrid(parameters)
+    print "1. Importing and Configurating Data (%d sweep points)" % len(points)
+    base = dataHandler.setupData(config)
+    rows = []
+    for group,(key,members) in enumerate(groupPoints(points).items()):
+        rows.extend(runGroup(base,config,parameters,group,json.loads(key),members,workers))
+    rows.sort(key=lambda row: (row[0],row[len(parameters)+1]))
+    return {"columns":sweepColumns(parameters,base["dimensions"]),"rows":rows}
+
+def sweepColumns(parameters,dimensions):
+    """Returns the column names of the results table of runParameterSweep"""
+    axes = 'xyz'[0:dimensions]
+    return (['point']+list(parameters)+['particle']+[axis+'0' for axis in axes]+list(axes)+
+            ['repeatCnt','event','eventTime'])
+
+def runGroup(base,config,parameters,group,overrides,members,workers=None):
+    """Simulates one group of sweep points as one particle batch, returns its rows of the results table
+
+    Args:
+        base : allData of the unmodified config (dataHandler.setupData)
+        config : unmodified config dictionary
+        parameters : list of the swept dotted config paths, in column order
+        group : integer index of the group (or JobQueue job), names its trajectoryDirectory
+        overrides : list of (name,value) group overrides (see groupPoints)
+        members : list of (pointIndex,point) of the group
+        workers : integer number of processes per simulation (defaults to config.workers)
+    """
+    allData, cf = groupData(base,config,overrides)
+    particleData = dataHandler.dataFromFile(cf["file_locations"]["particleFile"])
+    batch = []
+    for pointIndex,point in members:
+        particleList = pointParticles(particleData,cf,base["dimensions"],pointIndex,point)
+        batch.append((pointIndex,point,particleList,[particle.position.copy() for particle in particleList]))
+    allData["particleList"] = [particle for pointIndex,point,particleList,starts in batch for particle in particleList]
+    if allData["output"].get("trajectoryDirectory"):
+        allData["output"] = dict(allData["output"],trajectoryDirectory=join(allData["output"]["trajectoryDirectory"],'group%03d' % group))
+    simulator.startSimulation(allData,workers)
+    rows = []
+    for pointIndex,point,particleList,starts in batch:
+        for index,(particle,start) in enumerate(zip(particleList,starts)):
+            rows.append([pointIndex]+[point[name] for name in parameters]+[index]+list(start)+list(particle.position)+
+                        [particle.repeatCnt,particle.event,particle.eventTime])
+    return rows
+
+def writeResultsTable(table,fileName):
+    """Writes the results table of runParameterSweep as a .csv file with a header line"""
+    with open(fileName,'wb') as outFile:
+        writer = csv.writer(outFile)
+        writer.writerow(table["columns"])
+        for row in table["rows"]:
+            writer.writerow(['' if value is None else value for value in row])
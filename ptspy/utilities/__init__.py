@@ -1 +1,5 @@
-from dataHandler import Data
\ No newline at end of file
+from dataHandler import Data
+from dataHandler import FieldGrid
+from dataHandler import FieldGrid3D
+from dataHandler import FieldMesh
+from particleGenerator import ParticleGenerator
@@ -1,16 +1,38 @@
 import json
+import re
+from glob import glob
+from itertools import islice
+from os import chmod
+from os import close
+from os import remove
+from os import rename
+from os.path import basename
+from os.path import dirname
+from os.path import isfile
+from os.path import join
+from hashlib import sha1
+from tempfile import mkstemp
 
 from ptspy.physical import Fluid
 from ptspy.physical import Forces
 from ptspy.physical import Particle
 from ptspy.physical import PhysicalConstants
 from ptspy.simulator import Time
+from ptspy.simulator.profiler import profiler
+from ptspy.simulator.barycentricInterpolation import delaunayTriangles
 from ptspy.plot import Plot
+from ptspy.utilities.particleGenerator import ParticleGenerator
 
 from numpy import array
+from numpy import diff
 from numpy import isnan
-from numpy import zeros
-from numpy import insert
+from numpy import hstack
+from numpy import fromstring
+from numpy import flatnonzero
+from numpy import load
+from numpy import save
+from numpy import unique
+from numpy.lib.format import open_memmap
 
 class Data:
     """2D Vector field data object. 
@@ -25,11 +47,186 @@ class Data:
             dataArray : numpy.array of the column vectors from the .txt or .csv file
             XQuiverLength : integer of the number of elements for the quiver in X direction
         """
-        self.quiver = array(chunks(dataArray.tolist(),XQuiverLength))
-        self.quiver[isnan(self.quiver)] = 0
         self.trace = dataArray
-        self.trace[isnan(self.trace)] = 0
-        self.trace = self.trace.tolist()
+        nanMask = isnan(self.trace)
+        if nanMask.any():
+            self.trace[nanMask] = 0
+        self.quiver = self.trace.reshape(-1,XQuiverLength)
+        
+class GridAxis:
+    """Grid parameters of one axis (same names as the X and Y Data objects, without quiver and trace).
+    
+    Attributes:
+        quiverLength : integer of grid points along the axis (including virtual tiles)
+        minValue : first grid coordinate
+        maxValue : last grid coordinate (including virtual tiles)
+        gridSpacing : distance between grid points
+        baseLength : integer of grid points stored in memory (one tile)
+        period : offset between tiles (0 if the axis isn't tiled)
+        tiles : integer number of virtual tiles (defaults to 1)
+    """
+    def __init__(self,quiverLength,minValue,maxValue,gridSpacing,baseLength=None,period=0.,tiles=1):
+        self.quiverLength = quiverLength
+        self.minValue = minValue
+        self.maxValue = maxValue
+        self.gridSpacing = gridSpacing
+        self.baseLength = quiverLength if baseLength is None else baseLength
+        self.period = period
+        self.tiles = tiles
+        
+class FieldGrid:
+    """Uniform 2D field grid owning one contiguous float array per field and the grid metadata.
+    
+    Only one tile of the field is stored. Repeating the channel in X (config.multiplyFieldX) is virtual:
+    the interpolators map grid index i to stored column i % X.baseLength and shift its x coordinate by
+    (i // X.baseLength)*X.period, so memory stays the same for any number of repeats.
+    
+    Attributes:
+        table : numpy.array (or memmap) of shape (6,nodes) with rows [X,Y,U,V,gradE2X,gradE2Y] (U,V scaled)
+        fields : dictionary of field name to its row of table
+        shape : (YQuiverLength,XQuiverLength) of the stored tile
+        X : GridAxis for X, quiverLength/maxValue cover every tile
+        Y : GridAxis for Y
+        coordinates : np.array([[x1,x2,x3,...],[y1,y2,y3,...]]) of the stored tile
+        velocity : np.array([[x1,y1],[x2,y2],[x3,y3]...]) of the stored tile
+        gradE2 : np.array([[x1,y1],[x2,y2],[x3,y3]...]) of the stored tile
+    """
+    fieldNames = ['X','Y','U','V','gradE2X','gradE2Y']
+    
+    def __init__(self,table,XQuiverLength,YQuiverLength,tilesX=1):
+        """
+        Args:
+            table : numpy.array (or memmap) of shape (6,nodes) with rows [X,Y,U,V,gradE2X,gradE2Y]
+            XQuiverLength : integer of elements in X direction of the stored tile
+            YQuiverLength : integer of elements in Y direction
+            tilesX : integer number of virtual repeats in X (defaults to 1)
+        """
+        self.table = table
+        self.fields = dict(zip(self.fieldNames,table))
+        self.shape = (YQuiverLength,XQuiverLength)
+        x, y = table[0], table[1]
+        period = x.max()+x.min()
+        self.X = GridAxis(XQuiverLength*tilesX,x.min(),x.max()+(tilesX-1)*period,abs(x[1]-x[0]),
+                          baseLength=XQuiverLength,period=period,tiles=tilesX)
+        self.Y = GridAxis(YQuiverLength,y.min(),y.max(),abs(y[XQuiverLength]-y[0]))
+        self.coordinates = table[0:2]
+        self.velocity = table[2:4].T
+        self.gradE2 = table[4:6].T
+        
+    def tiledQuiver(self,name):
+        """Returns a new numpy.array of shape (YQuiverLength,X.quiverLength) of a field repeated over every tile
+        
+        Args:
+            name : field name in FieldGrid.fieldNames
+        """
+        quiver = self.fields[name].reshape(self.shape)
+        if name == 'X':
+            return hstack([quiver+tile*self.X.period for tile in range(self.X.tiles)])
+        return hstack([quiver]*self.X.tiles)
+    
+    def tiledData(self):
+        """Returns Data objects [X,Y,U,V,gradE2X,gradE2Y] of the tiled field (copies, eg. for vector field plots)"""
+        holdClasses = [Data(self.tiledQuiver(name).ravel(),self.X.quiverLength) for name in self.fieldNames]
+        buildParameters(holdClasses[0],holdClasses[1],self.X.quiverLength,self.Y.quiverLength)
+        return holdClasses
+        
+class FieldGrid3D:
+    """Uniform 3D field grid stored as one memory-mapped (nodes,9) table.
+    
+    Every node is one row [X,Y,Z,U,V,W,gradE2X,gradE2Y,gradE2Z] (X fastest, then Y, then Z), so the
+    interpolator gathers the 6 field values of a node from one place and only the pages of the
+    cells that particles visit are read from disk. Fields larger than RAM never have to be loaded whole.
+    
+    Attributes:
+        table : numpy.memmap of shape (nodes,9)
+        shape : (ZQuiverLength,YQuiverLength,XQuiverLength)
+        X, Y, Z : GridAxis of every axis
+        coordinates : np.array([[x1,x2,x3,...],[y1,y2,y3,...],[z1,z2,z3,...]]) view of table
+        fields : view of table of shape (nodes,6) with the stacked [velocity,gradE2] channels
+        channels : dictionary of field name to its slice of columns in fields
+        velocity : np.array([[x1,y1,z1],[x2,y2,z2],...]) view of table
+        gradE2 : np.array([[x1,y1,z1],[x2,y2,z2],...]) view of table
+    """
+    fieldNames = ['X','Y','Z','U','V','W','gradE2X','gradE2Y','gradE2Z']
+    channels = {'velocity':slice(0,3),'Efield':slice(3,6)}
+    
+    def __init__(self,table,XQuiverLength,YQuiverLength,ZQuiverLength):
+        """
+        Args:
+            table : numpy.memmap (or numpy.array) of shape (nodes,9)
+            XQuiverLength : integer of elements in X direction
+            YQuiverLength : integer of elements in Y direction
+            ZQuiverLength : integer of elements in Z direction
+        """
+        self.table = table
+        self.shape = (ZQuiverLength,YQuiverLength,XQuiverLength)
+        self.buildViews()
+        # Grid is sorted X fastest, so the axis ends are the first and last node along every axis
+        last = [XQuiverLength-1,XQuiverLength*(YQuiverLength-1),XQuiverLength*YQuiverLength*(ZQuiverLength-1)]
+        step = [1,XQuiverLength,XQuiverLength*YQuiverLength]
+        axes = []
+        for axis,length in enumerate([XQuiverLength,YQuiverLength,ZQuiverLength]):
+            first, end = table[0,axis], table[last[axis],axis]
+            spacing = abs(table[step[axis],axis]-first) if length > 1 else 0.
+            axes.append(GridAxis(length,min(first,end),max(first,end),spacing))
+        self.X, self.Y, self.Z = axes
+        
+    def buildViews(self):
+        self.coordinates = self.table[:,0:3].T
+        self.fields = self.table[:,3:9]
+        self.velocity = self.table[:,3:6]
+        self.gradE2 = self.table[:,6:9]
+        
+    def __getstate__(self):
+        """A memory-mapped table is pickled as its file name (eg. for worker processes) and mapped again"""
+        state = dict(self.__dict__)
+        for name in ['coordinates','fields','velocity','gradE2']:
+            state.pop(name,None)
+        if getattr(self.table,'filename',None):
+            state['table'] = self.table.filename
+        return state
+        
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        if isinstance(self.table,basestring):
+            self.table = load(self.table,mmap_mode='r')
+        self.buildViews()
+        
+class FieldMesh:
+    """Scattered 2D field nodes (unstructured or non-uniform, eg. a COMSOL mesh refined near the electrodes)
+    with a triangulation, interpolated by simulator.BarycentricInterpolation.
+    
+    Attributes:
+        table : numpy.array (or memmap) of shape (6,nodes) with rows [X,Y,U,V,gradE2X,gradE2Y] (U,V scaled)
+        fields : dictionary of field name to its row of table
+        X : GridAxis of the node bounding box in X (quiverLength is the number of distinct x values)
+        Y : GridAxis of the node bounding box in Y
+        coordinates : np.array([[x1,x2,x3,...],[y1,y2,y3,...]])
+        velocity : np.array([[x1,y1],[x2,y2],[x3,y3]...])
+        gradE2 : np.array([[x1,y1],[x2,y2],[x3,y3]...])
+        triangles : numpy.array of shape (T,3) of node indexes (mesh elements or Delaunay triangles, see getFieldMesh)
+    """
+    fieldNames = FieldGrid.fieldNames
+    
+    def __init__(self,table,triangles=None):
+        """
+        Args:
+            table : numpy.array (or memmap) of shape (6,nodes) with rows [X,Y,U,V,gradE2X,gradE2Y]
+            triangles : numpy.array of shape (T,3) of node indexes (defaults to the Delaunay triangulation)
+        """
+        self.table = table
+        self.fields = dict(zip(self.fieldNames,table))
+        self.X, self.Y = [meshAxis(values) for values in table[0:2]]
+        self.coordinates = table[0:2]
+        self.velocity = table[2:4].T
+        self.gradE2 = table[4:6].T
+        self.triangles = delaunayTriangles(self.coordinates) if triangles is None else triangles
+        
+def meshAxis(values):
+    """Returns the GridAxis of the bounding box of scattered node coordinates (gridSpacing is the smallest spacing)"""
+    distinct = unique(values)
+    spacing = diff(distinct).min() if len(distinct) > 1 else 0.
+    return GridAxis(len(distinct),distinct[0],distinct[-1],spacing)
         
 def getAllData(configFile):
     print "1. Importing and Configurating Data"
@@ -39,10 +236,38 @@ def getAllData(configFile):
 def setupData(cf):
     allData = {}
 
-    allData["X"],allData["Y"],allData["U"],allData["V"],allData["gradE2X"],allData["gradE2Y"],allData["coordinates"],allData["velocity"],allData["gradE2"] = getVectorFieldData(cf["file_locations"]["vectorFieldFile"],cf)
+    # config.profile records per-phase times and counters (see simulator.profiler)
+    profiler.enabled = cf["config"].get("profile","False") == "True"
+    profiler.reset()
+    with profiler.phase('load'):
+        # config.dimensions selects the 2D (bilinear) or 3D (trilinear, memory-mapped) pipeline
+        allData["dimensions"] = cf["config"].get("dimensions",2)
+        if allData["dimensions"] == 3:
+            grid = getFieldGrid3D(cf["file_locations"]["vectorFieldFile"],cf)
+            allData["Z"] = grid.Z
+        elif cf["config"].get("interpolation","bilinear") == "barycentric":
+            # Scattered nodes, the field file doesn't have to be a regular grid
+            grid = getFieldMesh(cf["file_locations"]["vectorFieldFile"],cf)
+        else:
+            grid = getFieldGrid(cf["file_locations"]["vectorFieldFile"],cf)
+        allData["fieldGrid"] = grid
+    with profiler.phase('setup'):
+        setupParameters(allData,cf)
+
+    print "1. Done"
+    return allData
+
+def setupParameters(allData,cf):
+    """Fills allData with the grid views, particles and physical, time, output and plot settings of the config"""
+    grid = allData["fieldGrid"]
+    allData["X"],allData["Y"] = grid.X,grid.Y
+    allData["coordinates"],allData["velocity"],allData["gradE2"] = grid.coordinates,grid.velocity,grid.gradE2
     
     particleData = dataFromFile(cf["file_locations"]["particleFile"])
-    allData["particleList"] = buildParticleList(particleData,cf)
+    if allData["dimensions"] == 3:
+        allData["particleList"] = buildParticleList3D(particleData,cf)
+    else:
+        allData["particleList"] = buildParticleList(particleData,cf)
     
     fluidData = cf["fluid_data"]
     allData["fluid"] = Fluid(
@@ -70,20 +295,67 @@ def setupData(cf):
     allData["time"] = Time(
         start = timeData["start"],
         stop = timeData["stop"],
-        step = timeData["step"])
+        step = timeData["step"],
+        recordStride = timeData.get("recordStride",1))
+    allData["integrator"] = timeData.get("integrator","rk2")
+    allData["rtol"] = timeData.get("rtol",1e-6)
+    allData["atol"] = timeData.get("atol",[1e-9,1e-9])
 
     allData["repeatX"] = cf["config"]["repeatX"]
     allData["repeatY"] = cf["config"]["repeatY"]
+    allData["repeatZ"] = cf["config"].get("repeatZ","False")
+    allData["interpolation"] = cf["config"].get("interpolation","bilinear")
+    if allData["dimensions"] == 3:
+        allData["interpolation"] = "trilinear"
+    allData["workers"] = cf["config"].get("workers",1)
+
+    allData["output"] = cf.get("output_data",{})
+
+    allData["events"] = cf.get("events_data",{})
+    allData["statistics"] = cf.get("statistics_data",{})
+    allData["captureMask"] = None
+    if allData["events"].get("detectEvents","False") == "True" and allData["events"].get("captureMaskFile"):
+        # One value per node of the field file, particles in cells with a value >= 0.5 are captured
+        allData["captureMask"] = dataFromFile(allData["events"]["captureMaskFile"]).ravel()
+
+    allData["injection"] = None
+    if cf.get("injection_data",{}).get("injectParticles","False") == "True":
+        allData["injection"] = buildParticleGenerator(cf["injection_data"],cf)
+    allData["injectionInMemory"] = cf.get("injection_data",{}).get("recordInMemory","False") == "True"
 
     plotData = cf["plot_data"]
     allData["plot"] = Plot(
         plotTrajectory = plotData["plotTrajectory"] == "True",
         plotFields = plotData["plotFields"] == "True",
         scaleX = plotData["scaleX"],
-        scaleY = plotData["scaleY"])
+        scaleY = plotData["scaleY"],
+        lineCollection = plotData.get("lineCollection","True") == "True",
+        decimation = plotData.get("decimation","pixel"),
+        pixelTolerance = plotData.get("pixelTolerance",0.5),
+        maxPoints = plotData.get("maxPoints",0),
+        quiverArrows = plotData.get("quiverArrows",50),
+        outputFile = plotData.get("outputFile",""),
+        show = plotData.get("show","True") == "True")
 
-    print "1. Done"
-    return allData
+def buildParticleGenerator(injectionData,config):
+    """Returns the ParticleGenerator of the injection_data settings (particles from templateFile, or from the distributions)"""
+    template = None
+    if injectionData.get("templateFile"):
+        template = dataFromFile(injectionData["templateFile"])
+    return ParticleGenerator(
+        rate = injectionData["rate"],
+        position = injectionData.get("position"),
+        radius = injectionData.get("radius",1e-5),
+        density = injectionData.get("density",1000.),
+        DEPFactor = injectionData.get("DEPFactor",0.),
+        mass = injectionData.get("mass"),
+        template = template,
+        voltageScale = config["electrode_data"]["voltageScale"],
+        arrivals = injectionData.get("arrivals","uniform"),
+        start = injectionData.get("start",0.),
+        stop = injectionData.get("stop"),
+        maxParticles = injectionData.get("maxParticles",1000),
+        seed = injectionData.get("seed",0))
 
 def buildParticleList(particleData,config):
     # Can modify this function if you want 1000+ particles
@@ -100,29 +372,252 @@ def buildParticleList(particleData,config):
             name = "particle"+str(index)))
     return particleList
 
-def getVectorFieldData(fileName,config):
-    dupe = config["config"]["multiplyFieldX"]
+def buildParticleList3D(particleData,config):
+    """Builds 3D particles from rows of x,y,z,vx,vy,vz,ax,ay,az,radius,density,mass,depFactor"""
+    particleList = []
+    for index,arr in enumerate(particleData):
+        particleList.append(Particle(
+            position = arr[0:3],
+            velocity = arr[3:6],
+            acceleration = arr[6:9],
+            radius = arr[9],
+            density = arr[10],
+            mass = arr[11],
+            DEPFactor = arr[12]*config["electrode_data"]["voltageScale"],
+            name = "particle"+str(index)))
+    return particleList
+
+def getFieldGrid(fileName,config):
+    """Loads the vector field file into a FieldGrid, scales the fluid velocity and repeats it
+    2**multiplyFieldX times in X (virtually, see FieldGrid)
+    
+    The processed field is cached next to the source as a binary table (fileName.cache.<key>.npy, named
+    in fileName.cache.json with its key, the file hash and the scaleX/scaleY settings) and is memory-mapped
+    on later runs instead of reparsing the .csv. Set config.cacheFieldData to "False" to disable.
+    """
+    tilesX = 2**config["config"]["multiplyFieldX"]
     scaleX, scaleY = config["fluid_data"]["scaleX"], config["fluid_data"]["scaleY"]
+    useCache = config["config"].get("cacheFieldData","True") == "True"
+    if useCache:
+        cacheKey = {"sha1":fileHash(fileName),"scaleX":scaleX,"scaleY":scaleY}
+        cached = loadFieldCache(fileName,cacheKey)
+        if cached is not None:
+            table, index = cached
+            return FieldGrid(table,index["XQuiverLength"],index["YQuiverLength"],tilesX)
     fieldData = dataFromFile(fileName)
     X,Y,U,V,gradE2X,gradE2Y = buildData(fieldData)
-    for i in range(0,dupe):
-        doubleFieldXDirection(X,Y,U,V,gradE2X,gradE2Y)
     coordinates, velocity, gradE2 = completeData(X,Y,U,V,gradE2X,gradE2Y,scaleX,scaleY)
-    return X,Y,U,V,gradE2X,gradE2Y,coordinates,velocity,gradE2
+    table = array([X.trace,Y.trace,velocity.T[0],velocity.T[1],gradE2.T[0],gradE2.T[1]])
+    if useCache:
+        writeFieldCache(fileName,cacheKey,table,{"XQuiverLength":X.quiverLength,"YQuiverLength":Y.quiverLength})
+    return FieldGrid(table,X.quiverLength,Y.quiverLength,tilesX)
+
+def getFieldMesh(fileName,config):
+    """Loads a field file of scattered nodes (columns x,y,u,v,gradE2x,gradE2y in any order of rows) into a FieldMesh
+    
+    NaN values are set to 0 and the fluid velocity is scaled by fluid_data scaleX/scaleY. The node table is cached
+    like getFieldGrid's (fileName.cachemesh.<key>.npy/.json) and the triangles next to it (fileName.cachetri.<key>.npy/.json),
+    so later runs memory-map both. The triangles are the mesh elements of file_locations.meshElementsFile if set,
+    otherwise the Delaunay triangulation without the triangles longer than config.maxTriangleEdge (see meshTriangles).
+    config.multiplyFieldX isn't used, repeatX/repeatY wrap particles around the node bounding box.
+    """
+    scaleX, scaleY = config["fluid_data"]["scaleX"], config["fluid_data"]["scaleY"]
+    useCache = config["config"].get("cacheFieldData","True") == "True"
+    elementsFile = config["file_locations"].get("meshElementsFile","")
+    maxEdge = config["config"].get("maxTriangleEdge",0)
+    table = triangles = None
+    if useCache:
+        sourceHash = fileHash(fileName)
+        cacheKey = {"sha1":sourceHash,"scaleX":scaleX,"scaleY":scaleY}
+        triangleKey = {"sha1":sourceHash,"elements":fileHash(elementsFile) if elementsFile else None,"maxTriangleEdge":maxEdge}
+        cached = loadFieldCache(fileName,cacheKey,'.cachemesh')
+        if cached is not None:
+            table = cached[0]
+        cached = loadFieldCache(fileName,triangleKey,'.cachetri')
+        if cached is not None:
+            triangles = cached[0]
+    if table is None:
+        table = dataFromFile(fileName)[:,0:6].T.copy()
+        table[isnan(table)] = 0
+        table[2] *= scaleX
+        table[3] *= scaleY
+        if useCache:
+            writeFieldCache(fileName,cacheKey,table,{"nodes":table.shape[1]},'.cachemesh')
+    if triangles is None:
+        triangles = meshTriangles(table,elementsFile,maxEdge)
+        if useCache:
+            writeFieldCache(fileName,triangleKey,triangles,{"triangles":len(triangles)},'.cachetri')
+    return FieldMesh(table,triangles)
+
+def meshTriangles(table,elementsFile='',maxEdge=0):
+    """Returns the triangles of shape (T,3) of the nodes of a FieldMesh table
+    
+    elementsFile holds the mesh elements, rows of 3 node indexes in the order of the field file (1-based
+    indexes, as exported by COMSOL, are detected by the absence of node 0). The elements keep holes such as
+    electrodes cut out of the domain. Without it the nodes are Delaunay triangulated (which imports matplotlib),
+    covering their convex hull minus the triangles with an edge longer than maxEdge (field units, 0 keeps all).
+    """
+    if not elementsFile:
+        return delaunayTriangles(table[0:2],maxEdge)
+    triangles = dataFromFile(elementsFile)
+    if triangles.ndim != 2 or triangles.shape[1] < 3:
+        raise ValueError("%s doesn't hold rows of 3 node indexes" % elementsFile)
+    triangles = triangles[:,0:3].astype(int)
+    if triangles.min() > 0:
+        triangles -= 1
+    if triangles.min() < 0 or triangles.max() >= table.shape[1]:
+        raise ValueError("%s holds node indexes outside the %d nodes of the field file" % (elementsFile,table.shape[1]))
+    return triangles
+
+def getFieldGrid3D(fileName,config):
+    """Loads a 3D vector field file (columns x,y,z,u,v,w,gradE2x,gradE2y,gradE2z) into a memory-mapped FieldGrid3D
+    
+    The file is parsed in blocks straight into a binary table next to the source (fileName.cache3d.<key>.npy,
+    named in fileName.cache3d.json with its key, the file hash and fluid_data scaleX/scaleY/scaleZ), so neither the text
+    nor the table has to fit in memory. The table is reused while the key matches. repeatX/repeatY/repeatZ
+    wrap particles around the grid, config.multiplyFieldX isn't used in 3D.
+    """
+    fluidData = config["fluid_data"]
+    scales = [fluidData["scaleX"],fluidData["scaleY"],fluidData.get("scaleZ",1)]
+    cacheKey = {"sha1":fileHash(fileName),"scaleX":scales[0],"scaleY":scales[1],"scaleZ":scales[2]}
+    cached = loadFieldCache(fileName,cacheKey,'.cache3d')
+    if cached is None:
+        tableName = cacheTableName(fileName,cacheKey,'.cache3d')
+        lengths = writeFieldTable3D(fileName,tableName,scales)
+        writeFieldCacheIndex(fileName+'.cache3d',cacheKey,lengths,tableName)
+        cached = loadFieldCache(fileName,cacheKey,'.cache3d')
+    table, index = cached
+    return FieldGrid3D(table,index["XQuiverLength"],index["YQuiverLength"],index["ZQuiverLength"])
+
+def writeFieldTable3D(fileName,tableName,scales,blockLines=1 << 18):
+    """Parses a 3D field file block by block into a (nodes,9) .npy table (written atomically), returns the quiver lengths
+    
+    NaN values are set to 0 and the velocity columns are multiplied by scales.
+    """
+    with open(fileName,'r') as inFile:
+        nodes = sum(1 for line in inFile if line.strip() and not line.startswith('%'))
+    temporary = temporaryFile(tableName)
+    table = open_memmap(temporary,mode='w+',dtype=float,shape=(nodes,len(FieldGrid3D.fieldNames)))
+    XQuiverLength, planeLength, row = 0, 0, 0
+    with open(fileName,'r') as inFile:
+        while True:
+            block = list(islice(inFile,blockLines))
+            if not block:
+                break
+            lines = [line.strip() for line in block if line.strip() and not line.startswith('%')]
+            if not lines:
+                continue
+            data = fromstring(','.join(lines),sep=',').reshape(len(lines),-1)
+            data[isnan(data)] = 0
+            data[:,3:6] *= scales
+            table[row:row+len(data)] = data
+            if XQuiverLength == 0:
+                repeats = flatnonzero(table[1:row+len(data),0] == table[0,0])
+                XQuiverLength = int(repeats[0])+1 if len(repeats) > 0 else 0
+            if planeLength == 0:
+                changes = flatnonzero(table[:row+len(data),2] != table[0,2])
+                planeLength = int(changes[0]) if len(changes) > 0 else 0
+            row += len(data)
+    table.flush()
+    del table
+    publishFile(temporary,tableName)
+    # A single X line or Z plane is the whole axis
+    XQuiverLength = XQuiverLength or nodes
+    planeLength = planeLength or nodes
+    return {"XQuiverLength":XQuiverLength,"YQuiverLength":planeLength//XQuiverLength,
+            "ZQuiverLength":nodes//planeLength}
+
+def getVectorFieldData(fileName,config):
+    """Returns X,Y,U,V,gradE2X,gradE2Y,coordinates,velocity,gradE2 of the field with the X repeats copied out in memory"""
+    X,Y,U,V,gradE2X,gradE2Y = getFieldGrid(fileName,config).tiledData()
+    return X,Y,U,V,gradE2X,gradE2Y,array([X.trace,Y.trace]),array([U.trace,V.trace]).T,array([gradE2X.trace,gradE2Y.trace]).T
+
+def fileHash(fileName):
+    """Returns the sha1 hex digest of a file"""
+    digest = sha1()
+    with open(fileName,'rb') as inFile:
+        for block in iter(lambda: inFile.read(1 << 20),b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def loadFieldCache(fileName,cacheKey,suffix='.cache'):
+    """Returns (table,index) with the table memory-mapped and index holding the quiver lengths,
+    or None if the cache is missing or stale"""
+    if not isfile(fileName+suffix+'.json'):
+        return None
+    index = jsonFromFile(fileName+suffix+'.json')
+    if index.get("key") != cacheKey or "table" not in index:
+        return None
+    try:
+        return load(join(dirname(fileName),index["table"]),mmap_mode='r'), index
+    except IOError:
+        # The table of an older key was removed by a newer writer
+        return None
+
+def writeFieldCache(fileName,cacheKey,table,quiverLengths,suffix='.cache'):
+    """Writes the processed field table and its key next to fileName (see writeFieldCacheIndex)"""
+    tableName = cacheTableName(fileName,cacheKey,suffix)
+    temporary = temporaryFile(tableName)
+    with open(temporary,'wb') as outFile:
+        save(outFile,table)
+    publishFile(temporary,tableName)
+    writeFieldCacheIndex(fileName+suffix,cacheKey,quiverLengths,tableName)
+
+def writeFieldCacheIndex(cacheName,cacheKey,quiverLengths,tableName):
+    """Atomically writes cacheName.json with the cache key, the quiver lengths and the name of the cached table
+
+    Every key has its own table file (see cacheTableName) that is published before the index, so a reader
+    never pairs a key with the table of another key. The tables of other keys are removed afterwards.
+    Concurrent writers (eg. sweep workers on a cold cache) write their own temporary files.
+    """
+    index = dict(quiverLengths)
+    index["key"] = cacheKey
+    index["table"] = basename(tableName)
+    temporary = temporaryFile(cacheName+'.json')
+    with open(temporary,'w') as outFile:
+        json.dump(index,outFile)
+    publishFile(temporary,cacheName+'.json')
+    for oldTable in glob(cacheName+'.*.npy'):
+        if oldTable != tableName:
+            try:
+                remove(oldTable)
+            except OSError:
+                pass
+
+def cacheTableName(fileName,cacheKey,suffix='.cache'):
+    """Returns the table file of cacheKey, fileName<suffix>.<hash of cacheKey>.npy"""
+    return '%s%s.%s.npy' % (fileName,suffix,sha1(json.dumps(cacheKey,sort_keys=True)).hexdigest()[0:16])
+
+def temporaryFile(fileName):
+    """Returns the name of a new, unique temporary file next to fileName (readable by everyone, as a published cache)"""
+    handle, temporary = mkstemp(prefix=basename(fileName)+'.',suffix='.tmp',dir=dirname(fileName) or '.')
+    close(handle)
+    chmod(temporary,0644)
+    return temporary
+
+def publishFile(temporary,fileName):
+    """Renames temporary over fileName, if another writer published fileName first its file is kept"""
+    try:
+        rename(temporary,fileName)
+    except OSError:
+        if not isfile(fileName):
+            raise
+        remove(temporary)
 
 def dataFromFile(fileName):
     """Imports data from file with comma separated delimiter (imports .csv or .txt files)
     
+    Lines starting with '%' are comments. The numbers are parsed in one pass by numpy.fromstring.
+    
     Args:
         fileName : string of full file name with path (eg. '/Users/YOURUSERNAME/Documents/FILENAME.txt')
     """
-    allData = []
     with open(fileName, 'r') as file1:
-        for line in file1:
-            if line[0] != '%':
-                lineFloat = [float(num) for num in line.split(',')]
-                allData.append(lineFloat)
-    return array(allData)
+        text = re.sub(r'(?m)^%.*(\n|$)','',file1.read()).strip()
+    if not text:
+        return array([])
+    columns = text.split('\n',1)[0].count(',')+1
+    return fromstring(text.replace('\n',','),sep=',').reshape(-1,columns)
 
 def jsonFromFile(fileName):
     with open(fileName, 'r') as inFile:
@@ -169,46 +664,22 @@ def buildParameters(X,Y,XQuiverLength,YQuiverLength):
         YQuiverLength : integer of elements in Y direction
     """
     X.quiverLength = XQuiverLength
-    X.minValue = min(X.trace)    
-    X.maxValue = max(X.trace)
+    X.minValue = X.trace.min()
+    X.maxValue = X.trace.max()
     X.gridSpacing = abs(X.trace[1]-X.trace[0])
     Y.quiverLength = YQuiverLength
-    Y.minValue = min(Y.trace)
-    Y.maxValue = max(Y.trace)
+    Y.minValue = Y.trace.min()
+    Y.maxValue = Y.trace.max()
     Y.gridSpacing = abs(Y.trace[X.quiverLength]-Y.trace[0])
     
-def doubleFieldXDirection(X,Y,U,V,gradE2X,gradE2Y):
-    objectsList = [Y,U,V,gradE2X,gradE2Y]
-    newQList = []
-    locationIndexes = zeros(X.quiverLength,int)+X.quiverLength    
-    for i in range(len(objectsList)):
-        newQList.append(objectsList[i].quiver)
-        newQList[i] = insert(newQList[i],locationIndexes,newQList[i],axis=1)
-    for i in range(len(objectsList)):
-        objectsList[i].quiver = newQList[i]
-        objectsList[i].trace = newQList[i].flatten()
-
-    #this for X
-    XnewQ = X.quiver    
-    locationIndexes = zeros(X.quiverLength,int)+X.quiverLength
-    XnewQ = insert(XnewQ,locationIndexes,XnewQ+(X.maxValue+X.minValue),axis=1)   
-    X.quiver = XnewQ
-    X.trace = XnewQ.flatten()
-    xquiverlength,yquiverlength = quiverLengths(X.trace)
-    buildParameters(X,Y,xquiverlength,yquiverlength)
-
 def quiverLengths(xTrace):
     """Determines the length of the X and Y coordinates for quiver plots
     
     Args:
         xTrace : numpy.array of Trace of X values
     """
-    xquiverlength = 0
-    firstNum = xTrace[0]
-    for i in range(1,len(xTrace)):
-        if xTrace[i] == firstNum:
-            xquiverlength = i
-            break
+    repeats = flatnonzero(xTrace[1:] == xTrace[0])
+    xquiverlength = int(repeats[0])+1 if len(repeats) > 0 else 0
     if xquiverlength > 0:
         yquiverlength = len(xTrace)/xquiverlength
     else:
@@ -3,4 +3,6 @@ import argparse
 def parseArgs():
     parser = argparse.ArgumentParser(description="Basic Particle Trajectory Simulator for Dielectrophoresis in Microfluidics.")
     parser.add_argument("configFile", type=str, help="The configuration file.")
+    parser.add_argument("--resume", action="store_true", help="Continue from the last checkpoint (output_data.checkpointFile).")
+    parser.add_argument("--headless", action="store_true", help="Only simulate, skip the plots (matplotlib isn't imported).")
     return parser.parse_args()
\ No newline at end of file
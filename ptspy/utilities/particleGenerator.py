@@ -0,0 +1,114 @@
+from numpy import array
+from numpy import ceil
+from numpy import full
+from numpy import nan
+from numpy import pi
+from numpy import zeros
+from numpy.random import RandomState
+from ptspy.physical.particleEnsemble import ParticleEnsemble
+
+class ParticleGenerator:
+    """Continuous injection source, creates particles at the inlet over time (SI units)
+
+    Particles arrive at rate particles per second between start and stop, evenly spaced ("uniform")
+    or as a Poisson process ("poisson"). They are drawn from the rows of a template particle file
+    when template is given, otherwise every property is sampled from its distribution:
+
+        a number : constant value
+        {"distribution":"uniform","low":a,"high":b}
+        {"distribution":"normal","mean":m,"std":s}
+        {"distribution":"lognormal","mean":m,"sigma":s} (mean and sigma of the logarithm)
+        {"distribution":"choice","values":[...],"weights":[...]} (weights default to equal)
+
+    The particles of a step are placed at the start of the step they arrive in, at rest.
+    A run holds at most maxParticles particles in flight, see RungeKuttaIntegrator.integrateInjection.
+
+    Attributes:
+        rate : particles per second
+        position : list of the distribution of every coordinate (eg. [inletX,{"distribution":"uniform",...}])
+        radius, density, DEPFactor : distributions, DEPFactor is multiplied by voltageScale
+        mass : distribution, or None for density*4/3*pi*radius**3
+        template : numpy.array of particle file rows (see dataHandler.buildParticleList), or None
+        arrivals : "uniform" or "poisson"
+        start, stop : injection time window (stop None injects until the end of the run)
+        maxParticles : integer of ensemble slots, the most particles in flight at once
+        seed : integer seed of the random numbers (None for a random seed)
+    """
+    def __init__(self,rate,position=None,radius=1e-5,density=1000.,DEPFactor=0.,mass=None,template=None,voltageScale=1,
+                 arrivals="uniform",start=0.,stop=None,maxParticles=1000,seed=0):
+        self.rate = float(rate)
+        self.position = position if position is not None else [0.,0.]
+        self.radius = radius
+        self.density = density
+        self.DEPFactor = DEPFactor
+        self.mass = mass
+        self.template = template
+        self.voltageScale = voltageScale
+        self.arrivals = arrivals
+        self.start = start
+        self.stop = stop
+        self.maxParticles = int(maxParticles)
+        self.seed = seed
+        self.dimensions = len(self.position) if template is None else (template.shape[1]-4)//3
+        self.reset()
+
+    def reset(self):
+        """Restarts the arrivals and the random numbers, a run calls it before the first step"""
+        self.random = RandomState(self.seed)
+        self.arrived = 0
+
+    def count(self,t,dt):
+        """Returns the integer number of particles arriving in [t,t+dt)"""
+        end = t+dt if self.stop is None else min(t+dt,self.stop)
+        if end <= max(t,self.start) or self.rate <= 0:
+            # Before start or after stop
+            return 0
+        if self.arrivals == "poisson":
+            return self.random.poisson(self.rate*(end-max(t,self.start)))
+        # Arrivals at start+k/rate
+        total = int(ceil((end-self.start)*self.rate))
+        count = max(total-self.arrived,0)
+        self.arrived += count
+        return count
+
+    def generate(self,t,dt):
+        """Returns a ParticleEnsemble of the particles arriving in [t,t+dt) (possibly empty)"""
+        n = self.count(t,dt)
+        d = self.dimensions
+        if self.template is not None:
+            rows = self.template[self.random.randint(0,len(self.template),n)]
+            return ParticleEnsemble(rows[:,0:d],rows[:,d:2*d],rows[:,2*d:3*d],rows[:,3*d],rows[:,3*d+2],
+                                    rows[:,3*d+1],rows[:,3*d+3]*self.voltageScale)
+        positions = array([self.sample(spec,n) for spec in self.position]).T.reshape(n,d)
+        radius = self.sample(self.radius,n)
+        density = self.sample(self.density,n)
+        if self.mass is None:
+            mass = density*(4/3.)*pi*radius**3
+        else:
+            mass = self.sample(self.mass,n)
+        return ParticleEnsemble(positions,zeros((n,d)),zeros((n,d)),radius,mass,density,
+                                self.sample(self.DEPFactor,n)*self.voltageScale)
+
+    def sample(self,spec,n):
+        """Returns numpy.array of shape (n,) drawn from the distribution spec (see ParticleGenerator)"""
+        if not isinstance(spec,dict):
+            return full(n,spec,dtype=float)
+        distribution = spec.get("distribution","uniform")
+        if distribution == "uniform":
+            return self.random.uniform(spec["low"],spec["high"],n)
+        if distribution == "normal":
+            return self.random.normal(spec["mean"],spec["std"],n)
+        if distribution == "lognormal":
+            return self.random.lognormal(spec["mean"],spec["sigma"],n)
+        if distribution == "choice":
+            weights = spec.get("weights")
+            if weights is not None:
+                weights = array(weights,dtype=float)/sum(weights)
+            return array(spec["values"],dtype=float)[self.random.choice(len(spec["values"]),n,p=weights)]
+        raise ValueError("unknown distribution '%s'" % distribution)
+
+    def slotEnsemble(self):
+        """Returns the ParticleEnsemble of maxParticles empty slots (nan positions) the injected particles are written into"""
+        n, d = self.maxParticles, self.dimensions
+        return ParticleEnsemble(full((n,d),nan),zeros((n,d)),zeros((n,d)),zeros(n),zeros(n),zeros(n),zeros(n),
+                                ['slot'+str(i) for i in range(n)])
@@ -12,6 +12,7 @@ setup(name='ptspy',
       description='Particle trajectory simulator for Python.',
       long_description=readme,
       packages=find_packages(),
+      entry_points={'console_scripts':['ptspy = ptspy.__main__:main']},
       classifiers=[
             'Development Status :: 4 - Beta',            
             'Intended Audience :: Scientists/Biomedical Engineers',
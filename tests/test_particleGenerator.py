@@ -0,0 +1,24 @@
+import unittest
+
+from ptspy.utilities.particleGenerator import ParticleGenerator
+
+class ParticleGeneratorCountTest(unittest.TestCase):
+    def generator(self,arrivals):
+        return ParticleGenerator(rate=100,position=[0.,0.],arrivals=arrivals,start=0.,stop=0.1)
+
+    def testPoissonStepPastStop(self):
+        generator = self.generator("poisson")
+        self.assertEqual(generator.count(0.2,0.01),0)
+
+    def testPoissonStepAcrossStop(self):
+        generator = self.generator("poisson")
+        self.assertTrue(generator.count(0.095,0.01) >= 0)
+
+    def testUniformArrivalsEndAtStop(self):
+        generator = self.generator("uniform")
+        counts = [generator.count(k*0.01,0.01) for k in range(75)]
+        self.assertEqual(sum(counts),10)
+        self.assertEqual(sum(counts[10:]),0)
+
+if __name__ == "__main__":
+    unittest.main()